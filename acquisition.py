@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+
+'''
+Wheel acquisition without GUI
+
+Runs a session: uploads parameters to Arduino, starts session, streams data
+from serial to HDF5 file, and finalizes file when Arduino ends session. Used
+by the GUI (wheel.py) and on its own from the command line.
+
+Outline of flow
+1. `Session(parameters)`
+2. `connect(port)` (or open port elsewhere, eg `arduino.Arduino`)
+3. `start(ser, hdf5_filename)`
+4. `poll()` periodically until `finished`; `stop()` to end early
+5. `finalize()`
+
+While recording, Arduino clock is aligned to host clock with pings (see
+`clock_sync`), and latency of each sample from transmit to arrival is
+tracked in `latency`. Both are saved as attributes of the behavior group.
+
+Throughput, queue depths and timings of each pipeline stage are counted in
+`telemetry` (see `telemetry`). Activity over the last second is kept in
+`stats` for display, printed every `telemetry_interval` seconds, and session
+totals are saved as attributes of the behavior group.
+
+Usage:
+    python acquisition.py --port /dev/ttyACM0 --duration 10 --track-period 5 --output data/data.h5
+'''
+
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import sys
+import threading
+import time
+import h5py
+import numpy as np
+import channels
+import clock_sync
+import hdf5_writer
+import protocol
+import ring_buffer
+import serial_link
+import telemetry
+
+
+# Header to print with Arduino outputs
+arduino_head = '  [a]: '
+
+# Serial input codes
+# Data channels (codes, datasets) are declared in `channels`
+code_end = 0
+code_wheel = channels.by_name['wheel'].code
+code_sync = protocol.code_sync
+code_dropped = protocol.code_dropped
+
+
+class Session:
+    writer_class = hdf5_writer.HDF5Writer
+
+    def __init__(self, parameters, cache_size=500, flush_interval=1, flush_rows=10000, swmr=False,
+                 sync_interval=1, telemetry_interval=60, print_arduino=False, verbose=False):
+        # `parameters` must be in same order as `protocol.parameter_names`
+        self.parameters = dict(parameters)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.swmr = swmr
+        self.sync_interval = sync_interval      # Time between clock pings (s); 0 to disable
+        self.telemetry_interval = telemetry_interval    # Time between telemetry logs (s); 0 to disable
+        self.print_arduino = print_arduino
+        self.verbose = verbose
+
+        self.ser = None
+        # Rows of (code, ts, value, host arrival (ns))
+        self.ring_serial = ring_buffer.SampleRing(width=4)
+        self.writer = None
+        self.thread_scan = None
+        self.channels = {channel.code: channel for channel in channels.registry}
+        self.counter = {channel.name: 0 for channel in self.channels.values()}
+        self.unwrappers = {}
+        self.cache = {}
+        self.hdf5_filename = None
+        self.hdf5_grp_name = None
+        self.start_time = None
+        self.arduino_end = None
+        self.arduino_dropped = 0
+        self.finished = False
+        self.clock = clock_sync.ClockSync(interval=sync_interval)
+        self.latency = clock_sync.LatencyStats()
+        self.telemetry = telemetry.Telemetry()
+        self.stats = {}
+        self.last_stats = None
+        self.last_log = None
+
+    def connect(self, port, **kwargs):
+        '''Open serial port and upload parameters
+        Raises `serial.SerialException` or `serial_link.UploadError` on failure
+        (including `serial_link.LinkBudgetError` if samples won't fit in
+        serial bandwidth).
+        '''
+
+        warning = serial_link.check_link_budget(self.parameters)
+        if warning: print(f'Warning: {warning}')
+
+        self.ser = serial_link.open_port(port)
+        echo = (lambda line: sys.stdout.write(arduino_head + line)) if self.print_arduino else None
+        try:
+            serial_link.upload_parameters(
+                self.ser, self.parameters.values(), echo=echo, verbose=self.verbose,
+                baudrate=self.parameters.get('baudrate'), **kwargs
+            )
+        except serial_link.UploadError:
+            self.ser.close()
+            raise
+        if self.verbose: print('Parameters uploaded to Arduino')
+
+    def start(self, ser=None, hdf5_filename='data.h5', subject='?', weight=0, code_start='E'):
+        '''Create session in HDF5 file and start Arduino
+        Raises `OSError` if file can't be created.
+        '''
+
+        if ser is not None:
+            self.ser = ser
+        self.hdf5_filename = hdf5_filename
+        self.hdf5_grp_name = create_session_group(
+            hdf5_filename, subject, weight, self.parameters, swmr=self.swmr,
+            channel_list=self.channels.values()
+        )
+
+        # Create cache
+        self.cache = {
+            channel.name: np.zeros((self.cache_size, channel.width), dtype=channel.dtype)
+            for channel in self.channels.values()
+        }
+        for ev in self.counter: self.counter[ev] = 0
+        self.unwrappers = {code: channel.unwrapper() for code, channel in self.channels.items()}
+
+        # Keep file open in background for session
+        self.writer = self.writer_class(
+            self.hdf5_filename,
+            datasets=[f'{self.hdf5_grp_name}/{channel.dataset}' for channel in self.channels.values()],
+            flush_interval=self.flush_interval, flush_rows=self.flush_rows,
+            swmr=self.swmr, verbose=self.verbose
+        )
+        # Reset rather than replace, since others (eg live view) may hold it
+        self.telemetry.reset()
+        self.stats = {}
+        self.last_stats = self.last_log = self.telemetry.start
+        self.writer.telemetry = self.telemetry
+        self.writer.start()
+
+        # Clear buffers
+        self.ring_serial.clear()
+        self.arduino_end = None
+        self.arduino_dropped = 0
+        self.finished = False
+        self.clock = clock_sync.ClockSync(interval=self.sync_interval)
+        self.latency = clock_sync.LatencyStats()
+
+        # Create thread to scan serial
+        self.thread_scan = threading.Thread(target=self.scan)
+        self.thread_scan.daemon = True
+
+        # Start session
+        self.ser.reset_input_buffer()                                   # Remove data from serial input
+        self.ser.write(code_start.encode())
+        self.thread_scan.start()
+
+        self.start_time = datetime.now()
+        print('Session start {}'.format(self.start_time))
+
+    def scan(self):
+        '''Scan serial until Arduino ends session (runs in own thread)'''
+
+        suppress = [
+            # code_wheel
+        ]
+        scan_serial(
+            self.ring_serial, self.ser, self.print_arduino,
+            suppress, code_end, self.parameters.get('binary_frames', 0), self.telemetry
+        )
+
+    def stop(self):
+        '''Ask Arduino to end session
+        Keep polling until `finished`.
+        '''
+
+        self.ser.write('0'.encode())
+        print('Stop triggered, sending signal to Arduino...')
+
+    def poll(self):
+        '''Record data received since last poll
+        Returns dict of new rows (see `channels.Channel.columns`) for each
+        channel, by name. Sets `finished` when Arduino ends session.
+        '''
+
+        t0 = time.perf_counter()
+        self.telemetry.gauge('ring_depth', len(self.ring_serial))
+        self.telemetry.gauge('ring_dropped', self.ring_serial.dropped)
+
+        # Take everything pending at once. Otherwise, a backlog will grow.
+        samples = self.ring_serial.pop_all()
+        self.telemetry.gauge('tick_rows', len(samples))
+        ix_end = np.flatnonzero(samples[:, 0] == code_end)
+        if len(ix_end):
+            self.arduino_end = int(samples[ix_end[0], 1])
+            samples = samples[:ix_end[0]]
+            self.finished = True
+        groups = channels.route(samples)
+
+        # Clock alignment
+        for ts, arrival in groups.get(code_sync, np.zeros((0, 4)))[:, [1, 3]].tolist():
+            self.clock.reply(ts, arrival / 1e9)
+        if self.sync_interval and not self.finished:
+            try:
+                self.clock.ping(self.ser)
+            except OSError as err:
+                # Port may close before end code is read; keep reading what arrived
+                print(f'Warning: could not ping Arduino, stopping clock alignment: {err}')
+                self.sync_interval = 0
+
+        # Samples Arduino couldn't send
+        if code_dropped in groups:
+            dropped = int(groups[code_dropped][:, 2].sum())
+            self.arduino_dropped += dropped
+            print(f'Warning: Arduino dropped {dropped} samples (serial output full)')
+
+        new = {}
+        for code, rows in groups.items():
+            channel = self.channels.get(code)
+            if channel is None: continue
+            event_samples = rows[:, 1:1 + channel.width]
+            if self.unwrappers.get(code):
+                event_samples = self.unwrappers[code](event_samples)
+            if self.clock.ready:
+                self.latency.add(rows[:, 3] / 1e9 - self.clock.to_host(event_samples[:, 0] / channel.ts_per_ms))
+
+            # Record data to cache
+            self.cache_samples(channel.name, event_samples)
+            new[channel.name] = event_samples
+
+        self.telemetry.timing('tick', time.perf_counter() - t0)
+        now = time.monotonic()
+        if now - self.last_stats >= 1:
+            self.last_stats = now
+            self.stats = self.telemetry.report()
+            if self.telemetry_interval and now - self.last_log >= self.telemetry_interval:
+                self.last_log = now
+                print('Telemetry: ' + self.telemetry.format(self.stats, sep=', '))
+
+        return new
+
+    def cache_samples(self, event_var, samples):
+        '''Record samples to cache
+        Sends cache to HDF5 writer each time it fills.
+        '''
+
+        cache = self.cache[event_var]
+        while len(samples):
+            event_n = self.counter[event_var]
+            cache_n = event_n % self.cache_size
+            n = min(len(samples), self.cache_size - cache_n)
+            cache[cache_n:cache_n + n, :] = samples[:n]
+            self.counter[event_var] = event_n + n
+            samples = samples[n:]
+
+            # Record data to HDF5 when cache fills
+            if cache_n + n >= self.cache_size:
+                self.writer.append(f'{self.hdf5_grp_name}/behavior/{event_var}', cache)
+
+    def finalize(self, notes='', end_time=None):
+        '''Write remaining data and attributes, and close file
+        Returns error from writing file (None if successful).
+        '''
+
+        end_time = end_time or datetime.now().strftime('%H:%M:%S')
+
+        # Write remainder of cache
+        for ev in self.counter:
+            cache_n = self.counter[ev] % self.cache_size
+            if cache_n:
+                self.writer.append(f'{self.hdf5_grp_name}/behavior/{ev}', self.cache[ev][:cache_n, :])
+
+        # Write attributes and notes, then close file
+        self.writer.close(attrs={
+            f'{self.hdf5_grp_name}/behavior': {
+                'start_time': self.start_time.strftime('%H:%M:%S'),
+                'end_time': end_time,
+                'arduino_end': self.arduino_end if self.arduino_end is not None else -1,
+                'arduino_dropped': self.arduino_dropped,
+                **self.clock.attrs(),
+                **self.latency.attrs(),
+                **self.telemetry.attrs(),
+            },
+            self.hdf5_grp_name: {
+                'notes': notes,
+            },
+        })
+        return self.writer.error
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+
+
+def create_session_group(hdf5_filename, subject='?', weight=0, parameters={}, swmr=False, channel_list=None):
+    '''Create group and datasets for session in HDF5 file
+    Group is named `subject/date`. If group already exists, a number is
+    appended to name. A dataset is created for each of `channel_list`
+    (default: all in `channels.registry`). Returns name of group.
+    '''
+
+    # Live reading (SWMR) requires latest file format
+    file_kwargs = {'libver': 'latest'} if swmr else {}
+    now = datetime.now()
+
+    # Create file if it doesn't already exist, append otherwise ('a' parameter)
+    with h5py.File(hdf5_filename, 'a', **file_kwargs) as hdf5_file:
+        # Create group for experiment
+        date = str(now.date())
+        index = 0
+        file_index = ''
+        while True:
+            try:
+                hdf5_grp_exp = hdf5_file.create_group(f'{subject}/{date + file_index}')
+            except (RuntimeError, ValueError):
+                index += 1
+                file_index = '-' + str(index)
+            else:
+                break
+        hdf5_grp_name = f'{subject}/{date + file_index}'
+        hdf5_grp_exp['weight'] = weight
+
+        # *** Create file structure ***
+        # Datasets start empty and grow as data is written
+        hdf5_grp_behav = hdf5_grp_exp.create_group('behavior')
+        for channel in channel_list or channels.registry:
+            dataset = hdf5_writer.create_growable_dataset(
+                hdf5_grp_behav, channel.name, track_period=parameters.get('track_period', 1),
+                width=channel.width, dtype=channel.dtype
+            )
+            dataset.attrs['columns'] = list(channel.columns)
+
+        # Store session parameters into behavior group
+        for key, value in parameters.items():
+            hdf5_grp_behav.attrs[key] = value
+
+    return hdf5_grp_name
+
+
+def scan_serial(ring_serial, ser, print_arduino=False, suppress=[], code_end=0, binary=False, telemetry=None):
+    '''Check serial for data
+    Continually check serial connection for data sent from Arduino. Send data
+    through ring buffer to communicate with main thread. Stop when `code_end`
+    is received from serial.
+
+    Data is read in chunks of whatever is waiting on the serial port and
+    decoded in bulk (see `protocol`). Each chunk is added to ring buffer as an
+    (N, 4) array of (code, ts, value, arrival), where arrival is host
+    `time.monotonic_ns()` when chunk was read. If `binary`, data is expected
+    as binary frames; otherwise as comma-separated lines. Bytes, samples and
+    bytes that could not be decoded are counted in `telemetry`, if given.
+    '''
+
+    decoder = protocol.FrameDecoder() if binary else protocol.AsciiDecoder()
+
+    if print_arduino: print('  Scanning Arduino outputs.')
+    while 1:
+        # Block for first byte (up to serial timeout), then take everything waiting
+        input_arduino = ser.read(max(ser.in_waiting, 1))
+        if not input_arduino: continue
+        arrival = time.monotonic_ns()
+
+        samples, junk = decoder.feed(input_arduino)
+        if telemetry:
+            telemetry.count('serial_bytes', len(input_arduino))
+            telemetry.count('serial_samples', len(samples))
+            telemetry.count('serial_junk_bytes', len(junk))
+        if print_arduino and junk:
+            # Data that could not be decoded
+            sys.stdout.write(arduino_head + junk.decode(errors='replace'))
+        if not len(samples): continue
+
+        # Drop anything after end code
+        ix_end = np.flatnonzero(samples[:, 0] == code_end)
+        if len(ix_end):
+            samples = samples[:ix_end[0] + 1]
+
+        if print_arduino:
+            # Only print from serial if code is not in list of codes to suppress
+            printed = samples[~np.isin(samples[:, 0], suppress)]
+            sys.stdout.writelines(
+                arduino_head + ','.join(str(x) for x in sample) + '\n'
+                for sample in printed.tolist()
+            )
+        ring_serial.push(np.column_stack([samples, np.full(len(samples), arrival)]))
+
+        if len(ix_end):
+            if print_arduino: print('  Scan complete.')
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record wheel session without GUI')
+    parser.add_argument('--port', required=True, help='Serial port or pyserial URL')
+    parser.add_argument('--duration', type=int, default=1, help='Session duration (min)')
+    parser.add_argument('--track-period', type=int, default=50, help='Track period (ms)')
+    parser.add_argument('--output', default=None, help='HDF5 file (default: data/data-<date>.h5)')
+    parser.add_argument('--subject', default='?')
+    parser.add_argument('--weight', type=int, default=0, help='Weight (g)')
+    parser.add_argument('--notes', default='')
+    parser.add_argument('--no-zeros', action='store_true', help="Don't record samples without movement")
+    parser.add_argument('--ascii', action='store_true', help='Receive ASCII lines instead of binary frames')
+    parser.add_argument('--emulate-wheel', action='store_true')
+    parser.add_argument('--baudrate', type=int, default=115200, choices=protocol.baudrates)
+    parser.add_argument('--camera-fps', type=int, default=0, help='Record camera strobe on pin 8, expected frame rate (0 to disable)')
+    parser.add_argument('--send-period', type=int, default=10, help='Max time Arduino holds samples to send together (ms)')
+    parser.add_argument('--decode-mode', type=int, default=1, choices=protocol.decode_modes,
+                        help='Encoder counts per cycle (4: every edge of both channels)')
+    parser.add_argument('--cache-size', type=int, default=500)
+    parser.add_argument('--flush-interval', type=float, default=1, help='Max seconds between HDF5 flushes')
+    parser.add_argument('--flush-rows', type=int, default=10000, help='Max rows written between HDF5 flushes')
+    parser.add_argument('--swmr', action='store_true', help='Allow other processes to read HDF5 file while recording')
+    parser.add_argument('--telemetry-interval', type=float, default=60, help='Seconds between pipeline telemetry logs (0 to disable)')
+    parser.add_argument('--print-arduino', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    output = args.output
+    if not output:
+        os.makedirs('data', exist_ok=True)
+        output = 'data/data-' + datetime.now().strftime('%y%m%d-%H%M%S') + '.h5'
+
+    # IMPORTANT: keep in same order as `GetParams()` in track_wheel.ino
+    parameters = {
+        'emulate_wheel': int(args.emulate_wheel),
+        'session_dur': args.duration,
+        'record_zeros': int(not args.no_zeros),
+        'track_period': args.track_period,
+        'binary_frames': int(not args.ascii),
+        'baudrate': args.baudrate,
+        'camera_fps': args.camera_fps,
+        'send_period': args.send_period,
+        'decode_mode': args.decode_mode,
+    }
+    session = Session(
+        parameters, cache_size=args.cache_size,
+        flush_interval=args.flush_interval, flush_rows=args.flush_rows, swmr=args.swmr,
+        telemetry_interval=args.telemetry_interval, print_arduino=args.print_arduino, verbose=args.verbose
+    )
+
+    try:
+        session.connect(args.port)
+    except Exception as err:
+        sys.exit(f'Error connecting to Arduino: {err}')
+    print('Parameters uploaded to Arduino')
+
+    session.start(hdf5_filename=output, subject=args.subject, weight=args.weight)
+    end_time = session.start_time + timedelta(minutes=args.duration)
+    print(f"Recording to {output} ({session.hdf5_grp_name}) until {end_time.strftime('%H:%M:%S')}")
+
+    # Rate to poll data
+    refresh_rate = 0.05
+    stop_sent = False
+    last_report = time.monotonic()
+    while not session.finished:
+        try:
+            time.sleep(refresh_rate)
+            session.poll()
+            if time.monotonic() - last_report >= 10:
+                last_report = time.monotonic()
+                p50, p99 = session.latency.live()
+                latency = f', latency p50 {p50:.1f} ms, p99 {p99:.1f} ms' if p50 is not None else ''
+                print(f"  {session.counter['wheel']} samples{latency}")
+        except KeyboardInterrupt:
+            if stop_sent:
+                print('Stopping without end signal from Arduino')
+                break
+            session.stop()
+            stop_sent = True
+
+    end_time = datetime.now().strftime('%H:%M:%S')
+    print('Session ended at ' + end_time)
+    session.close()
+    error = session.finalize(notes=args.notes, end_time=end_time)
+    if error:
+        sys.exit(f'Error saving data: {error}')
+    print(f"Saved {session.counter['wheel']} samples")
+
+
+if __name__ == '__main__':
+    main()
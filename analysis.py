@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+'''
+Batch analysis of wheel sessions
+
+Turns `behavior/wheel` rows of (ts, count) into:
+
+- velocity (cm/s): counts binned every `bin_ms`, converted with wheel geometry
+  and smoothed with a `smooth_ms` boxcar
+- position (cm): net distance, forward minus backward
+- distance (cm): total distance run in either direction
+- running bouts: speed crosses `on_speed` to start a bout and drops below
+  `off_speed` to end it (hysteresis), keeping bouts at least `min_bout_ms` long
+
+and resamples these onto other timestamps, eg camera frames.
+
+Counts per revolution are those of the encoder in 1x decoding; sessions
+recorded in 4x mode (`decode_mode` attribute) are scaled to match. Datasets
+are streamed chunk by chunk, and every step works on whole arrays, so a
+session takes about as long as reading it. Files are processed in parallel
+(`--workers`), one file per process.
+
+For each session, results are saved to `<output>/<file>-<session>-wheel.npz`
+and one row per session is added to `<output>/summary.csv`.
+
+Usage:
+    python analysis.py data/*.h5 --diameter 15.2 --cpr 360 --output results
+'''
+
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import os
+import h5py
+import numpy as np
+from export import iter_chunks
+from live_reader import find_sessions
+
+
+# Wheel used on rigs; override with --diameter and --cpr
+wheel_geometry = {
+    'diameter': 15.2,       # Diameter of running surface (cm)
+    'cpr': 360,             # Encoder counts per revolution (1x decoding)
+}
+
+summary_fields = [
+    'file', 'session', 'duration_s', 'distance_cm', 'net_cm', 'mean_speed', 'max_speed',
+    'running_fraction', 'bouts', 'encoder_errors', 'camera_frames', 'error',
+]
+
+
+def cm_per_count(diameter, cpr, decode_mode=1):
+    return np.pi * diameter / (cpr * decode_mode)
+
+
+def bin_counts(dataset, bin_ms, chunk_rows=None):
+    '''Sum counts of wheel dataset in bins of `bin_ms`
+    Returns net and absolute counts per bin. Bin `i` covers ts from
+    `i * bin_ms` to `(i + 1) * bin_ms`.
+    '''
+
+    if not dataset.shape[0]:
+        return np.zeros(0), np.zeros(0)
+    n_bins = int(dataset[-1, 0]) // bin_ms + 1
+    net = np.zeros(n_bins)
+    total = np.zeros(n_bins)
+    for chunk in iter_chunks(dataset, chunk_rows):
+        bins = np.clip(chunk[:, 0] // bin_ms, 0, n_bins - 1)
+        counts = chunk[:, 1].astype(np.float64)
+        net += np.bincount(bins, weights=counts, minlength=n_bins)
+        total += np.bincount(bins, weights=np.abs(counts), minlength=n_bins)
+    return net, total
+
+
+def smooth(x, n):
+    '''Centered moving average over `n` samples'''
+
+    if n <= 1 or not len(x): return x
+    csum = np.cumsum(np.r_[0., x])
+    half = n // 2
+    hi = np.minimum(np.arange(len(x)) + n - half, len(x))
+    lo = np.maximum(np.arange(len(x)) - half, 0)
+    return (csum[hi] - csum[lo]) / (hi - lo)
+
+
+def hysteresis(x, on, off):
+    '''True from where `x` reaches `on` until it drops below `off`'''
+
+    above = x >= on
+    below = x < off
+    # Each sample takes state of last sample that crossed either threshold
+    ix = np.where(above | below, np.arange(len(x)), -1)
+    last = np.maximum.accumulate(ix) if len(x) else ix
+    return (last >= 0) & above[np.maximum(last, 0)]
+
+
+def find_bouts(running, min_bins=1):
+    '''Start and end (exclusive) bins of runs of True at least `min_bins` long'''
+
+    edges = np.diff(np.r_[0, running.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_bins
+    return starts[keep], ends[keep]
+
+
+class WheelTrace:
+    '''Velocity, position and running state of a session, in bins of `bin_ms`'''
+
+    def __init__(self, net, total, bin_ms, cm_per_count, smooth_ms=100, on_speed=2., off_speed=1.,
+                 min_bout_ms=500):
+        self.bin_ms = bin_ms
+        self.t = np.arange(len(net)) * bin_ms        # Start of each bin (ms)
+        self.position = np.cumsum(net) * cm_per_count
+        self.distance = np.cumsum(total) * cm_per_count
+        self.velocity = smooth(net * cm_per_count / (bin_ms / 1000), int(round(smooth_ms / bin_ms)))
+
+        speed = np.abs(self.velocity)
+        running = hysteresis(speed, on_speed, off_speed)
+        starts, ends = find_bouts(running, int(np.ceil(min_bout_ms / bin_ms)))
+        self.running = np.zeros(len(net), dtype=bool)
+        if len(starts):
+            # Mark bouts with cumulative sum of edges instead of looping over bouts
+            marks = np.zeros(len(net) + 1, dtype=np.int8)
+            marks[starts] = 1
+            marks[ends] = -1
+            self.running = np.cumsum(marks[:-1]) > 0
+
+        # Bouts as rows of (start (ms), end (ms), distance (cm), peak speed (cm/s))
+        dist = np.r_[0., self.distance]
+        bounds = np.column_stack([starts, ends]).ravel()
+        peak = np.maximum.reduceat(np.r_[speed, 0.], bounds)[::2] if len(starts) else np.zeros(0)
+        self.bouts = np.column_stack([
+            starts * bin_ms, ends * bin_ms, dist[ends] - dist[starts], peak
+        ]) if len(starts) else np.zeros((0, 4))
+
+    def resample(self, ts):
+        '''Velocity, position, distance and running state at timestamps `ts` (ms)'''
+
+        ts = np.asarray(ts, dtype=np.float64)
+        centers = self.t + self.bin_ms / 2
+        ends = self.t + self.bin_ms                 # Position is known at end of each bin
+        ix = np.clip(np.searchsorted(self.t, ts, side='right') - 1, 0, max(len(self.t) - 1, 0))
+        return {
+            'velocity': np.interp(ts, centers, self.velocity),
+            'position': np.interp(ts, np.r_[0., ends], np.r_[0., self.position]),
+            'distance': np.interp(ts, np.r_[0., ends], np.r_[0., self.distance]),
+            'running': self.running[ix] if len(self.t) else np.zeros(len(ts), dtype=bool),
+        }
+
+    def summary(self):
+        duration = len(self.t) * self.bin_ms / 1000
+        return {
+            'duration_s': duration,
+            'distance_cm': self.distance[-1] if len(self.t) else 0.,
+            'net_cm': self.position[-1] if len(self.t) else 0.,
+            'mean_speed': self.distance[-1] / duration if duration else 0.,
+            'max_speed': np.abs(self.velocity).max() if len(self.t) else 0.,
+            'running_fraction': self.running.mean() if len(self.t) else 0.,
+            'bouts': len(self.bouts),
+        }
+
+
+def analyze_session(hdf5_file, session, diameter, cpr, bin_ms=None, chunk_rows=None, **kwargs):
+    '''WheelTrace of session in open HDF5 file
+    Defaults to bins of track period, but no shorter than 10 ms.
+    '''
+
+    hdf5_grp_behav = hdf5_file[f'{session}/behavior']
+    attrs = hdf5_grp_behav.attrs
+    if bin_ms is None:
+        bin_ms = max(int(attrs.get('track_period', 10)), 10)
+    scale = cm_per_count(diameter, cpr, int(attrs.get('decode_mode', 1)))
+    net, total = bin_counts(hdf5_grp_behav['wheel'], bin_ms, chunk_rows)
+    return WheelTrace(net, total, bin_ms, scale, **kwargs)
+
+
+def camera_ms(hdf5_grp_behav):
+    '''Timestamps (ms) of camera frames in session, or None if not recorded'''
+
+    if 'camera' not in hdf5_grp_behav or not hdf5_grp_behav['camera'].shape[0]:
+        return None
+    return hdf5_grp_behav['camera'][:, 0] / 1000
+
+
+def process_file(filename, output, geometry, options, camera=True, chunk_rows=None):
+    '''Analyze each session in file and save results
+    Returns summary of each session. Errors are reported in summary instead
+    of raised, so one bad file doesn't stop a batch.
+    '''
+
+    summaries = []
+    base = os.path.join(output, os.path.splitext(os.path.basename(filename))[0])
+    try:
+        with h5py.File(filename, 'r') as hdf5_file:
+            for session in find_sessions(hdf5_file):
+                summary = {'file': filename, 'session': session}
+                try:
+                    trace = analyze_session(hdf5_file, session, chunk_rows=chunk_rows, **geometry, **options)
+                    hdf5_grp_behav = hdf5_file[f'{session}/behavior']
+                    results = {
+                        't': trace.t, 'velocity': trace.velocity, 'position': trace.position,
+                        'distance': trace.distance, 'running': trace.running, 'bouts': trace.bouts,
+                    }
+                    frames = camera_ms(hdf5_grp_behav) if camera else None
+                    if frames is not None:
+                        results['camera_ts'] = frames
+                        for key, value in trace.resample(frames).items():
+                            results[f'camera_{key}'] = value
+                    np.savez(f"{base}-{session.replace('/', '_')}-wheel.npz", **results)
+
+                    summary.update(trace.summary())
+                    errors = hdf5_grp_behav.get('encoder_errors')
+                    summary['encoder_errors'] = int(errors[:, 1].sum()) if errors is not None and errors.shape[0] else 0
+                    summary['camera_frames'] = len(frames) if frames is not None else 0
+                except Exception as err:
+                    summary['error'] = repr(err)
+                summaries.append(summary)
+    except OSError as err:
+        summaries.append({'file': filename, 'error': repr(err)})
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Velocity, distance and running bouts of wheel sessions')
+    parser.add_argument('files', nargs='+', help='HDF5 files')
+    parser.add_argument('--output', default='.', help='Directory for results')
+    parser.add_argument('--diameter', type=float, default=wheel_geometry['diameter'],
+                        help='Wheel diameter (cm)')
+    parser.add_argument('--cpr', type=int, default=wheel_geometry['cpr'],
+                        help='Encoder counts per revolution (1x decoding)')
+    parser.add_argument('--bin', type=int, default=None, dest='bin_ms',
+                        help='Bin size (ms; default: track period, at least 10)')
+    parser.add_argument('--smooth', type=float, default=100, dest='smooth_ms',
+                        help='Width of velocity smoothing (ms)')
+    parser.add_argument('--on-speed', type=float, default=2., help='Speed starting a running bout (cm/s)')
+    parser.add_argument('--off-speed', type=float, default=1., help='Speed ending a running bout (cm/s)')
+    parser.add_argument('--min-bout', type=float, default=500, dest='min_bout_ms',
+                        help='Shortest running bout (ms)')
+    parser.add_argument('--no-camera', action='store_false', dest='camera',
+                        help="Don't resample onto camera frames")
+    parser.add_argument('--workers', type=int, default=None, help='Processes (default: number of CPUs)')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='Rows read per chunk')
+    args = parser.parse_args()
+
+    if args.off_speed > args.on_speed:
+        parser.error('--off-speed must not exceed --on-speed')
+    os.makedirs(args.output, exist_ok=True)
+    geometry = {'diameter': args.diameter, 'cpr': args.cpr}
+    options = {
+        'bin_ms': args.bin_ms, 'smooth_ms': args.smooth_ms, 'on_speed': args.on_speed,
+        'off_speed': args.off_speed, 'min_bout_ms': args.min_bout_ms,
+    }
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(process_file, filename, args.output, geometry, options, args.camera, args.chunk_rows)
+            for filename in args.files
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            for summary in future.result():
+                summaries.append(summary)
+                if summary.get('error'):
+                    print(f"Warning: {summary['file']} {summary.get('session', '')}: {summary['error']}")
+            print(f'{i + 1}/{len(futures)} files', end='\r')
+    print()
+
+    summaries.sort(key=lambda s: (s['file'], s.get('session', '')))
+    filename = os.path.join(args.output, 'summary.csv')
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=summary_fields, restval='')
+        writer.writeheader()
+        writer.writerows(summaries)
+    print(f'Saved {len(summaries)} sessions to {filename}')
+
+
+if __name__ == '__main__':
+    main()
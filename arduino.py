@@ -19,16 +19,16 @@ import tkinter.messagebox as tkMessageBox
 import pathlib
 import sys
 import os
-import time
-from PIL import ImageTk
+import queue
 import serial
-import serial.tools.list_ports
+import startup_profile
+import protocol
+from serial_link import Cancelled, Handshake, LinkBudgetError, PortMonitor, check_link_budget
 
 
-code_last_param = 271828
-
 class Arduino(tk.Frame):
-    def __init__(self, parent, main_window=None, verbose=False, print_arduino=False, params={'a': 1, 'b': 2}):
+    def __init__(self, parent, main_window=None, verbose=False, print_arduino=False, params={'a': 1, 'b': 2}, extra_ports=[],
+                 include_bridges=False):
         super().__init__()   # https://stackoverflow.com/questions/576169/understanding-python-super-with-init-methods
         self.parent = parent
         self.main_window = main_window if main_window else self.parent
@@ -36,9 +36,13 @@ class Arduino(tk.Frame):
         self.print_arduino = '  [a]: ' if print_arduino else False
         self.verbose = verbose
         self.parameters = params
+        self.extra_ports = list(extra_ports)     # eg emulator (see emulator.py)
         self.var_uploaded = tk.BooleanVar(name='uploaded')
 
-        self.ser = serial.Serial(timeout=1, write_timeout=3, baudrate=9600)
+        # Locked while open so port probes (see `serial_link.identify_port`) skip it
+        self.ser = serial.Serial(timeout=1, write_timeout=3, baudrate=protocol.default_baudrate, exclusive=True)
+        self.handshake = None
+        self.callbacks = queue.Queue()     # Callbacks from background threads to run in GUI thread
 
         self.var_port = tk.StringVar()
 
@@ -71,27 +75,37 @@ class Arduino(tk.Frame):
 
         update_icon_file = os.path.join(pathlib.Path(__file__).parent.absolute(), 'graphics/refresh.png')
         if os.path.isfile(update_icon_file):
-            icon_refresh = ImageTk.PhotoImage(file=update_icon_file)
+            icon_refresh = tk.PhotoImage(file=update_icon_file)
             self.button_update_ports.config(image=icon_refresh)
             self.button_update_ports.image = icon_refresh
 
         self.button_close_port['state'] = 'disabled'
         self.entry_serial_status.insert(0, 'Waiting for parameters')
         self.entry_serial_status['state'] = 'readonly'
-        self.update_ports()
+        self.button_open_port['state'] = 'disabled'
+
+        # Watch ports in background; port running firmware is selected
+        # unless user chooses another
+        self.port_selected = False
+        self.ports_listed = False
+        self.port_monitor = PortMonitor(
+            self.show_ports,
+            exclude=lambda device: self.ser.is_open and device == self.ser.port,
+            include_bridges=include_bridges,
+            dispatch=lambda func, arg: self.callbacks.put((func, arg))
+        )
+        self.port_monitor.start()
+        self.run_callbacks()
 
         # if self.ser.isOpen():
         #     self.var_port.set(self.ser.port)
         #     self.gui_util('uploaded')
 
     def gui_util(self, opt):
-        def relabel(label, txt):
-            label['state'] = 'normal'
-            label.delete(0, 'end')
-            label.insert(0, txt)
-            label['state'] = 'readonly'
+        relabel = self.relabel
         if opt == 'upload':
             self.button_open_port['state'] = 'disabled'
+            self.button_close_port['state'] = 'normal'
             relabel(self.entry_serial_status, 'Uploading...')
         elif opt == 'uploaded':
             self.button_open_port['state'] = 'disabled'
@@ -109,106 +123,173 @@ class Arduino(tk.Frame):
             print('Unknown utility option')
         self.parent.update_idletasks()
 
+    def relabel(self, label, txt):
+        label['state'] = 'normal'
+        label.delete(0, 'end')
+        label.insert(0, txt)
+        label['state'] = 'readonly'
 
     def update_ports(self):
-        '''Update available ports'''
+        '''List ports now (ports are otherwise listed every second)'''
+        self.port_monitor.refresh()
+
+    def select_port(self, port):
+        self.var_port.set(port)
+        self.port_selected = True
+        if not (self.ser.is_open or self.handshake is not None):
+            self.update_upload_button()
+
+    def update_upload_button(self):
+        '''Allow upload unless already uploaded or port is being identified
+        Probe holds port with exclusive lock, so upload would fail until it's
+        done; `show_ports` is called again when it is.
+        '''
+        port = self.var_port.get()
+        busy = self.var_uploaded.get() or self.port_monitor.identifying(port)
+        self.button_open_port['state'] = 'disabled' if busy else 'normal'
 
-        # Get available ports
-        ports_info = list(serial.tools.list_ports.comports())
-        ports = [port.device for port in ports_info]
-        ports_description = [port.description for port in ports_info]
+    def show_ports(self, ports):
+        '''Update menu with ports from `port_monitor`'''
+
+        if not self.ports_listed:
+            startup_profile.mark('Ports listed')
+            self.ports_listed = True
+
+        wheel_ports = [device for device, (_, firmware) in ports.items() if firmware]
+        devices = self.extra_ports + list(ports)
+        descriptions = self.extra_ports + [
+            description + (' (wheel)' if firmware else '')
+            for description, firmware in ports.values()
+        ]
 
         # Update GUI
         menu = self.option_ports['menu']
         menu.delete(0, 'end')
-        if ports:
-            for port, description in zip(ports, ports_description):
-                menu.add_command(label=description, command=lambda com=port: self.var_port.set(com))
-            self.var_port.set(ports[0])
-            self.button_open_port['state'] = 'normal'
-        else:
+        for port, description in zip(devices, descriptions):
+            menu.add_command(label=description, command=lambda com=port: self.select_port(com))
+
+        # Keep port while connected
+        if self.ser.is_open or self.handshake is not None: return
+
+        port = self.var_port.get()
+        if port in devices and self.port_selected:
+            pass
+        elif wheel_ports:
+            port = wheel_ports[0]
+        elif port not in devices:
+            port = devices[0] if devices else None
+        if port is None:
             self.var_port.set('No ports found')
             self.button_open_port['state'] = 'disabled'
+        else:
+            self.var_port.set(port)
+            self.update_upload_button()
 
     def settings(self):
         '''Sets serial settings'''
 
         win_settings = tk.Toplevel(self.main_window)
-        tk.Label(win_settings, text='Under construction').grid()
+        win_settings.title('Serial settings')
+        if 'baudrate' not in self.parameters:
+            tk.Label(win_settings, text='No serial settings').grid(padx=15, pady=5)
+            return
+        combo_baudrate = ttk.Combobox(
+            win_settings, textvariable=self.parameters['baudrate'], values=protocol.baudrates, width=10,
+            state='readonly'
+        )
+        tk.Label(win_settings, text='Baud rate: ').grid(row=0, column=0, sticky='e', padx=5, pady=5)
+        combo_baudrate.grid(row=0, column=1, sticky='w', padx=5, pady=5)
+        if self.var_uploaded.get() or self.handshake is not None:
+            combo_baudrate['state'] = 'disabled'
+        ttk.Button(win_settings, text='Close', command=win_settings.destroy).grid(row=1, column=0, columnspan=2, pady=5)
 
     def open_serial(self, delay=3, timeout=10, code_params='D', delim='+'):
         ''' Open serial connection to Arduino
         Executes when 'Open' is pressed
 
         Opens connection via serial. Parameters are sent when connection is 
-        opened with prefix `code_params` and delimited by `delim`
+        opened with prefix `code_params` and delimited by `delim`. Runs in
+        background (see `serial_link.Handshake`) so GUI stays responsive;
+        'Reset' cancels.
         '''
 
+        # Values typed into entries may not be numbers
+        parameters = {}
+        for key, value in self.parameters.items():
+            try:
+                parameters[key] = value.get() if isinstance(value, tk.Variable) else value
+            except tk.TclError:
+                tkMessageBox.showerror('Invalid parameter', f'Invalid value for {key}: {self.parent.getvar(str(value))!r}')
+                return
+
+        # Check samples fit in serial bandwidth
+        if 'track_period' in parameters:
+            try:
+                warning = check_link_budget(parameters)
+            except LinkBudgetError as err:
+                tkMessageBox.showerror('Serial bandwidth', str(err))
+                return
+            if warning:
+                print(f'Warning: {warning}')
+                tkMessageBox.showwarning('Serial bandwidth', warning)
+
         self.gui_util('upload')
 
-        # Open serial
-        self.ser.port = self.var_port.get()
-        try:
-            self.ser.open()
-        except serial.SerialException as err:
+        # New port object each time, since ports can be devices or pyserial
+        # URLs (eg `socket://localhost:5000`), which need different classes
+        self.ser = serial.serial_for_url(
+            self.var_port.get(), do_not_open=True, exclusive=True,
+            timeout=self.ser.timeout, write_timeout=self.ser.write_timeout, baudrate=protocol.default_baudrate
+        )
+
+        # Send parameters to Arduino
+        values = list(parameters.values())
+        echo = (lambda line: sys.stdout.write(self.print_arduino + line)) if self.print_arduino else None
+        self.handshake = Handshake(
+            self.ser, values,
+            on_progress=lambda message: self.relabel(self.entry_serial_status, message),
+            on_success=self.upload_success, on_failure=self.upload_failure,
+            dispatch=lambda func, arg: self.callbacks.put((func, arg)),
+            delay=delay, timeout=timeout, code_params=code_params, delim=delim, echo=echo, verbose=self.verbose,
+            baudrate=parameters.get('baudrate')
+        )
+        self.handshake.start()
+
+    def run_callbacks(self):
+        '''Run callbacks from background threads in GUI thread'''
+
+        while not self.callbacks.empty():
+            func, arg = self.callbacks.get()
+            func(arg)
+        self.main_window.after(20, self.run_callbacks)
+
+    def upload_success(self, ser):
+        self.handshake = None
+        print('Parameters uploaded to Arduino')
+        print('Ready to start')
+        self.gui_util('uploaded')
+
+    def upload_failure(self, err):
+        self.handshake = None
+        if isinstance(err, Cancelled):
+            print('Upload cancelled')
+        elif isinstance(err, serial.SerialException):
             # Error during serial.open()
-            err_msg = err.args[0]
+            err_msg = err.args[0] if err.args else str(err)
             tkMessageBox.showerror('Serial error', err_msg)
             print(f'Serial error: {err_msg}')
-            self.close_serial()
-            return
         else:
-            # Serial opened successfully
-            time.sleep(delay)
-            if self.verbose: print('Connection to Arduino opened')
-
-        # Handle opening message from serial
-        if self.print_arduino:
-            while self.ser.in_waiting:
-                sys.stdout.write(self.print_arduino + self.ser.readline().decode())
-        else:
-            self.ser.flushInput()
+            print(f'Error uploading parameters: {err}')
+        self.close_serial()
 
-        # Send parameters to Arduino
-        values = list(self.parameters.values())
-        if type(values[0]) == tk.IntVar:
-            values = [x.get() for x in values]
-        values.append(code_last_param)
-        ser_msg = code_params + delim.join(str(s) for s in values)
-        if self.verbose: print('Sending parameters as `{}`'.format(ser_msg))
-        try:
-            self.ser.write(ser_msg.encode())
-        except serial.serialutil.SerialTimeoutException:
-            # Write timeout
-            print('Error uploading parameters: write timeout')
-            self.close_serial()
-            return
-
-        # Ensure parameters processed
-        start_time = time.time()
-        while 1:
-            if time.time() >= start_time + timeout:
-                print('Error uploading parameters: start signal not found')
-                self.close_serial()
-                return
-            if self.ser.in_waiting:
-                upload_code = self.ser.readline().decode().rstrip()
-                if self.print_arduino:
-                    # Print incoming data
-                    while self.ser.in_waiting:
-                        sys.stdout.write(self.print_arduino + self.ser.readline().decode())
-                if upload_code != '0':
-                    print(f'Error uploading parameters: exit code {upload_code}')
-                    self.close_serial()
-                    return
-                else:
-                    print('Parameters uploaded to Arduino')
-                    print('Ready to start')
-                    self.gui_util('uploaded')
-                    return
-    
     def close_serial(self):
         ''' Close serial connection to Arduino '''
+
+        # Cancel upload in progress; closes when handshake finishes
+        if self.handshake is not None:
+            self.handshake.cancel()
+            return
+
         print('Closing serial connection')
         self.gui_util('resetting')
         self.ser.close()
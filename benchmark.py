@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+'''
+Benchmark acquisition pipeline
+
+Drives the same stages used during a session from a simulated serial source:
+
+    serial bytes -> scan_serial (reader thread) -> ring buffer
+    -> Session.poll (cache) -> HDF5 writer thread
+                            -> live view (rendered off-screen)
+
+Each run sends samples at a fixed rate for a fixed duration. Reported per run:
+- samples/s sustained, samples dropped
+- CPU time per stage
+- ring buffer depth at each tick
+- latency from byte arrival to HDF5 commit and to pixels (p50/p99)
+
+The rate at which samples start to drop (or can't be sustained) is reported
+for each cache size. Results are saved as JSON.
+
+The sample timestamp is used to carry the sample index so arrival time of
+each sample is known exactly.
+
+Usage:
+    python benchmark.py --rates 100 1000 10000 --cache-sizes 100 500 --output bench.json
+'''
+
+
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import acquisition
+import hdf5_writer
+import live_data_view
+import protocol
+
+
+code_end = acquisition.code_end
+code_wheel = acquisition.code_wheel
+
+
+class SimulatedSerial:
+    '''Serial port that receives samples at `rate` (Hz) in real time
+    Implements the parts of `serial.Serial` used by `acquisition.Session`.
+    Samples start arriving when the start signal is written.
+    '''
+
+    def __init__(self, rate, duration, binary=True, timeout=1):
+        self.rate = rate
+        self.timeout = timeout
+        n = int(rate * duration)
+        samples = np.column_stack([np.full(n + 1, code_wheel), np.arange(n + 1), np.ones(n + 1, dtype=int)])
+        samples[-1] = [code_end, n, 0]
+        if binary:
+            self.data = protocol.encode_frames(samples)
+            self.offsets = np.arange(1, n + 2) * protocol.frame_size
+        else:
+            lines = [b'%d,%d,%d\r\n' % tuple(row) for row in samples.tolist()]
+            self.data = b''.join(lines)
+            self.offsets = np.cumsum([len(line) for line in lines])
+        self.n_samples = n
+        self.pos = 0
+        self.t0 = None
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data):
+        if data == b'E':
+            self.t0 = time.monotonic()
+        return len(data)
+
+    def arrival(self, ix):
+        '''Time samples with index `ix` are received'''
+        return self.t0 + np.asarray(ix) / self.rate
+
+    def bytes_due(self):
+        n_due = min(int((time.monotonic() - self.t0) * self.rate) + 1, len(self.offsets))
+        return int(self.offsets[n_due - 1])
+
+    @property
+    def in_waiting(self):
+        return self.bytes_due() - self.pos
+
+    def read(self, size=1):
+        wait_until = time.monotonic() + self.timeout
+        while self.bytes_due() <= self.pos:
+            if self.pos >= len(self.data) or time.monotonic() >= wait_until:
+                return b''
+            # Data arrives at most once per USB frame (1 ms)
+            time.sleep(min(max(1 / self.rate, 0.001), 0.01))
+        end = min(self.bytes_due(), self.pos + size)
+        data = self.data[self.pos:end]
+        self.pos = end
+        return data
+
+
+class HeadlessCanvas(FigureCanvasAgg):
+    '''Off-screen canvas with the interface `LiveDataView` uses'''
+
+    def __init__(self, figure, parent=None):
+        super().__init__(figure)
+
+    def get_tk_widget(self):
+        return self
+
+    def grid(self, **kwargs):
+        pass
+
+    def draw_idle(self):
+        self.draw()
+
+    def blit(self, bbox=None):
+        pass
+
+
+class HeadlessParent:
+    def after(self, ms, func):
+        pass
+
+
+class TimedWriter(hdf5_writer.HDF5Writer):
+    def run(self):
+        super().run()
+        self.cpu = time.thread_time()
+
+
+class TimedSession(acquisition.Session):
+    writer_class = TimedWriter
+
+    def scan(self):
+        super().scan()
+        self.cpu_reader = time.thread_time()
+
+
+def format_ms(value):
+    return 'n/a' if value is None else f'{value:.0f} ms'
+
+
+def percentiles(values):
+    if not len(values):
+        return {'p50': None, 'p99': None}
+    return {
+        'p50': float(np.percentile(values, 50)) * 1000,
+        'p99': float(np.percentile(values, 99)) * 1000,
+    }
+
+
+def run_pipeline(rate, duration, cache_size, binary=True, refresh_ms=10, fps=30, flush_interval=1, flush_rows=10000):
+    '''Run one session through pipeline and return stats'''
+
+    source = SimulatedSerial(rate, duration, binary=binary)
+    parameters = {
+        'emulate_wheel': 0,
+        'session_dur': duration / 60,
+        'record_zeros': 1,
+        'track_period': 1000 / rate,
+        'binary_frames': int(binary),
+    }
+    session = TimedSession(
+        parameters, cache_size=cache_size,
+        flush_interval=flush_interval, flush_rows=flush_rows
+    )
+
+    # Live view
+    view = live_data_view.LiveDataView(
+        HeadlessParent(), x_history=30 * rate, scale_x=1 / rate,
+        data_types={'wheel': 'line'}, decimate='minmax', fps=fps,
+        canvas_class=HeadlessCanvas, ylim=(-25, 50)
+    )
+    pixel_latency = []
+    n_viewed = 0
+    n_drawn = 0
+
+    # Commit latency
+    commit_latency = []
+    committed = [0]
+    def on_commit(n_rows):
+        t = time.monotonic()
+        n = n_rows[path]
+        if n > committed[0]:
+            commit_latency.append(t - source.arrival(np.arange(committed[0], n)))
+            committed[0] = n
+
+    fd, filename = tempfile.mkstemp(suffix='.h5')
+    os.close(fd)
+    session.start(source, filename, subject='bench')
+    path = f'{session.hdf5_grp_name}/behavior/wheel'
+    session.writer.on_commit = on_commit
+    thread_read = session.thread_scan
+
+    depth = []
+    cpu = {'tick': 0, 'render': 0}
+    frame_interval = 1 / fps
+    next_frame = 0
+
+    t_start = time.monotonic()
+    while not session.finished:
+        time.sleep(refresh_ms / 1000)
+
+        # GUI tick (see `wheel.Main.update_session`)
+        c0 = time.thread_time()
+        depth.append(len(session.ring_serial))
+        rows = session.poll().get('wheel', np.zeros((0, 2)))
+        view.update_view_many(rows, 'wheel')
+        n_viewed += len(rows)
+        cpu['tick'] += time.thread_time() - c0
+
+        # Frame
+        now = time.monotonic()
+        if now >= next_frame and view.dirty:
+            c0 = time.thread_time()
+            view.draw_frame()
+            cpu['render'] += time.thread_time() - c0
+            t = time.monotonic()
+            pixel_latency.append(t - source.arrival(np.arange(n_drawn, n_viewed)))
+            n_drawn = n_viewed
+            next_frame = now + frame_interval
+
+    session.finalize()
+    wall = time.monotonic() - t_start
+    thread_read.join()
+    os.remove(filename)
+
+    commit_latency = np.concatenate(commit_latency) if commit_latency else np.zeros(0)
+    pixel_latency = np.concatenate(pixel_latency) if pixel_latency else np.zeros(0)
+    cpu['reader'] = session.cpu_reader
+    cpu['writer'] = session.writer.cpu
+    n_received = session.counter['wheel']
+    return {
+        'rate': rate,
+        'duration': duration,
+        'cache_size': cache_size,
+        'format': 'binary' if binary else 'ascii',
+        'offered': source.n_samples,
+        'received': n_received,
+        'dropped': source.n_samples - n_received,
+        'sustained_rate': n_received / wall,
+        'wall_time': wall,
+        'cpu_time': cpu,
+        'cpu_percent': {stage: 100 * t / wall for stage, t in cpu.items()},
+        'queue_depth': {'mean': float(np.mean(depth)), 'max': int(np.max(depth))},
+        'latency_commit_ms': percentiles(commit_latency),
+        'latency_pixels_ms': percentiles(pixel_latency),
+    }
+
+
+def drop_onset(runs, max_p99_ms=1000):
+    '''Lowest rate at which samples are dropped or latency exceeds `max_p99_ms`'''
+    for run in sorted(runs, key=lambda run: run['rate']):
+        p99 = run['latency_pixels_ms']['p99']
+        if run['dropped'] or (p99 is not None and p99 > max_p99_ms):
+            return run['rate']
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark acquisition pipeline')
+    parser.add_argument('--rates', type=float, nargs='+', default=[100, 300, 1000, 3000, 10000], help='Sample rates (Hz)')
+    parser.add_argument('--cache-sizes', type=int, nargs='+', default=[500])
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per run')
+    parser.add_argument('--ascii', action='store_true', help='Send ASCII lines instead of binary frames')
+    parser.add_argument('--flush-interval', type=float, default=1)
+    parser.add_argument('--flush-rows', type=int, default=10000)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    matplotlib.use('Agg')
+    results = {
+        'date': datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'runs': [],
+        'drop_onset': {},
+    }
+    for cache_size in args.cache_sizes:
+        runs = []
+        for rate in args.rates:
+            run = run_pipeline(
+                rate, args.duration, cache_size, binary=not args.ascii,
+                flush_interval=args.flush_interval, flush_rows=args.flush_rows
+            )
+            print(
+                f"{rate:>8g} Hz, cache {cache_size:>5}: {run['sustained_rate']:>9.1f} samples/s, "
+                f"dropped {run['dropped']}, max depth {run['queue_depth']['max']}, "
+                f"commit p99 {format_ms(run['latency_commit_ms']['p99'])}, "
+                f"pixels p99 {format_ms(run['latency_pixels_ms']['p99'])}"
+            )
+            runs.append(run)
+        results['runs'] += runs
+        results['drop_onset'][cache_size] = drop_onset(runs)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Saved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''
+Data channels recorded from Arduino
+
+Each event code the Arduino sends as data is declared once here with the
+dataset it is saved to, its columns and dtype, and how it is plotted. Session
+caches, HDF5 datasets, counters and live view series are all created from this
+registry, so adding a channel (eg lick, camera TTL, opto) only needs a new
+entry here and the matching code in track_wheel.ino.
+
+Samples arrive as rows of (code, ts, value, ...). Each tick, rows are split
+by code with one sort (`route`) rather than checking each row, so cost per
+sample doesn't grow with the number of channels.
+
+Counters sent with fewer bits than a session needs (eg microsecond
+timestamps) are unwrapped on the host (`Unwrapper`), so saved values increase
+monotonically.
+
+Kept free of slow imports so the GUI can use it at startup.
+'''
+
+
+import numpy as np
+import protocol
+
+
+class Channel:
+    def __init__(self, code, name, columns=('ts', 'value'), dtype='int32', plot=None, label=None,
+                 wrap=None, ts_per_ms=1):
+        self.code = code            # Event code sent by Arduino
+        self.name = name            # Dataset name in behavior group
+        self.columns = columns      # Saved columns, taken from (ts, value, ...) of each sample
+        self.dtype = dtype
+        self.plot = plot            # Live view series type ('line', 'scatter'), or None
+        self.label = label or name.capitalize()
+        self.wrap = wrap            # Modulus at which each column wraps (None if it doesn't)
+        self.ts_per_ms = ts_per_ms  # Timestamp units per ms
+
+    @property
+    def width(self):
+        return len(self.columns)
+
+    @property
+    def dataset(self):
+        return f'behavior/{self.name}'
+
+    def unwrapper(self):
+        return Unwrapper(self.wrap) if self.wrap else None
+
+    def __repr__(self):
+        return f'Channel({self.code}, {self.name!r})'
+
+
+class Unwrapper:
+    '''Undo wrapping of counters across batches of rows
+    Each column with a modulus in `wrap` is assumed to increase, and to
+    advance by less than half the modulus between consecutive rows.
+    '''
+
+    def __init__(self, wrap):
+        self.wrap = wrap
+        self.last = [None] * len(wrap)      # Last raw value of each column
+        self.offset = [0] * len(wrap)       # Added to raw values of each column
+
+    def __call__(self, rows):
+        rows = np.array(rows, dtype=np.int64)
+        if not len(rows): return rows
+        for col, modulus in enumerate(self.wrap):
+            if not modulus: continue
+            raw = rows[:, col].copy()
+            previous = np.r_[raw[0] if self.last[col] is None else self.last[col], raw[:-1]]
+            wraps = np.cumsum(raw - previous < -modulus // 2)
+            rows[:, col] = raw + self.offset[col] + wraps * modulus
+            self.last[col] = int(raw[-1])
+            self.offset[col] += int(wraps[-1]) * modulus
+        return rows
+
+
+# Codes in track_wheel.ino
+registry = [
+    Channel(7, 'wheel', plot='line'),
+    Channel(
+        protocol.code_camera, 'camera', columns=('us', 'frame'), dtype='int64',
+        wrap=(protocol.camera_ts_max, protocol.camera_index_max), ts_per_ms=1000
+    ),
+    Channel(protocol.code_encoder_error, 'encoder_errors', columns=('ts', 'errors'), label='Encoder errors'),
+]
+
+by_code = {channel.code: channel for channel in registry}
+by_name = {channel.name: channel for channel in registry}
+
+
+def register(channel):
+    '''Add channel to registry'''
+
+    if channel.code in by_code or channel.name in by_name:
+        raise ValueError(f'Channel code or name already registered: {channel}')
+    registry.append(channel)
+    by_code[channel.code] = channel
+    by_name[channel.name] = channel
+
+
+def route(samples, codes=None):
+    '''Split samples by code
+    Returns dict of code: rows (in order received) for each code present,
+    limited to `codes` if given.
+    '''
+
+    if not len(samples): return {}
+    order = np.argsort(samples[:, 0], kind='stable')
+    grouped = samples[order]
+    keys, starts = np.unique(grouped[:, 0], return_index=True)
+    groups = dict(zip(keys.tolist(), np.split(grouped, starts[1:])))
+    if codes is not None:
+        groups = {code: rows for code, rows in groups.items() if code in codes}
+    return groups
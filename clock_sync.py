@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+'''
+Alignment of Arduino and host clocks
+
+Host sends ping (`code_ping`) and Arduino replies immediately with a sync
+sample (`code_sync`) stamped with its clock. Reply is assumed to be sent
+halfway between ping sent and reply received, so each exchange gives a pair
+of (Arduino time, host time). A line fit to these pairs maps Arduino
+timestamps (ms since session start) to host `time.monotonic()` (s), including
+drift between clocks. Exchanges with long round trips are excluded from fit.
+
+Latency of each sample is its host arrival time minus its Arduino timestamp
+mapped to host time, ie time from transmit to arrival, including USB and OS
+buffering. Since fit assumes symmetric delays, latency is relative to half the
+shortest round trip.
+'''
+
+
+import time
+import numpy as np
+from protocol import code_ping
+
+
+class ClockSync:
+    def __init__(self, interval=1, timeout=1, max_rtt_factor=2, max_pings=3600):
+        self.interval = interval                # Time between pings (s)
+        self.timeout = timeout                  # Time to wait for reply (s)
+        self.max_rtt_factor = max_rtt_factor    # Exclude pings with RTT above factor times median
+        self.max_pings = max_pings              # Most recent pings used for fit
+
+        self.pings = np.zeros((0, 3))   # (Arduino time (s), host time (s), round trip (s))
+        self.sent = None                # Host time last ping was sent
+        self.last_ping = -np.inf
+        self.n_lost = 0
+        self.offset = None              # Host time (s) at Arduino time 0
+        self.scale = None               # Host s per Arduino s
+        self.residual = None            # SD of fit residuals (s)
+
+    @property
+    def ready(self):
+        return self.offset is not None
+
+    def ping(self, ser, now=None):
+        '''Send ping if due'''
+
+        now = time.monotonic() if now is None else now
+        if self.sent is not None:
+            if now - self.sent < self.timeout: return
+            self.n_lost += 1
+            self.sent = None
+        if now - self.last_ping < self.interval: return
+        ser.write(code_ping.encode())
+        self.sent = self.last_ping = now
+
+    def reply(self, ts, arrival):
+        '''Record reply with Arduino timestamp `ts` (ms) received at host `arrival` (s)'''
+
+        if self.sent is None: return
+        rtt = arrival - self.sent
+        host = self.sent + rtt / 2
+        self.sent = None
+        self.pings = np.vstack([self.pings[-(self.max_pings - 1):], [ts / 1000, host, rtt]])
+        self.fit()
+
+    def fit(self):
+        pings = self.pings
+        if len(pings) < 2: return
+        pings = pings[pings[:, 2] <= self.max_rtt_factor * np.median(pings[:, 2])]
+        if len(pings) < 2 or np.ptp(pings[:, 0]) == 0: return
+        self.scale, self.offset = np.polyfit(pings[:, 0], pings[:, 1], 1)
+        self.residual = float(np.std(pings[:, 1] - self.to_host(pings[:, 0] * 1000)))
+
+    def to_host(self, ts):
+        '''Host time (s) of Arduino timestamps `ts` (ms)'''
+        return self.offset + self.scale * np.asarray(ts) / 1000
+
+    def attrs(self):
+        '''Fit and ping statistics, for saving'''
+
+        rtt = self.pings[:, 2] if len(self.pings) else np.full(1, np.nan)
+        return {
+            'clock_offset': self.offset if self.ready else np.nan,
+            'clock_scale': self.scale if self.ready else np.nan,
+            'clock_drift_ppm': (self.scale - 1) * 1e6 if self.ready else np.nan,
+            'clock_residual_ms': self.residual * 1000 if self.ready else np.nan,
+            'clock_pings': len(self.pings),
+            'clock_pings_lost': self.n_lost,
+            'clock_rtt_median_ms': float(np.median(rtt)) * 1000,
+            'clock_rtt_min_ms': float(np.min(rtt)) * 1000,
+            # Converts host monotonic time to Unix time
+            'clock_unix_offset': time.time() - time.monotonic(),
+        }
+
+
+class LatencyStats:
+    '''Summary of latencies
+    All latencies are counted in a histogram (`bin_ms` resolution, up to
+    `max_ms`); the last `recent` are kept for live stats.
+    '''
+
+    def __init__(self, bin_ms=0.1, max_ms=1000, recent=4096):
+        self.bin_ms = bin_ms
+        self.counts = np.zeros(int(max_ms / bin_ms) + 1, dtype=np.int64)
+        self.recent = np.zeros(recent)
+        self.n = 0
+        self.max = -np.inf
+
+    def add(self, latency):
+        '''Add latencies (s)'''
+
+        latency_ms = np.asarray(latency) * 1000
+        if not len(latency_ms): return
+        bins = np.clip(latency_ms / self.bin_ms, 0, len(self.counts) - 1).astype(np.int64)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.max = max(self.max, latency_ms.max())
+
+        latency_ms = latency_ms[-len(self.recent):]
+        ix = (self.n + np.arange(len(latency_ms))) % len(self.recent)
+        self.recent[ix] = latency_ms
+        self.n += len(latency_ms)
+
+    def live(self):
+        '''p50 and p99 (ms) of recent latencies'''
+        if not self.n: return None, None
+        recent = self.recent[:min(self.n, len(self.recent))]
+        return tuple(np.percentile(recent, [50, 99]))
+
+    def percentile(self, q):
+        total = self.counts.sum()
+        if not total: return np.nan
+        ix = np.searchsorted(np.cumsum(self.counts), q / 100 * total)
+        return (ix + 0.5) * self.bin_ms
+
+    def attrs(self):
+        '''Summary, for saving'''
+        return {
+            'latency_n': int(self.counts.sum()),
+            'latency_p50_ms': self.percentile(50),
+            'latency_p99_ms': self.percentile(99),
+            'latency_max_ms': self.max if self.n else np.nan,
+        }
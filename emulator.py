@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+
+'''
+Software emulator of track_wheel.ino
+
+Follows the same states as the firmware:
+1. Wait for parameters (`D` followed by parameters, see `protocol`) and reply
+`0` if they end with `code_last_param`.
+2. Wait for start signal (`E`).
+3. Take wheel samples every `track_period` into an on-board buffer and send
+them every `send_period` (or when buffer is half full) until `session_dur` or
+until `0` is received, then send end code.
+
+After a session ends the emulator starts over, as if the Arduino were reset.
+
+The emulator is exposed on a pseudo-terminal (POSIX) that can be opened like a
+serial port, or on a TCP port that can be opened with the pyserial URL
+`socket://localhost:<port>`. Neither is limited by baud rate, but the
+firmware's transmit buffer is emulated at the `baudrate` parameter: samples
+that don't fit wait in the on-board buffer, and samples that don't fit there
+are dropped and reported with `code_dropped`. Emulated time can run faster
+than real time (`speed`) to reach sample rates well above what the firmware's
+1 ms resolution allows.
+
+Without `emulate_wheel`, movement is simulated as running bouts separated by
+rest, in counts scaled by the `decode_mode` parameter. In 4x mode, missed
+encoder edges can be emulated (`missed_edges`) and are reported with
+`code_encoder_error`. With the `camera_fps` parameter, camera strobes are
+emulated at that rate (or `camera_fps` given to the emulator, to test a camera
+running faster than expected) and sent in batches like the firmware's frame
+buffer. Output can be held and sent in bursts, and random bytes can be
+corrupted, to test the host under realistic transport conditions.
+
+Usage:
+    python emulator.py
+    python wheel.py --port /dev/pts/N
+'''
+
+
+import argparse
+import os
+import select
+import socket
+import sys
+import time
+import numpy as np
+import protocol
+
+
+# Output codes
+code_end = 0
+code_move = 7
+code_sync = protocol.code_sync
+code_dropped = protocol.code_dropped
+code_camera = protocol.code_camera
+code_encoder_error = protocol.code_encoder_error
+code_param_error = 70
+
+# Arduino serial transmit buffer (bytes)
+tx_buffer_size = 64
+
+# Wheel samples buffered on board (holds one less; see samples.h)
+sample_buffer_size = 32
+
+# Camera frames are buffered on board (frames strobed while buffer is full are
+# lost), and sent when `cam_batch` are buffered or `cam_flush_ms` after last
+# sent. Frames that don't fit in transmit buffer stay buffered.
+cam_buffer_size = 32
+cam_batch = 8
+cam_flush_ms = 10
+
+
+class PtyTransport:
+    '''Pseudo-terminal; host opens `port` like a serial port'''
+
+    def __init__(self):
+        import tty
+        self.fd, self.fd_slave = os.openpty()
+        tty.setraw(self.fd_slave)
+        self.port = os.ttyname(self.fd_slave)
+
+    def wait(self):
+        '''Wait for host to connect'''
+        return True
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready: return b''
+        return os.read(self.fd, 4096)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.fd_slave)
+
+
+class TcpTransport:
+    '''TCP server; host opens `socket://localhost:<port>`'''
+
+    def __init__(self, port=0):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('localhost', port))
+        self.server.listen(1)
+        self.port = f'socket://localhost:{self.server.getsockname()[1]}'
+        self.conn = None
+
+    def wait(self):
+        '''Wait for host to connect (like Arduino reset on connection)'''
+        if self.conn is None:
+            self.conn, _ = self.server.accept()
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.conn], [], [], max(timeout, 0))
+        if not ready: return b''
+        data = self.conn.recv(4096)
+        if not data:
+            raise ConnectionResetError('Host disconnected')
+        return data
+
+    def write(self, data):
+        self.conn.sendall(data)
+
+    def disconnect(self, linger=10):
+        '''Close connection once host is done reading
+        Closing with host input unread resets the connection, which discards
+        data the host hasn't read yet (eg end code).
+        '''
+
+        if self.conn is None: return
+        try:
+            self.conn.shutdown(socket.SHUT_WR)
+            wait_until = time.monotonic() + linger
+            while time.monotonic() < wait_until:
+                ready, _, _ = select.select([self.conn], [], [], wait_until - time.monotonic())
+                if ready and not self.conn.recv(4096): break
+        except OSError:
+            pass
+        self.conn.close()
+        self.conn = None
+
+    def close(self):
+        self.disconnect()
+        self.server.close()
+
+
+class RunningWheel:
+    '''Simulated wheel movement
+    Animal alternates between rest and running bouts (exponentially distributed
+    durations). Speed relaxes toward bout speed with some noise. Returns
+    encoder counts per sample.
+    '''
+
+    def __init__(self, rng, run_speed=40, rest_dur=5, bout_dur=3, tau=0.3, noise=5):
+        self.rng = rng
+        self.run_speed = run_speed  # Counts/s while running
+        self.rest_dur = rest_dur    # Mean rest duration (s)
+        self.bout_dur = bout_dur    # Mean bout duration (s)
+        self.tau = tau              # Time constant of speed changes (s)
+        self.noise = noise          # Speed noise (counts/s)
+
+        self.running = False
+        self.speed = 0.
+        self.position = 0.
+
+    def step(self, n, dt):
+        '''Counts for `n` samples spaced by `dt` (s)'''
+        p_switch = dt / (self.bout_dur if self.running else self.rest_dur)
+        switch = self.rng.random(n) < p_switch
+        running = self.running ^ (np.cumsum(switch) % 2).astype(bool)
+        self.running = bool(running[-1]) if n else self.running
+
+        target = running * self.run_speed
+        noise = self.rng.normal(0, self.noise * np.sqrt(dt), n)
+        alpha = min(dt / self.tau, 1)
+        speed = np.empty(n)
+        s = self.speed
+        for i in range(n):
+            s += alpha * (target[i] - s) + noise[i]
+            speed[i] = s
+        self.speed = s
+
+        position = self.position + np.cumsum(speed * dt)
+        counts = np.diff(np.floor(np.r_[self.position, position])).astype(np.int64)
+        self.position = position[-1] if n else self.position
+        return counts
+
+
+class WheelEmulator:
+    def __init__(self, transport, speed=1, burst_ms=0, corrupt=0, reset_ms=100, camera_fps=None, missed_edges=0,
+                 seed=None, verbose=False):
+        self.transport = transport
+        self.reset_ms = reset_ms    # Time to reset after host connects (like bootloader)
+        self.speed = speed          # Emulated ms per real ms
+        self.burst_ms = burst_ms    # Hold output and send every `burst_ms` (real time)
+        self.corrupt = corrupt      # Probability per sample of corrupting a byte
+        self.camera_fps = camera_fps    # Strobe rate (Hz); default from parameters
+        self.missed_edges = missed_edges    # Probability per moving sample of a missed edge (4x mode)
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.last_send = time.monotonic()
+        self.params = {}
+        self.dropped = 0        # Samples dropped since last report
+        self.sample_buffer = np.zeros((0, 3), dtype=np.int64)   # Wheel samples not yet sent
+        self.frame_buffer = np.zeros((0, 3), dtype=np.int64)    # Camera frames not yet sent
+        self.frames_taken = 0   # Camera frames strobed
+
+    # -- Serial -- #
+
+    def receive(self, timeout=0):
+        data = self.transport.read(timeout)
+        if data and self.verbose: print(f'  [host]: {data!r}')
+        self.rx += data
+
+    def println(self, text):
+        self.tx += f'{text}\r\n'.encode()
+        self.send()
+
+    def send_samples(self, samples):
+        if not len(samples): return
+        if self.params.get('binary_frames'):
+            data = bytearray(protocol.encode_frames(samples))
+        else:
+            data = bytearray(b''.join(b'%d,%d,%d\r\n' % tuple(row) for row in samples.tolist()))
+
+        # Corrupt random bytes
+        n_corrupt = self.rng.binomial(len(samples), self.corrupt) if self.corrupt else 0
+        for ix in self.rng.integers(0, len(data), n_corrupt):
+            data[ix] = self.rng.integers(0, 256)
+
+        self.tx += data
+        if (time.monotonic() - self.last_send) * 1000 >= self.burst_ms:
+            self.send()
+
+    def send(self):
+        if self.tx:
+            self.transport.write(bytes(self.tx))
+            self.tx.clear()
+        self.last_send = time.monotonic()
+
+    def peek(self, timeout):
+        '''Next byte without consuming it (None on timeout)'''
+        if not self.rx:
+            self.receive(timeout)
+        return self.rx[0] if self.rx else None
+
+    def parse_int(self, timeout=1, digit_timeout=0.05):
+        '''Emulates `Serial.parseInt()`
+        Skips characters until a digit or '-', then reads digits. Returns 0 on
+        timeout.
+        '''
+
+        # Skip to start of number
+        wait_until = time.monotonic() + timeout
+        while True:
+            c = self.peek(wait_until - time.monotonic())
+            if c is None: return 0
+            if chr(c).isdigit() or c == ord('-'): break
+            self.rx.pop(0)
+
+        text = chr(self.rx.pop(0))
+        while True:
+            c = self.peek(digit_timeout)
+            if c is None or not chr(c).isdigit(): break
+            text += chr(self.rx.pop(0))
+        return int(text) if text != '-' else 0
+
+    # -- States -- #
+
+    def look_for_signal(self, signal):
+        '''Wait for `signal` byte; returns False if end code received instead'''
+        while True:
+            if not self.rx:
+                self.receive(1)
+                continue
+            reading = self.rx.pop(0)
+            if reading == ord('0'):
+                self.end_session(0)
+                return False
+            if reading == ord(signal):
+                return True
+            if reading == ord(protocol.code_identify):
+                self.println(protocol.firmware_id)
+
+    def get_params(self):
+        values = [self.parse_int() for _ in range(len(protocol.parameter_names) + 1)]
+        self.params = dict(zip(protocol.parameter_names, values))
+        return values[-1] == protocol.code_last_param
+
+    def end_session(self, ts):
+        self.send_samples(self.sample_buffer)
+        self.sample_buffer = self.sample_buffer[:0]
+        self.strobe(ts * 1000)
+        self.send_samples(self.frame_buffer)
+        self.frame_buffer = self.frame_buffer[:0]
+        if self.dropped:
+            self.send_samples(np.array([[code_dropped, ts, min(self.dropped, 32767)]]))
+        self.send_samples(np.array([[code_end, ts, 0]]))
+        self.send()
+
+    def frame_rate(self):
+        '''Camera strobe rate (Hz), 0 if frames aren't captured'''
+        if not self.params.get('camera_fps'): return 0
+        return self.camera_fps if self.camera_fps is not None else self.params['camera_fps']
+
+    def strobe(self, ts_us):
+        '''Add camera frames strobed up to `ts_us` to frame buffer
+        Frame k strobes at k / fps, with some jitter. All frames due are
+        added, since firmware sends frames between emulator passes; frames
+        that still don't fit after sending are dropped by `stream()`.
+        '''
+
+        fps = self.frame_rate()
+        if not fps: return
+        n_due = int(ts_us * fps / 1e6)
+        index = np.arange(self.frames_taken + 1, n_due + 1)
+        self.frames_taken = max(n_due, self.frames_taken)
+        us = (index * 1e6 / fps + self.rng.normal(0, 2, len(index))).astype(np.int64)
+        self.frame_buffer = np.vstack([self.frame_buffer, np.column_stack([
+            np.full(len(index), code_camera),
+            us % protocol.camera_ts_max,
+            index % protocol.camera_index_max,
+        ])])
+
+    def buffer_samples(self, samples):
+        '''Queue wheel samples on board; samples that don't fit are dropped'''
+        room = sample_buffer_size - 1 - len(self.sample_buffer)
+        self.dropped += max(len(samples) - room, 0)
+        self.sample_buffer = np.vstack([self.sample_buffer, samples[:room]])
+
+    def send_buffered(self, ts):
+        '''Send dropped report and buffered wheel samples that fit in transmit buffer'''
+        if self.dropped:
+            report = self.limit_bandwidth(np.array([[code_dropped, ts, min(self.dropped, 32767)]]), ts)
+            if len(report):
+                self.dropped -= int(report[0, 2])
+                self.send_samples(report)
+        samples = self.limit_bandwidth(self.sample_buffer, ts)
+        self.sample_buffer = self.sample_buffer[len(samples):]
+        self.send_samples(samples)
+
+    def limit_bandwidth(self, samples, ts_end):
+        '''Samples that fit in transmit buffer at baud rate
+        Buffer drains at `baudrate` / 10 bytes/s (emulated time) between
+        batches of samples, sent at `ts_end` (ms). Returns the first of
+        `samples` that fit; the rest are left to the caller.
+        '''
+
+        baudrate = self.params.get('baudrate') or protocol.default_baudrate
+        size = protocol.sample_size(self.params['binary_frames'], self.params['session_dur'] * 60000)
+        drained = (ts_end - self.tx_ts) * baudrate / 10 / 1000
+        self.tx_ts = ts_end
+
+        room = tx_buffer_size - self.tx_level + drained
+        samples = samples[:int(max(room // size, 0))]
+        self.tx_level = min(max(tx_buffer_size - room + len(samples) * size, 0), tx_buffer_size)
+        return samples
+
+    def run_session(self):
+        '''One pass of firmware from reset to end of session'''
+
+        self.rx.clear()
+        self.tx.clear()
+        while True:
+            self.println('Waiting for parameters...')
+            if not self.look_for_signal('D'): return
+            if self.get_params(): break
+            self.println(code_param_error)
+            self.println('Error parsing parameters')
+        self.println(0)
+        self.println('Paremeters processed')
+        self.println('Emulating wheel' if self.params['emulate_wheel'] else 'no emulation')
+        if self.params['binary_frames']:
+            self.println('Sending binary frames')
+        if self.params['baudrate'] and self.params['baudrate'] != protocol.default_baudrate:
+            self.println(protocol.baudrate_switch)
+            time.sleep(0.1)
+
+        self.println("Waiting for start signal ('E')")
+        if not self.look_for_signal('E'): return
+        self.println('Session started')
+        self.stream()
+
+    def stream(self):
+        session_dur = self.params['session_dur'] * 1000 * 60
+        track_period = max(self.params['track_period'], 1)
+        wheel = RunningWheel(self.rng)
+
+        start = time.monotonic()
+        ts_next_track = track_period
+        self.tx_level = 0       # Bytes in transmit buffer
+        self.tx_ts = 0          # Time of last transmit
+        self.dropped = 0
+        send_period = self.params.get('send_period', 0)
+        ts_sent = 0
+        self.sample_buffer = self.sample_buffer[:0]
+        self.frame_buffer = self.frame_buffer[:0]
+        self.frames_taken = 0
+        frame_period = 1000 / self.frame_rate() if self.frame_rate() else None
+        ts_frame_flush = 0
+        while True:
+            ts = int((time.monotonic() - start) * 1000 * self.speed)
+
+            # Serial scan
+            if ord('0') in self.rx:
+                self.end_session(ts)
+                return
+            for _ in range(self.rx.count(ord(protocol.code_ping))):
+                self.send_samples(np.array([[code_sync, ts, 0]]))
+            self.rx.clear()
+
+            # Camera frames
+            # Sent before wheel samples: when this pass comes late, firmware
+            # would have sent the frames strobed meanwhile as they came in
+            if frame_period:
+                self.strobe(ts * 1000)
+                n = len(self.frame_buffer)
+                if n >= cam_batch or (n and ts - ts_frame_flush >= cam_flush_ms):
+                    samples = self.limit_bandwidth(self.frame_buffer, ts)
+                    self.frame_buffer = self.frame_buffer[len(samples):]
+                    self.send_samples(samples)
+                    ts_frame_flush = ts
+                # Frames left over fill buffer; later ones are lost (gap in index)
+                self.frame_buffer = self.frame_buffer[:cam_buffer_size]
+
+            # Track movement
+            # Samples due before end of session (firmware checks every ms)
+            ts_track = min(ts, session_dur - 1)
+            if ts_track >= ts_next_track:
+                ts_samples = np.arange(ts_next_track, ts_track + 1, track_period)
+                ts_next_track = ts_samples[-1] + track_period
+                if self.params['emulate_wheel']:
+                    values = self.rng.integers(1, 25, len(ts_samples))
+                    keep = self.rng.integers(0, 10, len(ts_samples)) == 0
+                else:
+                    decode_mode = self.params.get('decode_mode') or 1
+                    values = wheel.step(len(ts_samples), track_period / 1000) * decode_mode
+                    keep = values != 0
+                if self.params['record_zeros']:
+                    keep[:] = True
+                samples = np.column_stack([np.full(len(ts_samples), code_move), ts_samples, values])[keep]
+
+                # Missed edges; error report is buffered before its sample
+                if self.params.get('decode_mode') == 4 and self.missed_edges:
+                    missed = (self.rng.random(len(samples)) < self.missed_edges) & (samples[:, 2] != 0)
+                    errors = np.column_stack([
+                        np.full(missed.sum(), code_encoder_error), samples[missed, 1], np.ones(missed.sum(), dtype=np.int64)
+                    ])
+                    samples = np.vstack([samples, errors])
+                    samples = samples[np.lexsort((samples[:, 0] != code_encoder_error, samples[:, 1]))]
+                self.buffer_samples(samples)
+
+            # Send wheel samples
+            n = len(self.sample_buffer)
+            if n and (ts - ts_sent >= send_period or n >= sample_buffer_size // 2):
+                self.send_buffered(ts)
+                ts_sent = ts
+
+            # Session control
+            if ts >= session_dur:
+                self.end_session(ts)
+                return
+
+            # Wait for next sample (or burst, or batch of frames) while watching for input
+            ts_next = ts_next_track
+            if len(self.sample_buffer):
+                ts_next = min(ts_next, ts_sent + send_period)
+            if frame_period:
+                ts_batch = (self.frames_taken + cam_batch - len(self.frame_buffer)) * frame_period
+                ts_next = min(ts_next, ts_batch)
+                if len(self.frame_buffer):
+                    ts_next = min(ts_next, ts_frame_flush + cam_flush_ms)
+            wait_ms = max(ts_next - ts, 0) / self.speed
+            if self.tx:
+                wait_ms = min(wait_ms, self.burst_ms - (time.monotonic() - self.last_send) * 1000)
+                if wait_ms <= 0:
+                    self.send()
+                    continue
+            self.receive(wait_ms / 1000)
+
+    def run(self, once=False):
+        while True:
+            self.transport.wait()
+            time.sleep(self.reset_ms / 1000)
+            try:
+                self.run_session()
+            except (ConnectionResetError, BrokenPipeError):
+                if self.verbose: print('Host disconnected, resetting')
+                if hasattr(self.transport, 'disconnect'): self.transport.disconnect()
+                continue
+            if self.verbose: print('Session ended, resetting')
+            if once: return
+            if hasattr(self.transport, 'disconnect'): self.transport.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate Arduino running track_wheel.ino')
+    parser.add_argument('--tcp', type=int, nargs='?', const=0, default=None, metavar='PORT',
+                        help='Serve on TCP port instead of pseudo-terminal (0 for any free port)')
+    parser.add_argument('--speed', type=float, default=1, help='Emulated time per real time')
+    parser.add_argument('--burst-ms', type=float, default=0, help='Send output in bursts every BURST_MS')
+    parser.add_argument('--corrupt', type=float, default=0, help='Probability per sample of corrupting a byte')
+    parser.add_argument('--reset-ms', type=float, default=100, help='Delay before greeting after host connects')
+    parser.add_argument('--camera-fps', type=float, default=None,
+                        help='Camera strobe rate (default: camera_fps parameter; strobes only sent if it is set)')
+    parser.add_argument('--missed-edges', type=float, default=0,
+                        help='Probability per moving sample of a missed encoder edge (4x decoding)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--once', action='store_true', help='Exit after one session')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.tcp is not None:
+        transport = TcpTransport(args.tcp)
+    elif os.name == 'posix':
+        transport = PtyTransport()
+    else:
+        sys.exit('Pseudo-terminals not supported on this system, use --tcp')
+
+    print(f'Emulated Arduino on {transport.port}')
+    sys.stdout.flush()
+    emulator = WheelEmulator(
+        transport, speed=args.speed, burst_ms=args.burst_ms, corrupt=args.corrupt,
+        reset_ms=args.reset_ms, camera_fps=args.camera_fps, missed_edges=args.missed_edges,
+        seed=args.seed, verbose=args.verbose
+    )
+    try:
+        emulator.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+'''
+Export session data from HDF5 file
+
+Datasets are streamed chunk by chunk so memory use doesn't depend on session
+length. Supported formats:
+
+- csv: integer-formatted comma-separated values
+- npy: numpy array file
+- parquet: columnar file (requires pyarrow)
+
+Each dataset in a session's `behavior` group is saved as
+`<base>-<dataset>.<ext>`, and attributes and notes as `<base>-attributes.csv`.
+
+Usage:
+    python export.py data/data.h5 --format npy
+'''
+
+
+import argparse
+import os
+import h5py
+import numpy as np
+from live_reader import find_sessions
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+formats = {
+    'csv': '.csv',
+    'npy': '.npy',
+    'parquet': '.parquet',
+}
+
+
+def iter_chunks(dataset, chunk_rows=None):
+    '''Yield dataset in blocks of rows
+    Defaults to dataset's chunk size (or 65536 rows if not chunked).
+    '''
+
+    if chunk_rows is None:
+        chunk_rows = max(dataset.chunks[0] if dataset.chunks else 65536, 65536)
+    for start in range(0, dataset.shape[0], chunk_rows):
+        yield dataset[start:start + chunk_rows]
+
+
+def column_names(dataset):
+    if 'columns' in dataset.attrs:
+        return [str(c) for c in dataset.attrs['columns']]
+    return [f'c{i}' for i in range(dataset.shape[1])]
+
+
+def export_csv(dataset, filename, chunk_rows=None):
+    # Format whole chunk at once instead of row by row
+    line_fmt = ','.join(['%d'] * dataset.shape[1]) + '\n'
+    with open(filename, 'w') as file:
+        for block in iter_chunks(dataset, chunk_rows):
+            file.write((line_fmt * len(block)) % tuple(block.ravel().tolist()))
+
+
+def export_npy(dataset, filename, chunk_rows=None):
+    array = np.lib.format.open_memmap(filename, mode='w+', dtype=dataset.dtype, shape=dataset.shape)
+    start = 0
+    for block in iter_chunks(dataset, chunk_rows):
+        array[start:start + len(block)] = block
+        start += len(block)
+    array.flush()
+    del array
+
+
+def export_parquet(dataset, filename, chunk_rows=None):
+    if pyarrow is None:
+        raise RuntimeError('Exporting to parquet requires pyarrow')
+
+    names = column_names(dataset)
+    schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dataset.dtype)) for name in names])
+    with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+        for block in iter_chunks(dataset, chunk_rows):
+            table = pyarrow.Table.from_arrays([block[:, i] for i in range(block.shape[1])], schema=schema)
+            writer.write_table(table)
+
+
+exporters = {
+    'csv': export_csv,
+    'npy': export_npy,
+    'parquet': export_parquet,
+}
+
+
+def export_attributes(hdf5_file, session, filename):
+    '''Save session attributes and notes as text'''
+
+    hdf5_grp_behav = hdf5_file[f'{session}/behavior']
+    subj = session.split('/')[0]
+    wt = hdf5_file[f'{session}/weight'][()] if f'{session}/weight' in hdf5_file else ''
+    notes = hdf5_file[session].attrs.get('notes', '')
+    with open(filename, 'w') as file:
+        file.write(f"subject,{subj}\n")
+        file.write(f"weight,{wt}\n")
+        for k, v in hdf5_grp_behav.attrs.items():
+            file.write(f"{k},{v}\n")
+        file.write(f"notes:\n{notes}")
+
+
+def export_session(hdf5_filename, session, filename_base, fmt='csv', chunk_rows=None, verbose=False):
+    '''Export all datasets in session's `behavior` group'''
+
+    exporter = exporters[fmt]
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        export_attributes(hdf5_file, session, f'{filename_base}-attributes.csv')
+        for name, dataset in hdf5_file[f'{session}/behavior'].items():
+            if not isinstance(dataset, h5py.Dataset): continue
+            filename = f'{filename_base}-{name}{formats[fmt]}'
+            exporter(dataset, filename, chunk_rows)
+            if verbose: print(f'Saved {dataset.shape[0]} rows to {filename}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export sessions from HDF5 file')
+    parser.add_argument('file')
+    parser.add_argument('--session', help='Group of session (default: all sessions in file)')
+    parser.add_argument('--format', choices=formats.keys(), default='csv')
+    parser.add_argument('--output', help='Base name for exported files (default: name of HDF5 file)')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='Rows read per chunk')
+    args = parser.parse_args()
+
+    if args.session:
+        sessions = [args.session]
+    else:
+        with h5py.File(args.file, 'r') as hdf5_file:
+            sessions = find_sessions(hdf5_file)
+
+    base = args.output or os.path.splitext(args.file)[0]
+    for session in sessions:
+        # Name files by session if exporting more than one
+        filename_base = base if len(sessions) == 1 else f"{base}-{session.replace('/', '_')}"
+        export_session(args.file, session, filename_base, args.format, args.chunk_rows, verbose=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+'''
+Background HDF5 writer
+
+Keeps HDF5 file open for the whole session and writes blocks of data from a
+separate thread so file I/O doesn't stall the GUI. Blocks are appended to
+datasets in the order they are received. File is flushed when `flush_rows`
+rows have been written or `flush_interval` seconds have passed since the last
+flush, whichever comes first.
+
+Datasets are created empty with unlimited length and grown geometrically as
+data arrives, then trimmed to the rows written when the file is closed. Rows
+up to the `n_rows` attribute of each dataset have been flushed to disk.
+
+With `swmr`, file is opened in single-writer/multiple-reader mode so other
+processes can read data while it is recorded (see `live_reader`). File must be
+created with `libver='latest'` and all datasets must exist before the writer
+starts.
+'''
+
+
+import threading
+from queue import Queue, Empty
+import time
+import h5py
+import numpy as np
+
+
+def create_growable_dataset(group, name, track_period, width=2, dtype='int32', chunk_duration=10,
+                            min_chunk_rows=256, max_chunk_rows=65536):
+    '''Create empty dataset with unlimited length
+    Chunk length is chosen to hold about `chunk_duration` seconds of data at
+    one row per `track_period` (ms).
+    '''
+
+    rows_per_s = 1000 / max(track_period, 1)
+    chunk_rows = int(np.clip(rows_per_s * chunk_duration, min_chunk_rows, max_chunk_rows))
+    dataset = group.create_dataset(
+        name=name, dtype=dtype, shape=(0, width), maxshape=(None, width),
+        chunks=(chunk_rows, width)
+    )
+    dataset.attrs['n_rows'] = 0
+    return dataset
+
+
+class HDF5Writer(threading.Thread):
+    def __init__(self, filename, datasets=[], flush_interval=1, flush_rows=10000, growth_factor=1.5, swmr=False, verbose=False):
+        super().__init__(daemon=True)
+        self.filename = filename
+        self.swmr = swmr
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.growth_factor = growth_factor
+        self.verbose = verbose
+
+        self.q_write = Queue()
+        self.n_rows = {path: 0 for path in datasets}   # Rows written per dataset
+        self.uncommitted = set()                        # Datasets with rows not flushed
+        self.error = None
+        self.on_commit = None   # Called with rows per dataset after each flush
+        self.telemetry = None   # `telemetry.Telemetry` for rows written and flush timing
+
+    def append(self, path, block):
+        '''Queue block of rows to be appended to dataset at `path`'''
+        self.q_write.put(('append', path, np.array(block)))
+
+    def close(self, attrs={}):
+        '''Finish writing and close file
+        Datasets are trimmed to the number of rows written. `attrs` maps HDF5
+        paths to dicts of attributes to set before closing. Blocks until done.
+        '''
+
+        self.q_write.put(('close', attrs, None))
+        self.join()
+
+    def run(self):
+        try:
+            file_kwargs = {'libver': 'latest'} if self.swmr else {}
+            with h5py.File(self.filename, 'a', **file_kwargs) as hdf5_file:
+                if self.swmr:
+                    try:
+                        hdf5_file.swmr_mode = True
+                    except (ValueError, RuntimeError) as err:
+                        print(f'Could not start SWMR mode, data readable at end of session only: {err}')
+                self.write_loop(hdf5_file)
+        except Exception as err:
+            self.error = err
+            print(f'Error writing HDF5 file: {err}')
+
+    def write_loop(self, hdf5_file):
+        last_flush = time.monotonic()
+        unflushed = 0
+
+        while True:
+            try:
+                command, arg1, arg2 = self.q_write.get(timeout=self.flush_interval)
+            except Empty:
+                command = None
+
+            if command == 'append':
+                path, block = arg1, arg2
+                n = self.n_rows.get(path, 0)
+                dataset = hdf5_file[path]
+                if n + len(block) > dataset.shape[0]:
+                    self.grow(dataset, n + len(block))
+                dataset[n:n + len(block)] = block
+                self.n_rows[path] = n + len(block)
+                self.uncommitted.add(path)
+                unflushed += len(block)
+                if self.telemetry:
+                    self.telemetry.count('hdf5_rows', len(block))
+                    self.telemetry.gauge('hdf5_queue', self.q_write.qsize())
+
+            elif command == 'close':
+                for path, n in self.n_rows.items():
+                    hdf5_file[path].resize(n, axis=0)
+                for path, path_attrs in arg1.items():
+                    for key, value in path_attrs.items():
+                        hdf5_file[path].attrs[key] = value
+                self.commit(hdf5_file)
+                if self.verbose: print(f'HDF5 file closed ({self.n_rows})')
+                return
+
+            # Flush on size or time
+            now = time.monotonic()
+            if unflushed and (unflushed >= self.flush_rows or now - last_flush >= self.flush_interval):
+                t0 = now
+                self.commit(hdf5_file)
+                last_flush = time.monotonic()
+                if self.verbose: print(f'Flushed {unflushed} rows in {last_flush - t0:.3f} s')
+                unflushed = 0
+
+    def commit(self, hdf5_file):
+        '''Flush file and mark written rows as readable'''
+        t0 = time.perf_counter()
+        for path in self.uncommitted:
+            hdf5_file[path].attrs.modify('n_rows', self.n_rows[path])
+        self.uncommitted.clear()
+        hdf5_file.flush()
+        if self.telemetry:
+            self.telemetry.timing('hdf5_flush', time.perf_counter() - t0)
+            self.telemetry.gauge('hdf5_file_bytes', hdf5_file.id.get_filesize())
+        if self.on_commit: self.on_commit(dict(self.n_rows))
+
+    def grow(self, dataset, min_rows):
+        '''Resize dataset to hold at least `min_rows`
+        Grows by `growth_factor` (at least one chunk) so resizes are amortized.
+        '''
+
+        new_rows = max(
+            min_rows,
+            int(dataset.shape[0] * self.growth_factor),
+            dataset.shape[0] + dataset.chunks[0],
+        )
+        dataset.resize(new_rows, axis=0)
@@ -2,23 +2,60 @@
 
 '''
 Sample tkinter live graph
+
+Data for each series is kept in a preallocated ring buffer so adding points
+doesn't reallocate the plotted history.
+
+Adding data does not draw anything. The plot is repainted on a timer at most
+`fps` times per second, only if new data has arrived. With `blit`, only the
+data artists are repainted over a saved background; the axes (and ticks) are
+fully redrawn only when the x-axis scrolls, at most every `scroll_interval`
+seconds, or when the figure is resized.
+
+With `decimate='minmax'`, each series is reduced to the min and max point per
+pixel column before plotting, so drawing cost depends on plot width rather
+than the number of points in `x_history`.
 '''
 
 import tkinter as tk
 import tkinter.ttk as ttk
+import time
 import matplotlib
 matplotlib.use('TKAgg')
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
+from series_buffer import SeriesBuffer, MinMaxDecimator
 
 
 class LiveDataView(ttk.Frame):
-    def __init__(self, parent, x_history=30, scale_x=1, scale_y = 1, data_types={'default': 'line'}, **ax_kwargs):
+    def __init__(self, parent, x_history=30, scale_x=1, scale_y = 1, data_types={'default': 'line'}, buffer_size=65536,
+                 blit=True, fps=30, scroll_interval=0.5, x_lead=0.05, decimate=None,
+                 canvas_class=FigureCanvasTkAgg, **ax_kwargs):
         self.parent = parent
         self.x_history = x_history * scale_x
         self.scale_x = scale_x
         self.scale_y = scale_y
+        self.buffers = {name: SeriesBuffer(buffer_size) for name in data_types}
+
+        # Decimation
+        # Set up when plot width is known (see `setup_decimators`)
+        self.decimate = decimate
+        self.decimators = {}
+        self.decimate_width = None
+
+        # Rendering
+        # x-axis extends `x_lead` (fraction of history) past latest point so
+        # new data is visible between scrolls.
+        self.blit = blit
+        self.frame_interval = int(1000 / fps)
+        self.scroll_interval = scroll_interval
+        self.x_lead = x_lead * self.x_history
+        self.x_last = None
+        self.last_scroll = 0
+        self.dirty = False
+        self.background = None
+        self.telemetry = None   # `telemetry.Telemetry` for draw timing
 
         # Create matplotlib figure
         self.fig_preview = Figure()
@@ -29,44 +66,121 @@ class LiveDataView(ttk.Frame):
                 data, = self.ax_preview.plot(0, 0)
             elif plot_type == 'scatter':
                 data = self.ax_preview.scatter(0, 0)
+            data.set_animated(self.blit)
             self.data[name] = data
         self.ax_preview.set(**ax_kwargs)
         self.ax_preview.set_xlim((-self.x_history, 0))
 
         # Add to tkinter
-        self.canvas_preview = FigureCanvasTkAgg(self.fig_preview, self.parent)
+        self.canvas_preview = canvas_class(self.fig_preview, self.parent)
+        if self.blit:
+            self.canvas_preview.mpl_connect('draw_event', self.on_draw)
         self.canvas_preview.draw()
         self.canvas_preview.get_tk_widget().grid(row=0, column=0, sticky='wens')
 
+        self.parent.after(self.frame_interval, self.render)
+
     def update_view(self, xy, name='default'):
+        '''Add single (x, y) point to series `name`'''
+        self.update_view_many(np.reshape(xy, (1, 2)), name)
+
+    def update_view_many(self, xy, name='default'):
+        '''Add (N, 2) array of points to series `name`
+        Plot is updated on next frame.
+        '''
+        if not len(xy): return
+
+        new_xy = np.asarray(xy) * np.array([self.scale_x, self.scale_y])
+        self.buffers[name].append(new_xy)
+        if name in self.decimators:
+            self.decimators[name].append(new_xy)
+        x_last = new_xy[-1, 0]
+        self.x_last = x_last if self.x_last is None else max(self.x_last, x_last)
+        self.dirty = True
+
+    def render(self):
+        '''Repaint plot if there is new data'''
+        if self.dirty:
+            self.draw_frame()
+        self.parent.after(self.frame_interval, self.render)
+
+    def setup_decimators(self):
+        '''(Re)build decimators with one bin per pixel column of plot
+        Called when plot width changes. Decimated data is rebuilt from buffers,
+        and from previous bins where history is longer than buffers.
+        '''
+
+        self.decimate_width = max(int(self.ax_preview.bbox.width), 1)
+        bin_width = self.x_history / self.decimate_width
+        for name, buffer in self.buffers.items():
+            if name in self.decimators:
+                self.decimators[name] = self.decimators[name].rebin(bin_width, buffer.view())
+            else:
+                self.decimators[name] = MinMaxDecimator(bin_width)
+                self.decimators[name].append(buffer.view())
+
+    def draw_frame(self):
+        t0 = time.perf_counter()
+        self.dirty = False
+        if self.decimate and int(self.ax_preview.bbox.width) != self.decimate_width:
+            self.setup_decimators()
+
+        # Scroll x-axis when data reaches the edge, and otherwise at most every
+        # `scroll_interval`
+        now = time.monotonic()
+        x_min, x_max = self.ax_preview.get_xlim()
+        scroll = self.x_last > x_max or \
+            (now - self.last_scroll >= self.scroll_interval and self.x_last > x_max - self.x_lead)
+        if scroll:
+            x_max = self.x_last + self.x_lead
+            x_min = x_max - self.x_history
+            self.ax_preview.set_xlim((x_min, x_max))
+            self.last_scroll = now
+
         # Update data
-        # Need to determine the type of plot it is.
-        new_xy = xy * np.array([self.scale_x, self.scale_y])
-        data_type = type(self.data[name])
-        if data_type == matplotlib.lines.Line2D:
-            # Line plot
-            current = self.data[name].get_xydata()
-            updated = self.update_data(current, new_xy)
-            self.data[name].set_data(updated.T)
-        elif data_type == matplotlib.collections.PathCollection:
-            # Scatter plot
-            current = self.data[name].get_offsets()
-            updated = self.update_data(current, new_xy)
-            self.data[name].set_offsets(updated)
+        # Only show data for window defined by `x_history`
+        for name, buffer in self.buffers.items():
+            if name in self.decimators:
+                updated = self.decimators[name].window(x_min)
+            else:
+                updated = buffer.window(x_min)
+            if not len(updated): continue
+
+            # Need to determine the type of plot it is.
+            data_type = type(self.data[name])
+            if data_type == matplotlib.lines.Line2D:
+                # Line plot
+                self.data[name].set_data(updated[:, 0], updated[:, 1])
+            elif data_type == matplotlib.collections.PathCollection:
+                # Scatter plot
+                self.data[name].set_offsets(updated)
 
         # Update view
-        new_xlim = new_xy[0] + np.array([-self.x_history, 0])
-        self.ax_preview.set_xlim(new_xlim)
-        self.canvas_preview.draw_idle()
-
-    def update_data(self, current, xy):
-        # Only keep data for window defined by `x_history`
-        # Should keep down on resource usage.
-        new_ix = current[:, 0] > xy[0] - self.x_history
-        return np.concatenate([current[new_ix, :], [xy]], axis=0)
+        if not self.blit or scroll or self.background is None:
+            # Full redraw; artists are redrawn by `on_draw` when blitting
+            self.canvas_preview.draw_idle()
+        else:
+            self.canvas_preview.restore_region(self.background)
+            self.draw_artists()
+            self.canvas_preview.blit(self.ax_preview.bbox)
+        if self.telemetry:
+            self.telemetry.timing('draw', time.perf_counter() - t0)
+
+    def on_draw(self, event):
+        '''Save background after full redraw (eg on scroll or resize)'''
+        self.background = self.canvas_preview.copy_from_bbox(self.ax_preview.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.data.values():
+            self.ax_preview.draw_artist(artist)
 
     def clear_data(self):
         blank = np.zeros((1, 2))
+        for buffer in self.buffers.values():
+            buffer.clear()
+        for decimator in self.decimators.values():
+            decimator.clear()
         for name, data in self.data.items():
             data_type = type(self.data[name])
             if data_type == matplotlib.lines.Line2D:
@@ -74,6 +188,8 @@ class LiveDataView(ttk.Frame):
                 self.data[name].set_data(np.concatenate([blank, blank]))
             elif data_type == matplotlib.collections.PathCollection:
                 self.data[name].set_offsets(blank)
+        self.x_last = None
+        self.dirty = False
 
         # Update view
         self.ax_preview.set_xlim([-self.x_history, 0])
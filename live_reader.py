@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+'''
+Read wheel data while it is being recorded
+
+Session must be recorded with `wheel.py --swmr`. Rows are read incrementally:
+each poll only reads rows committed since the last poll, up to the `n_rows`
+attribute kept by the writer. Reading never blocks the writer.
+
+Example:
+    with SessionTail('data/data.h5') as tail:
+        while True:
+            rows = tail.poll()
+            ...
+'''
+
+
+import argparse
+import time
+import h5py
+
+
+def find_sessions(hdf5_file, dataset='behavior/wheel'):
+    '''List groups in file containing `dataset`'''
+
+    sessions = []
+    def visit(name, obj):
+        if isinstance(obj, h5py.Group) and dataset in obj:
+            sessions.append(name)
+    hdf5_file.visititems(visit)
+    return sessions
+
+
+class SessionTail:
+    def __init__(self, filename, session=None, dataset='behavior/wheel'):
+        self.file = h5py.File(filename, 'r', libver='latest', swmr=True)
+
+        # Default to last session in file
+        if session is None:
+            sessions = find_sessions(self.file, dataset)
+            if not sessions:
+                self.file.close()
+                raise KeyError(f'No session with `{dataset}` found in {filename}')
+            session = sessions[-1]
+
+        self.session = session
+        self.dataset = self.file[f'{session}/{dataset}']
+        self.n_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def committed(self):
+        '''Number of rows readable'''
+        self.dataset.refresh()
+        return min(int(self.dataset.attrs.get('n_rows', 0)), self.dataset.shape[0])
+
+    def poll(self):
+        '''Read rows committed since last poll'''
+        n = self.committed()
+        rows = self.dataset[self.n_read:n]
+        self.n_read = n
+        return rows
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print wheel data as it is recorded')
+    parser.add_argument('file')
+    parser.add_argument('--session', help='Group of session (default: last in file)')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between polls')
+    args = parser.parse_args()
+
+    with SessionTail(args.file, args.session) as tail:
+        print(f'Reading {tail.session}')
+        try:
+            while True:
+                rows = tail.poll()
+                if len(rows):
+                    print(f'{tail.n_read} rows, last: {rows[-1].tolist()}')
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
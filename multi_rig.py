@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+
+'''
+Run several wheel rigs from one process
+
+Each rig (serial port) has its own `acquisition.Session`, with its own serial
+reader thread, ring buffer, cache and HDF5 writer. A single Tk timer polls all
+rigs. Each rig is shown as one compact row with status, sample count, time
+left and a trace of recent movement. Traces are drawn on a Tk canvas from
+min/max decimated data (see `series_buffer`), so matplotlib isn't loaded.
+
+Parameters are shared by all rigs. Each rig records to its own HDF5 file in
+`data_dir`. Connecting (parameter upload) and finalizing files run in the
+background so one rig doesn't hold up the others.
+
+Usage:
+    python multi_rig.py --port /dev/ttyACM0 --port /dev/ttyACM1 --duration 30
+'''
+
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import threading
+import tkinter as tk
+import tkinter.ttk as ttk
+import numpy as np
+import acquisition
+import protocol
+import serial_link
+from series_buffer import MinMaxDecimator
+
+
+# Formatting
+entry_width = 10
+px = 15
+py = 5
+px1 = 5
+
+
+class Rig:
+    '''One rig, independent of GUI
+    States: idle -> connecting -> ready -> recording -> finalizing -> idle
+    Call `poll` regularly to record data and advance state. If `poll` fails,
+    call `fail`; rig stays in error state until `disconnect`.
+    '''
+
+    def __init__(self, name, port, x_history=30000, trace_width=300, **session_kwargs):
+        self.name = name
+        self.port = port
+        self.x_history = x_history
+        self.session_kwargs = session_kwargs    # See `acquisition.Session`
+
+        self.trace = MinMaxDecimator(x_history / trace_width)
+        self.session = None
+        self.thread = None
+        self.error = None
+        self.state = 'idle'
+        self.message = ''
+        self.last_ts = 0
+
+    def run_background(self, func, *args):
+        '''Run `func` in thread; result (or exception) is kept in `error`'''
+
+        def target():
+            try:
+                self.error = func(*args)
+            except Exception as err:
+                self.error = err
+        self.error = None
+        self.thread = threading.Thread(target=target, name=self.name, daemon=True)
+        self.thread.start()
+
+    def connect(self, parameters):
+        '''Open port and upload parameters in background'''
+
+        if self.state != 'idle': return
+        self.session = acquisition.Session(parameters, **self.session_kwargs)
+        self.state = 'connecting'
+        self.message = 'Uploading parameters...'
+        self.run_background(self.session.connect, self.port)
+
+    def disconnect(self):
+        if self.state not in ['ready', 'error']: return
+        try:
+            self.session.close()
+        except Exception as err:
+            print(f'{self.name}: error closing port: {err}')
+        self.state = 'idle'
+        self.message = ''
+
+    def fail(self, err):
+        '''Stop using rig after error in `poll`'''
+        self.state = 'error'
+        self.message = f'Error: {err}'
+        print(f'{self.name}: {self.message}')
+
+    def start(self, hdf5_filename, subject='?', weight=0):
+        if self.state != 'ready': return
+        self.trace.clear()
+        self.last_ts = 0
+        try:
+            self.session.start(hdf5_filename=hdf5_filename, subject=subject, weight=weight)
+        except OSError as err:
+            self.message = f'File error: {err}'
+            return
+        self.state = 'recording'
+        self.message = hdf5_filename
+
+    def stop(self):
+        if self.state != 'recording': return
+        self.session.stop()
+        self.message = 'Stopping...'
+
+    def time_left(self):
+        if self.state != 'recording': return None
+        end_time = self.session.start_time + timedelta(minutes=self.session.parameters['session_dur'])
+        return max(end_time - datetime.now(), timedelta(0))
+
+    def poll(self):
+        '''Finish background tasks and record data received since last poll'''
+
+        if self.thread is not None and not self.thread.is_alive():
+            self.thread = None
+            if self.state == 'connecting':
+                if self.error:
+                    self.state = 'idle'
+                    self.message = f'Error connecting: {self.error}'
+                else:
+                    self.state = 'ready'
+                    self.message = 'Ready to start'
+            elif self.state == 'finalizing':
+                self.session.close()
+                self.state = 'idle'
+                if self.error:
+                    self.message = f'Error saving data: {self.error}'
+                else:
+                    self.message = f"Saved {self.session.counter['wheel']} samples to {self.session.hdf5_filename}"
+
+        if self.state != 'recording': return
+
+        new = self.session.poll()
+        if 'wheel' in new:
+            self.trace.append(new['wheel'])
+            self.last_ts = new['wheel'][-1, 0]
+
+        if self.session.finished:
+            self.state = 'finalizing'
+            self.message = 'Finalizing data...'
+            end_time = datetime.now().strftime('%H:%M:%S')
+            self.run_background(lambda: self.session.finalize(end_time=end_time))
+
+
+class RigPanel:
+    '''Compact row of widgets for one rig'''
+
+    def __init__(self, parent, rig, row, connect, start, trace_width=300, trace_height=40, ylim=(-25, 50)):
+        self.rig = rig
+        self.trace_width = trace_width
+        self.trace_height = trace_height
+        self.ylim = ylim
+
+        self.var_state = tk.StringVar()
+        self.var_count = tk.StringVar()
+        self.var_time_left = tk.StringVar()
+        self.var_message = tk.StringVar()
+
+        self.entry_subject = ttk.Entry(parent, width=entry_width)
+        self.button_upload = ttk.Button(parent, text='Upload', width=7, command=lambda: connect(rig))
+        self.button_start = ttk.Button(parent, text='Start', width=7, command=lambda: start(rig))
+        self.button_stop = ttk.Button(parent, text='Stop', width=7, command=rig.stop)
+        self.canvas = tk.Canvas(parent, width=trace_width, height=trace_height, background='white', highlightthickness=0)
+        self.line = self.canvas.create_line(0, 0, 0, 0, fill='#1f77b4')
+
+        tk.Label(parent, text=rig.name, anchor='w').grid(row=row, column=0, sticky='w', padx=px1)
+        tk.Label(parent, text=rig.port, anchor='w').grid(row=row, column=1, sticky='w', padx=px1)
+        self.entry_subject.grid(row=row, column=2, padx=px1)
+        self.button_upload.grid(row=row, column=3)
+        self.button_start.grid(row=row, column=4)
+        self.button_stop.grid(row=row, column=5)
+        tk.Label(parent, textvariable=self.var_state, width=10, anchor='w').grid(row=row, column=6, padx=px1)
+        tk.Label(parent, textvariable=self.var_count, width=8, anchor='e').grid(row=row, column=7, padx=px1)
+        tk.Label(parent, textvariable=self.var_time_left, width=8, anchor='e').grid(row=row, column=8, padx=px1)
+        self.canvas.grid(row=row, column=9, padx=px1, pady=1)
+        tk.Label(parent, textvariable=self.var_message, anchor='w').grid(row=row, column=10, sticky='w', padx=px1)
+
+        self.update()
+
+    def update(self):
+        '''Show current state of rig'''
+
+        rig = self.rig
+        self.var_state.set(rig.state)
+        self.var_count.set(rig.session.counter['wheel'] if rig.session else '')
+        time_left = rig.time_left()
+        self.var_time_left.set(str(time_left).split('.')[0] if time_left is not None else '')
+        self.var_message.set(rig.message)
+
+        self.button_upload['state'] = 'normal' if rig.state == 'idle' else 'disabled'
+        self.button_start['state'] = 'normal' if rig.state == 'ready' else 'disabled'
+        self.button_stop['state'] = 'normal' if rig.state == 'recording' else 'disabled'
+        self.entry_subject['state'] = 'normal' if rig.state in ['idle', 'ready'] else 'disabled'
+
+        self.draw_trace()
+
+    def draw_trace(self):
+        rig = self.rig
+        x_min = rig.last_ts - rig.x_history
+        points = rig.trace.window(x_min)
+        if len(points) < 2:
+            self.canvas.coords(self.line, 0, 0, 0, 0)
+            return
+
+        y_min, y_max = self.ylim
+        x = (points[:, 0] - x_min) / rig.x_history * self.trace_width
+        y = (1 - (np.clip(points[:, 1], y_min, y_max) - y_min) / (y_max - y_min)) * (self.trace_height - 1)
+        self.canvas.coords(self.line, *np.column_stack([x, y]).ravel().tolist())
+
+
+class MultiRig(tk.Frame):
+    def __init__(self, parent, ports, data_dir='data', emulate_wheel=False, session_dur=1, track_period=50,
+                 baudrate=115200, camera_fps=0, decode_mode=1, refresh_rate=10, display_rate=100, **session_kwargs):
+        super().__init__(parent)
+        self.parent = parent
+        self.data_dir = data_dir
+        self.refresh_rate = refresh_rate        # Rate to poll rigs (ms)
+        self.display_rate = display_rate        # Rate to update display (ms)
+        self.n_ticks = 0
+        self.closing = False
+
+        self.var_sess_dur = tk.IntVar()
+        self.var_rec_zeros = tk.IntVar()
+        self.var_emulate_wheel = tk.IntVar()
+        self.var_track_per = tk.IntVar()
+        self.var_binary_frames = tk.IntVar()
+        self.var_baudrate = tk.IntVar()
+        self.var_camera_fps = tk.IntVar()
+        self.var_send_period = tk.IntVar()
+        self.var_decode_mode = tk.IntVar()
+
+        self.var_sess_dur.set(session_dur)
+        self.var_rec_zeros.set(1)
+        self.var_emulate_wheel.set(emulate_wheel)
+        self.var_track_per.set(track_period)
+        self.var_binary_frames.set(1)
+        self.var_baudrate.set(baudrate)
+        self.var_camera_fps.set(camera_fps)
+        self.var_send_period.set(10)
+        self.var_decode_mode.set(decode_mode)
+
+        # IMPORTANT: keep in same order as `GetParams()` in track_wheel.ino
+        self.parameters = {
+            'emulate_wheel': self.var_emulate_wheel,
+            'session_dur': self.var_sess_dur,
+            'record_zeros': self.var_rec_zeros,
+            'track_period': self.var_track_per,
+            'binary_frames': self.var_binary_frames,
+            'baudrate': self.var_baudrate,
+            'camera_fps': self.var_camera_fps,
+            'send_period': self.var_send_period,
+            'decode_mode': self.var_decode_mode,
+        }
+
+        # Lay out GUI
+        frame_params = tk.Frame(self)
+        frame_buttons = tk.Frame(self)
+        frame_rigs = tk.Frame(self)
+        frame_params.grid(row=0, column=0, sticky='w', padx=px, pady=py)
+        frame_buttons.grid(row=1, column=0, sticky='w', padx=px, pady=py)
+        frame_rigs.grid(row=2, column=0, sticky='we', padx=px, pady=py)
+
+        ## Parameters
+        self.entry_session_dur = ttk.Entry(frame_params, textvariable=self.var_sess_dur, width=entry_width)
+        self.entry_track_period = ttk.Entry(frame_params, textvariable=self.var_track_per, width=entry_width)
+        self.entry_rec_zeros = ttk.Checkbutton(frame_params, variable=self.var_rec_zeros)
+        self.entry_binary_frames = ttk.Checkbutton(frame_params, variable=self.var_binary_frames)
+        self.entry_baudrate = ttk.Combobox(frame_params, textvariable=self.var_baudrate, values=protocol.baudrates, width=entry_width,
+                                           state='readonly')
+        self.entry_camera_fps = ttk.Entry(frame_params, textvariable=self.var_camera_fps, width=entry_width)
+        tk.Label(frame_params, text='Session duration (min): ').grid(row=0, column=0, sticky='e')
+        tk.Label(frame_params, text='Track period (ms): ').grid(row=0, column=2, sticky='e')
+        tk.Label(frame_params, text='Record zeros: ').grid(row=0, column=4, sticky='e')
+        tk.Label(frame_params, text='Binary frames: ').grid(row=0, column=6, sticky='e')
+        tk.Label(frame_params, text='Baud rate: ').grid(row=0, column=8, sticky='e')
+        tk.Label(frame_params, text='Camera fps: ').grid(row=0, column=10, sticky='e')
+        self.entry_session_dur.grid(row=0, column=1, sticky='w')
+        self.entry_track_period.grid(row=0, column=3, sticky='w')
+        self.entry_rec_zeros.grid(row=0, column=5, sticky='w')
+        self.entry_binary_frames.grid(row=0, column=7, sticky='w')
+        self.entry_baudrate.grid(row=0, column=9, sticky='w')
+        self.entry_camera_fps.grid(row=0, column=11, sticky='w')
+        self.obj_params = [
+            self.entry_session_dur, self.entry_track_period, self.entry_rec_zeros,
+            self.entry_binary_frames, self.entry_baudrate, self.entry_camera_fps,
+        ]
+
+        ## Buttons for all rigs
+        ttk.Button(frame_buttons, text='Upload all', command=self.connect_all).grid(row=0, column=0)
+        ttk.Button(frame_buttons, text='Start all', command=self.start_all).grid(row=0, column=1)
+        ttk.Button(frame_buttons, text='Stop all', command=self.stop_all).grid(row=0, column=2)
+        ttk.Button(frame_buttons, text='Reset all', command=self.disconnect_all).grid(row=0, column=3)
+
+        ## Rigs
+        for column, text in enumerate(['Rig', 'Port', 'Subject', '', '', '', 'State', 'Samples', 'Time left', 'Wheel', '']):
+            tk.Label(frame_rigs, text=text, anchor='w').grid(row=0, column=column, sticky='w', padx=px1)
+        self.rigs = []
+        self.panels = []
+        for i, port in enumerate(ports):
+            rig = Rig(f'rig{i + 1}', port, **session_kwargs)
+            self.rigs.append(rig)
+            self.panels.append(RigPanel(frame_rigs, rig, i + 1, self.connect, self.start))
+
+        self.tick()
+
+    def get_parameters(self):
+        '''Values of parameter entries; raises ValueError if one isn't a number'''
+
+        parameters = {}
+        for key, value in self.parameters.items():
+            try:
+                parameters[key] = value.get()
+            except tk.TclError:
+                raise ValueError(f'Invalid value for {key}: {self.parent.getvar(str(value))!r}')
+        return parameters
+
+    def connect(self, rig):
+        try:
+            parameters = self.get_parameters()
+        except ValueError as err:
+            rig.message = str(err)
+            return
+        try:
+            serial_link.check_link_budget(parameters)
+        except serial_link.LinkBudgetError as err:
+            rig.message = str(err)
+            return
+        rig.connect(parameters)
+
+    def start(self, rig):
+        panel = self.panels[self.rigs.index(rig)]
+        os.makedirs(self.data_dir, exist_ok=True)
+        filename = os.path.join(self.data_dir, f"{rig.name}-{datetime.now().strftime('%y%m%d-%H%M%S')}.h5")
+        rig.start(filename, subject=panel.entry_subject.get() or '?')
+
+    def connect_all(self):
+        for rig in self.rigs: self.connect(rig)
+
+    def start_all(self):
+        for rig in self.rigs: self.start(rig)
+
+    def stop_all(self):
+        for rig in self.rigs: rig.stop()
+
+    def disconnect_all(self):
+        for rig in self.rigs: rig.disconnect()
+
+    def tick(self):
+        '''Poll all rigs; update display every `display_rate`
+        Error in one rig puts it in error state without stopping the others.
+        '''
+
+        self.parent.after(self.refresh_rate, self.tick)
+
+        for rig in self.rigs:
+            try:
+                rig.poll()
+            except Exception as err:
+                rig.fail(err)
+
+        self.n_ticks += 1
+        if self.n_ticks * self.refresh_rate >= self.display_rate:
+            self.n_ticks = 0
+            for panel in self.panels:
+                panel.update()
+            # Parameters are shared, so can only change when all rigs are idle
+            editable = all(rig.state == 'idle' for rig in self.rigs)
+            for obj in self.obj_params:
+                obj['state'] = 'disabled' if not editable else 'readonly' if obj is self.entry_baudrate else 'normal'
+
+    def close(self):
+        '''Stop recording rigs and wait for files to be finalized before closing window'''
+
+        if not self.closing:
+            self.closing = True
+            self.stop_all()
+        if any(rig.state in ['connecting', 'recording', 'finalizing'] for rig in self.rigs):
+            self.parent.after(100, self.close)
+            return
+        self.disconnect_all()
+        self.parent.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several wheel rigs from one process')
+    parser.add_argument('--port', action='append', required=True, help='Serial port or pyserial URL of rig (repeat for each rig)')
+    parser.add_argument('--duration', type=int, default=1, help='Session duration (min)')
+    parser.add_argument('--track-period', type=int, default=50, help='Track period (ms)')
+    parser.add_argument('--baudrate', type=int, default=115200, choices=protocol.baudrates)
+    parser.add_argument('--camera-fps', type=int, default=0, help='Record camera strobe on pin 8, expected frame rate (0 to disable)')
+    parser.add_argument('--decode-mode', type=int, default=1, choices=protocol.decode_modes,
+                        help='Encoder counts per cycle (4: every edge of both channels)')
+    parser.add_argument('--data-dir', default='data', help='Directory for HDF5 files (one per rig and session)')
+    parser.add_argument('--emulate-wheel', action='store_true')
+    parser.add_argument('--cache-size', type=int, default=500)
+    parser.add_argument('--flush-interval', type=float, default=1, help='Max seconds between HDF5 flushes')
+    parser.add_argument('--flush-rows', type=int, default=10000, help='Max rows written between HDF5 flushes')
+    parser.add_argument('--swmr', action='store_true', help='Allow other processes to read HDF5 files while recording')
+    parser.add_argument('--print-arduino', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    root.wm_title('Wheel rigs')
+    multi_rig = MultiRig(
+        root, args.port, data_dir=args.data_dir, emulate_wheel=args.emulate_wheel,
+        session_dur=args.duration, track_period=args.track_period, baudrate=args.baudrate,
+        camera_fps=args.camera_fps, decode_mode=args.decode_mode, cache_size=args.cache_size, flush_interval=args.flush_interval, flush_rows=args.flush_rows,
+        swmr=args.swmr, print_arduino=args.print_arduino, verbose=args.verbose
+    )
+    multi_rig.grid()
+    root.protocol('WM_DELETE_WINDOW', multi_rig.close)
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+'''
+Serial protocol for data sent from Arduino
+
+Samples are sent as triplets of (code, timestamp, value). Two formats are
+supported and chosen when parameters are uploaded to the Arduino:
+
+- ASCII: comma-separated line, eg `7,1250,3\n`
+- Binary: fixed-size little-endian frame
+
+Binary frame layout (9 bytes):
+
+    byte  0     sync byte (0xA5)
+    byte  1     code (uint8)
+    bytes 2-5   timestamp (uint32)
+    bytes 6-7   value (int16)
+    byte  8     checksum, XOR of bytes 1-7
+
+Keep in sync with `WriteSample()` in track_wheel.ino.
+'''
+
+
+import re
+import numpy as np
+
+
+# Parameters in order read by `GetParams()` in track_wheel.ino
+# Sent as `D<p0>+<p1>+...+<code_last_param>`
+parameter_names = [
+    'emulate_wheel',
+    'session_dur',
+    'record_zeros',
+    'track_period',
+    'binary_frames',
+    'baudrate',
+    'camera_fps',
+    'send_period',
+    'decode_mode',
+]
+code_last_param = 271828
+
+# Serial runs at `default_baudrate` until parameters are processed. If another
+# baud rate was requested, Arduino sends `baudrate_switch` line and changes.
+default_baudrate = 9600
+baudrate_switch = 'Switching baud rate'
+baudrates = [9600, 57600, 115200, 250000, 500000, 1000000, 2000000]
+
+# Sent to Arduino during session; Arduino replies right away with
+# `code_sync` sample (see `clock_sync`)
+code_ping = 'P'
+code_sync = 8
+
+# Sent when samples were dropped because serial output couldn't keep up;
+# value is number of samples dropped since last report
+code_dropped = 9
+
+# Camera frame (strobe rising edge), captured by interrupt. Timestamp is
+# microseconds since session start (wraps every ~71.6 min); value is frame
+# index (wraps at 2^15), so gaps show frames that were lost.
+code_camera = 5
+camera_ts_max = 2**32
+camera_index_max = 2**15
+
+# Encoder decoding: 1 counts rising edges of A; 4 counts every edge of A and B.
+# In 4x mode, transitions that skip a state (missed edge) are reported with
+# `code_encoder_error`; value is number of errors since last report.
+decode_modes = [1, 4]
+code_encoder_error = 10
+
+# Sent to Arduino while it waits for parameters or start signal; Arduino
+# replies with `firmware_id` line
+code_identify = '?'
+firmware_id = 'track_wheel'
+
+frame_sync = 0xA5
+frame_dtype = np.dtype([
+    ('sync', '<u1'),
+    ('code', '<u1'),
+    ('ts', '<u4'),
+    ('value', '<i2'),
+    ('checksum', '<u1'),
+])
+frame_size = frame_dtype.itemsize
+
+_sync_byte = bytes([frame_sync])
+_line_pattern = re.compile(rb'^(-?\d+),(-?\d+),(-?\d+)\r?$', re.MULTILINE)
+
+# Longest line kept while waiting for newline. Anything longer is not a sample.
+max_line_length = 256
+
+
+def sample_size(binary=True, ts_max=10**7):
+    '''Bytes sent per sample
+    For ASCII, assumes one-digit code, `ts_max` for timestamp and three
+    characters for value.
+    '''
+    if binary: return frame_size
+    return 1 + 1 + len(str(int(ts_max))) + 1 + 3 + 2
+
+
+def link_utilization(track_period, baudrate, binary=True, session_dur=60, camera_fps=0):
+    '''Fraction of serial bandwidth used by samples every `track_period` (ms)
+    and camera frames at `camera_fps` (Hz). Each byte takes 10 bits (start, 8
+    data, stop). Above 1, samples are dropped by Arduino. `session_dur` (min)
+    sets length of ASCII timestamps.
+    '''
+    bytes_per_s = 1000 / max(track_period, 1) * sample_size(binary, session_dur * 60000) + \
+        camera_fps * sample_size(binary, camera_ts_max)
+    return bytes_per_s * 10 / baudrate
+
+
+def encode_frames(samples):
+    '''Encode samples as binary frames
+    `samples` is an (N, 3) array-like of (code, ts, value). Mainly useful for
+    emulating the Arduino.
+    '''
+
+    samples = np.asarray(samples, dtype=np.int64).reshape(-1, 3)
+    frames = np.zeros(len(samples), dtype=frame_dtype)
+    frames['sync'] = frame_sync
+    frames['code'] = samples[:, 0]
+    frames['ts'] = samples[:, 1]
+    frames['value'] = samples[:, 2]
+    raw = frames.view(np.uint8).reshape(-1, frame_size)
+    frames['checksum'] = np.bitwise_xor.reduce(raw[:, 1:frame_size - 1], axis=1)
+    return frames.tobytes()
+
+
+def _empty_samples():
+    return np.zeros((0, 3), dtype=np.int64)
+
+
+class AsciiDecoder:
+    '''Decode stream of comma-separated lines
+    Same interface as `FrameDecoder`. Complete lines in each chunk are parsed
+    at once; the trailing partial line is carried over to the next call. Lines
+    that are not samples are returned as junk so they can be echoed.
+    '''
+
+    def __init__(self):
+        self.carry = b''
+
+    def feed(self, data):
+        '''Decode chunk of bytes
+        Returns (samples, junk) where `samples` is an (N, 3) int64 array of
+        (code, ts, value) and `junk` is the lines that could not be parsed.
+        '''
+
+        buf = self.carry + bytes(data)
+        last_newline = buf.rfind(b'\n')
+        if last_newline < 0:
+            if len(buf) > max_line_length:
+                self.carry = b''
+                return _empty_samples(), buf
+            self.carry = buf
+            return _empty_samples(), b''
+        lines, self.carry = buf[:last_newline + 1], buf[last_newline + 1:]
+
+        matches = _line_pattern.findall(lines)
+        if len(matches) == lines.count(b'\n'):
+            junk = b''
+        else:
+            # Some lines aren't samples; find them for echoing
+            junk = b''.join(
+                line + b'\n' for line in lines.split(b'\n')[:-1]
+                if not _line_pattern.match(line)
+            )
+
+        if matches:
+            samples = np.array(matches).astype(np.int64)
+        else:
+            samples = _empty_samples()
+        return samples, junk
+
+
+class FrameDecoder:
+    '''Decode stream of binary frames
+    Bytes are fed in arbitrary chunks. Incomplete frames are carried over to
+    the next call. Bytes that are not part of a valid frame (eg text printed by
+    the Arduino) are returned separately so they can be echoed.
+    '''
+
+    def __init__(self):
+        self.carry = b''
+
+    def feed(self, data):
+        '''Decode chunk of bytes
+        Returns (samples, junk) where `samples` is an (N, 3) int64 array of
+        (code, ts, value) and `junk` is the bytes that could not be decoded.
+        '''
+
+        buf = self.carry + bytes(data)
+        pos = 0
+        blocks = []
+        junk = bytearray()
+
+        while len(buf) - pos >= frame_size:
+            if buf[pos] != frame_sync:
+                # Resynchronize on next sync byte
+                next_sync = buf.find(_sync_byte, pos + 1)
+                if next_sync < 0:
+                    next_sync = len(buf)
+                junk += buf[pos:next_sync]
+                pos = next_sync
+                continue
+
+            # Check all complete frames from current position at once
+            n = (len(buf) - pos) // frame_size
+            raw = np.frombuffer(buf, dtype=np.uint8, count=n * frame_size, offset=pos).reshape(n, frame_size)
+            valid = (raw[:, 0] == frame_sync) & \
+                (np.bitwise_xor.reduce(raw[:, 1:frame_size - 1], axis=1) == raw[:, -1])
+            n_valid = n if valid.all() else int(np.argmin(valid))
+            if not n_valid:
+                # False sync byte
+                junk.append(buf[pos])
+                pos += 1
+                continue
+
+            frames = np.frombuffer(buf, dtype=frame_dtype, count=n_valid, offset=pos)
+            blocks.append(frames)
+            pos += n_valid * frame_size
+
+        self.carry = buf[pos:]
+
+        if blocks:
+            frames = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+            samples = np.column_stack([frames['code'], frames['ts'], frames['value']]).astype(np.int64)
+        else:
+            samples = _empty_samples()
+        return samples, bytes(junk)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''
+Ring buffer for passing samples between threads
+
+Single producer (serial thread) writes batches of samples; single consumer
+(GUI) takes everything pending at once. Storage is preallocated and no locks
+are used: each side only moves its own index, and an index is only moved after
+the rows it covers have been written/read.
+'''
+
+
+import time
+import numpy as np
+
+
+class SampleRing:
+    def __init__(self, capacity=65536, width=3, dtype=np.int64):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, width), dtype=dtype)
+        self.head = 0       # Total rows written (only moved by producer)
+        self.tail = 0       # Total rows read (only moved by consumer)
+        self.dropped = 0    # Rows dropped because buffer was full
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def clear(self):
+        '''Discard pending rows
+        Only call when producer is not running.
+        '''
+
+        self.head = self.tail = 0
+        self.dropped = 0
+
+    def push(self, samples, timeout=1):
+        '''Add batch of rows
+        Waits up to `timeout` seconds for the consumer to make room. Rows that
+        still don't fit are dropped and counted in `dropped`.
+        '''
+
+        samples = np.asarray(samples)
+        wait_until = time.monotonic() + timeout
+        while len(samples):
+            free = self.capacity - (self.head - self.tail)
+            if not free:
+                if time.monotonic() >= wait_until:
+                    self.dropped += len(samples)
+                    return
+                time.sleep(0.001)
+                continue
+
+            n = min(len(samples), free)
+            start = self.head % self.capacity
+            first = min(n, self.capacity - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:n - first] = samples[first:n]
+            self.head += n
+            samples = samples[n:]
+
+    def pop_all(self):
+        '''Take all pending rows
+        Returns copy of rows as (N, width) array.
+        '''
+
+        n = self.head - self.tail
+        start = self.tail % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            samples = self.buffer[start:start + n].copy()
+        else:
+            samples = np.concatenate([self.buffer[start:], self.buffer[:n - first]])
+        self.tail += n
+        return samples
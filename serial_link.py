@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+
+'''
+Serial connection to Arduino without GUI
+
+Parameters are sent to Arduino after connection is opened. Message contains
+parameters with prefix and specific delimiter set by code, and ends with
+`code_last_param`. Arduino replies `0` when parameters are processed.
+
+Arduino resets when port is opened and announces it is ready with
+`greeting`. Parameters are sent as soon as it is seen (or after `delay` if it
+isn't). Waiting is done with blocking reads, so no CPU is used, in short steps
+so it can be cancelled.
+
+`Handshake` runs connection and upload in a background thread and reports
+progress, success and failure through callbacks.
+
+`identify_port` checks whether a port runs track_wheel.ino by its reply to
+`code_identify` (or its greeting, if board resets anyway). To disturb other
+devices as little as possible:
+
+- Ports are opened with an exclusive lock (as are ports used for sessions),
+  so a port in use by another process is skipped rather than read from.
+- Only ports with USB IDs of Arduino boards are checked. Generic USB-serial
+  chips (`bridge_vids`) are also used by other instruments, so they are only
+  checked if asked for (`include_bridges`).
+- Ports are opened with DTR and RTS off, so boards that reset when DTR is
+  asserted (eg Uno) keep running. Each device (by USB serial number) is still
+  checked only once; `PortMonitor` keeps results until the program exits.
+
+`PortMonitor` watches for ports being plugged in or removed and identifies
+new ones in the background.
+
+Usage:
+    python serial_link.py --probe /dev/ttyACM0 /dev/ttyACM1
+'''
+
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import serial
+import serial.tools.list_ports
+from protocol import code_last_param, code_identify, firmware_id, baudrate_switch, default_baudrate, link_utilization
+
+
+# First line sent by track_wheel.ino after reset
+greeting = 'Waiting for parameters'
+
+# USB vendor IDs of Arduino and compatible boards
+arduino_vids = {
+    0x2341,     # Arduino
+    0x2A03,     # Arduino (arduino.org)
+    0x239A,     # Adafruit
+    0x1B4F,     # SparkFun
+}
+
+# USB vendor IDs of generic USB-serial chips, used on Arduino clones but also
+# on other devices
+bridge_vids = {
+    0x1A86,     # WCH (CH340)
+    0x0403,     # FTDI
+    0x10C4,     # Silicon Labs (CP210x)
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+class Cancelled(UploadError):
+    pass
+
+
+class LinkBudgetError(UploadError):
+    pass
+
+
+def open_port(port, baudrate=default_baudrate, timeout=1, write_timeout=3):
+    '''Open serial port
+    `port` can be a device or a pyserial URL (eg `socket://localhost:5000`).
+    Port is locked so other processes (eg `identify_port`) can't open it.
+    '''
+
+    return serial.serial_for_url(
+        port, baudrate=baudrate, timeout=timeout, write_timeout=write_timeout, exclusive=True
+    )
+
+
+class LineReader:
+    '''Read lines from serial without busy-waiting
+    Blocks in `ser.read` for at most `step` seconds at a time so waiting can be
+    cancelled with `cancel` (`threading.Event`).
+    '''
+
+    def __init__(self, ser, echo=None, cancel=None, step=0.1):
+        self.ser = ser
+        self.echo = echo
+        self.cancel = cancel
+        self.step = step
+        self.buffer = b''
+
+    def readline(self, timeout):
+        '''Next line (without line ending), or None after `timeout` seconds'''
+
+        wait_until = time.monotonic() + timeout
+        ser_timeout = self.ser.timeout
+        self.ser.timeout = self.step
+        try:
+            while b'\n' not in self.buffer:
+                if self.cancel is not None and self.cancel.is_set():
+                    raise Cancelled('cancelled')
+                if time.monotonic() >= wait_until:
+                    return None
+                self.buffer += self.ser.read(max(self.ser.in_waiting, 1))
+        finally:
+            self.ser.timeout = ser_timeout
+
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        line = line.decode(errors='replace')
+        if self.echo: self.echo(line + '\n')
+        return line.rstrip()
+
+    def wait_for(self, text, timeout):
+        '''Read lines until one contains `text`; returns False on timeout'''
+
+        wait_until = time.monotonic() + timeout
+        while True:
+            line = self.readline(wait_until - time.monotonic())
+            if line is None: return False
+            if text in line: return True
+
+
+def check_link_budget(parameters, warn_at=0.8):
+    '''Check that samples fit in serial bandwidth
+    Raises `LinkBudgetError` if samples can't be sent as fast as they're
+    taken. Returns warning message if close to limit (`warn_at`), otherwise
+    None.
+    '''
+
+    baudrate = parameters.get('baudrate') or default_baudrate
+    camera_fps = parameters.get('camera_fps', 0)
+    utilization = link_utilization(
+        parameters['track_period'], baudrate,
+        binary=parameters.get('binary_frames', 0), session_dur=parameters.get('session_dur', 60),
+        camera_fps=camera_fps
+    )
+    source = f"Track period of {parameters['track_period']} ms"
+    if camera_fps: source += f' and camera at {camera_fps} fps'
+    message = f'{source} needs {utilization:.0%} of serial bandwidth at {baudrate} baud'
+    if utilization > 1:
+        raise LinkBudgetError(message + '; increase baud rate or track period')
+    if utilization > warn_at:
+        return message + '; samples may be dropped'
+
+
+def upload_parameters(ser, values, delay=3, timeout=10, code_params='D', delim='+', echo=None, verbose=False,
+                      cancel=None, progress=None, baudrate=None):
+    '''Send parameters to Arduino and wait for confirmation
+    Waits up to `delay` seconds for Arduino to reset after connection is
+    opened. Lines from Arduino are passed to `echo` (if given), and steps are
+    reported to `progress` (if given). Raises `UploadError` if parameters
+    can't be sent or aren't confirmed within `timeout` seconds, or `Cancelled`
+    if `cancel` (`threading.Event`) is set.
+
+    If `baudrate` is given (and is one of parameters), port is changed to it
+    when Arduino does.
+    '''
+
+    reader = LineReader(ser, echo=echo, cancel=cancel)
+
+    # Handle opening message from serial
+    if progress: progress('Waiting for Arduino...')
+    if not reader.wait_for(greeting, delay) and verbose:
+        print('No greeting from Arduino, sending parameters anyway')
+
+    # Send parameters to Arduino
+    values = list(values) + [code_last_param]
+    ser_msg = code_params + delim.join(str(s) for s in values)
+    if verbose: print('Sending parameters as `{}`'.format(ser_msg))
+    if progress: progress('Sending parameters...')
+    try:
+        ser.write(ser_msg.encode())
+    except serial.SerialTimeoutException:
+        raise UploadError('write timeout')
+
+    # Ensure parameters processed
+    upload_code = reader.readline(timeout)
+    if upload_code is None:
+        raise UploadError('start signal not found')
+    if upload_code != '0':
+        raise UploadError(f'exit code {upload_code}')
+
+    # Change baud rate along with Arduino, then check it still responds
+    if baudrate and baudrate != ser.baudrate:
+        if progress: progress(f'Switching to {baudrate} baud...')
+        if not reader.wait_for(baudrate_switch, timeout):
+            raise UploadError('baud rate not changed')
+        ser.baudrate = baudrate
+        reader.buffer = b''
+        if not reader.wait_for('Waiting for start signal', timeout):
+            raise UploadError(f'no response at {baudrate} baud')
+
+
+class Handshake(threading.Thread):
+    '''Open serial port and upload parameters in background
+    `ser` is an unopened `serial.Serial` (or URL handler), with port set.
+    Callbacks are called as `on_progress(message)`, `on_success(ser)` and
+    `on_failure(error)`. They run in this thread unless `dispatch` is given, in
+    which case they're called as `dispatch(callback, arg)`, eg to pass them to
+    a GUI thread. Port is closed on failure. Call `cancel` to abort.
+    '''
+
+    def __init__(self, ser, values, on_progress=None, on_success=None, on_failure=None, dispatch=None, **kwargs):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.values = list(values)
+        self.on_progress = on_progress
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.dispatch = dispatch
+        self.kwargs = kwargs        # See `upload_parameters`
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def callback(self, func, arg):
+        if func is None: return
+        if self.dispatch:
+            self.dispatch(func, arg)
+        else:
+            func(arg)
+
+    def run(self):
+        try:
+            self.callback(self.on_progress, 'Opening port...')
+            self.ser.baudrate = default_baudrate      # Arduino restarts at default
+            self.ser.open()
+            upload_parameters(
+                self.ser, self.values, cancel=self.cancelled,
+                progress=lambda message: self.callback(self.on_progress, message),
+                **self.kwargs
+            )
+        except (serial.SerialException, UploadError) as err:
+            self.ser.close()
+            self.callback(self.on_failure, err)
+        else:
+            self.callback(self.on_success, self.ser)
+
+
+def is_arduino(port_info, include_bridges=False):
+    '''Whether port (from `serial.tools.list_ports`) may be an Arduino'''
+    return port_info.vid in arduino_vids or (include_bridges and port_info.vid in bridge_vids)
+
+
+def device_key(port_info):
+    '''Identifies device across ports and reconnections (if it has a serial number)'''
+    if port_info.serial_number:
+        return (port_info.vid, port_info.pid, port_info.serial_number)
+    return (port_info.vid, port_info.pid, port_info.device)
+
+
+def identify_port(port, timeout=3, query_after=1):
+    '''Whether `port` has Arduino running track_wheel.ino
+    Port is opened with DTR and RTS off so boards that reset on DTR aren't
+    reset, and firmware is asked to identify itself right away. Query is
+    repeated every `query_after` seconds; greeting is also accepted in case
+    board resets anyway. Returns None if port can't be opened (eg in use).
+    '''
+
+    try:
+        ser = serial.serial_for_url(
+            port, do_not_open=True, baudrate=default_baudrate, timeout=1, write_timeout=1, exclusive=True
+        )
+        ser.dtr = False
+        ser.rts = False
+        ser.open()
+    except (serial.SerialException, OSError, ValueError):
+        return None
+    try:
+        reader = LineReader(ser)
+        wait_until = time.monotonic() + timeout
+        query_at = time.monotonic()
+        while True:
+            if time.monotonic() >= query_at:
+                ser.write(code_identify.encode())
+                query_at = time.monotonic() + query_after
+            line = reader.readline(max(min(query_at, wait_until) - time.monotonic(), 0))
+            if line is not None and (greeting in line or line == firmware_id): return True
+            if time.monotonic() >= wait_until: return False
+    except serial.SerialException:
+        return False
+    finally:
+        ser.close()
+
+
+def probe_ports(ports=None, timeout=3, include_bridges=False):
+    '''Identify ports in parallel
+    Returns dict of port: whether it has Arduino running track_wheel.ino
+    (None if it couldn't be opened). Checks ports of Arduino boards by
+    default (see `is_arduino`).
+    '''
+
+    if ports is None:
+        ports = [
+            port.device for port in serial.tools.list_ports.comports() if is_arduino(port, include_bridges)
+        ]
+    if not ports: return {}
+    with ThreadPoolExecutor(len(ports)) as executor:
+        found = executor.map(lambda port: identify_port(port, timeout), ports)
+    return dict(zip(ports, found))
+
+
+class PortMonitor(threading.Thread):
+    '''Watch serial ports in background
+    Lists ports every `interval` seconds and identifies new Arduino ports in
+    parallel (see `identify_port`, `is_arduino`), skipping ports for which
+    `exclude(device)` is true (eg port in use). Each device is identified
+    once: results are kept by device (see `device_key`), so devices aren't
+    reset again when listed again or plugged back in. Ports that couldn't be
+    opened (eg in use by another program) are tried again on `refresh`.
+
+    Calls `on_change(ports)` whenever list or identification changes, with
+    dict of device: (description, firmware) where firmware is True/False, or
+    None if not (yet) identified. Callback is passed through `dispatch` if
+    given (see `Handshake`).
+    '''
+
+    def __init__(self, on_change, interval=1, identify=True, exclude=None, dispatch=None, timeout=3,
+                 include_bridges=False):
+        super().__init__(name='port_monitor', daemon=True)
+        self.on_change = on_change
+        self.interval = interval
+        self.identify = identify
+        self.exclude = exclude
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.include_bridges = include_bridges
+
+        self.ports = {}
+        self.keys = {}              # Device: key of device on port (see `device_key`)
+        self.results = {}           # Key: whether device runs firmware
+        self.busy = set()           # Keys of devices that couldn't be opened
+        self.pending = set()        # Ports being identified
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(4, thread_name_prefix='identify')
+
+    def refresh(self):
+        '''List ports now and try again ports that couldn't be opened'''
+        with self.lock:
+            self.busy.clear()
+        self.wake.set()
+
+    def identifying(self, device):
+        '''Whether port is being identified (and so is locked by probe)'''
+        with self.lock:
+            return device in self.pending
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        self.executor.shutdown(wait=False)
+
+    def notify(self):
+        with self.lock:
+            ports = dict(self.ports)
+        if self.dispatch:
+            self.dispatch(self.on_change, ports)
+        else:
+            self.on_change(ports)
+
+    def identified(self, device, key, future):
+        found = future.result()
+        with self.lock:
+            self.pending.discard(device)
+            if found is None:
+                self.busy.add(key)
+            else:
+                self.results[key] = found
+            if self.keys.get(device) != key: return
+            self.ports[device] = (self.ports[device][0], found)
+        self.notify()
+
+    def scan(self):
+        '''List ports; returns whether list changed'''
+
+        ports_info = {port.device: port for port in serial.tools.list_ports.comports()}
+        with self.lock:
+            changed = set(ports_info) != set(self.ports)
+            self.keys = {device: device_key(port) for device, port in ports_info.items()}
+            self.ports = {}
+            to_identify = []
+            for device, port in ports_info.items():
+                key = self.keys[device]
+                if not (self.identify and is_arduino(port, self.include_bridges)):
+                    firmware = False
+                else:
+                    firmware = self.results.get(key)
+                    if (firmware is None and key not in self.busy and device not in self.pending
+                            and not (self.exclude and self.exclude(device))):
+                        to_identify.append(device)
+                self.ports[device] = (port.description, firmware)
+            self.pending.update(to_identify)
+        for device in to_identify:
+            future = self.executor.submit(identify_port, device, self.timeout)
+            future.add_done_callback(
+                lambda future, device=device, key=self.keys[device]: self.identified(device, key, future)
+            )
+        return changed
+
+    def run(self):
+        refreshed = True
+        while not self.stopped.is_set():
+            if self.scan() or refreshed:
+                self.notify()
+            refreshed = self.wake.wait(self.interval)
+            self.wake.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check serial ports for Arduino running track_wheel.ino')
+    parser.add_argument('--probe', nargs='*', metavar='PORT', help='Ports to probe (default: ports of Arduino boards)')
+    parser.add_argument('--include-bridges', action='store_true',
+                        help='Also probe generic USB-serial chips (FTDI, CP210x, CH340) by default')
+    parser.add_argument('--timeout', type=float, default=3)
+    args = parser.parse_args()
+
+    for port, found in probe_ports(args.probe or None, args.timeout, args.include_bridges).items():
+        print(f"{port}: {'found' if found else 'busy' if found is None else 'not found'}")
+
+
+if __name__ == '__main__':
+    main()
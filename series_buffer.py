@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+'''
+Buffers of (x, y) points for live plots
+
+Kept apart from plotting so they can be used without matplotlib (see
+`live_data_view` and `multi_rig`).
+'''
+
+import numpy as np
+
+
+class SeriesBuffer:
+    '''Ring buffer of (x, y) points
+    Each point is written twice (at `i` and `i + capacity`) so the last
+    `capacity` points are always available as a contiguous view without
+    copying. Points are expected in order of increasing x.
+    '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, 2))
+        self.n = 0      # Total points added
+
+    def __len__(self):
+        return min(self.n, self.capacity)
+
+    def append(self, xy):
+        '''Add (N, 2) array of points'''
+        xy = xy[-self.capacity:]
+        start = self.n % self.capacity
+        first = min(len(xy), self.capacity - start)
+        rest = len(xy) - first
+        for offset in (0, self.capacity):
+            self.data[offset + start:offset + start + first] = xy[:first]
+            self.data[offset:offset + rest] = xy[first:]
+        self.n += len(xy)
+
+    def view(self):
+        '''All points in buffer, oldest first'''
+        start = (self.n - len(self)) % self.capacity
+        return self.data[start:start + len(self)]
+
+    def window(self, x_min):
+        '''Points with x greater than `x_min`'''
+        points = self.view()
+        ix = np.searchsorted(points[:, 0], x_min, side='right')
+        return points[ix:]
+
+    def clear(self):
+        self.n = 0
+
+
+class MinMaxDecimator:
+    '''Reduce points to min and max y per bin of x
+    Updated incrementally: completed bins are kept as two points each (in x
+    order) in a `SeriesBuffer`; the last bin stays open until a point arrives
+    in a later bin. Points are expected in order of increasing x.
+    '''
+
+    def __init__(self, bin_width, capacity=16384):
+        self.bin_width = bin_width
+        self.bins = SeriesBuffer(capacity)
+        self.open = np.zeros((0, 2))    # Min and max points of last bin
+
+    def append(self, xy):
+        '''Add (N, 2) array of points'''
+        if not len(xy): return
+        points = np.concatenate([self.open, xy])
+        bin_ids = np.floor(points[:, 0] / self.bin_width).astype(np.int64)
+
+        # Sort by y within each bin; first point is min, last is max
+        order = np.lexsort((points[:, 1], bin_ids))
+        bin_sorted = bin_ids[order]
+        starts = np.flatnonzero(np.r_[True, bin_sorted[1:] != bin_sorted[:-1]])
+        ends = np.r_[starts[1:], len(order)] - 1
+        ix_min, ix_max = order[starts], order[ends]
+        pairs = np.stack([
+            points[np.minimum(ix_min, ix_max)],
+            points[np.maximum(ix_min, ix_max)],
+        ], axis=1)
+
+        self.bins.append(pairs[:-1].reshape(-1, 2))
+        self.open = pairs[-1]
+
+    def window(self, x_min):
+        '''Decimated points with x greater than `x_min`'''
+        return np.concatenate([self.bins.window(x_min), self.open[self.open[:, 0] > x_min]])
+
+    def points(self):
+        '''All decimated points, oldest first'''
+        return np.concatenate([self.bins.view(), self.open])
+
+    def rebin(self, bin_width, xy=None):
+        '''New decimator with bins of `bin_width` and same history
+        Rebuilt from min and max points of current bins, so history is kept
+        beyond raw data (eg when plot is resized); a bin cut by a new bin edge
+        goes to the new bin of each of its points. Raw points `xy`, if given,
+        are used instead from their first x on.
+        '''
+        decimator = MinMaxDecimator(bin_width, self.bins.capacity)
+        points = self.points()
+        if xy is not None and len(xy):
+            points = np.concatenate([points[points[:, 0] < xy[0, 0]], xy])
+        decimator.append(points)
+        return decimator
+
+    def clear(self):
+        self.bins.clear()
+        self.open = np.zeros((0, 2))
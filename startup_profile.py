@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+'''
+Startup profile
+
+Records how long each module takes to import (including module-level
+initialization) and when startup reaches named points, eg first paint. Must be
+installed before the modules of interest are imported:
+
+    import startup_profile
+    startup_profile.install()
+    ...
+    startup_profile.mark('Window drawn')
+    startup_profile.report()
+
+Import time of a module includes the modules it imports first. Imports are
+timed per thread, so modules loaded in the background are reported separately.
+`mark` and `report` do nothing unless profile is installed.
+'''
+
+
+import builtins
+import sys
+import threading
+import time
+
+
+start = time.perf_counter()
+installed = False
+imports = []        # (thread name, module, seconds, depth)
+marks = []          # (thread name, label, seconds since start)
+_lock = threading.Lock()
+_local = threading.local()
+_import = builtins.__import__
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    '''Replacement for `__import__` that times first import of each module'''
+
+    if level or name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    t0 = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = depth
+        with _lock:
+            imports.append((threading.current_thread().name, name, time.perf_counter() - t0, depth))
+
+
+def install():
+    global installed
+    if installed: return
+    builtins.__import__ = timed_import
+    installed = True
+
+
+def uninstall():
+    global installed
+    builtins.__import__ = _import
+    installed = False
+
+
+def mark(label):
+    '''Record time since start at which `label` is reached'''
+    if not installed: return
+    with _lock:
+        marks.append((threading.current_thread().name, label, time.perf_counter() - start))
+
+
+def report(min_ms=1, file=None):
+    '''Print import times (top-level imports above `min_ms`) and marks'''
+
+    if not installed: return
+    file = file or sys.stdout
+    with _lock:
+        top = [entry for entry in imports if entry[3] == 0 and entry[2] * 1000 >= min_ms]
+        points = list(marks)
+
+    print('Startup profile', file=file)
+    print('  Imports (ms, including dependencies):', file=file)
+    for thread, name, seconds, _ in sorted(top, key=lambda entry: -entry[2]):
+        print(f'    {seconds * 1000:8.1f}  {name}  [{thread}]', file=file)
+    print(f'    {sum(entry[2] for entry in top) * 1000:8.1f}  total', file=file)
+    print('  Time since start (ms):', file=file)
+    for thread, label, seconds in points:
+        print(f'    {seconds * 1000:8.1f}  {label}  [{thread}]', file=file)
+    file.flush()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+'''
+Pipeline telemetry
+
+Counters, timings and gauges for each stage of the acquisition pipeline:
+
+    scan_serial (reader thread)   serial_bytes, serial_samples, serial_junk_bytes
+    Session.poll (GUI tick)       tick (duration), tick_rows, ring_depth
+    HDF5Writer (writer thread)    hdf5_flush (duration), hdf5_rows, hdf5_file_bytes
+    LiveDataView                  draw (duration)
+
+Each name is updated from a single thread, so no lock is needed; reports read
+the values from another thread and may be off by one update.
+
+`report()` summarizes activity since the previous report (rates, mean and max
+durations) for logging and display; `attrs()` summarizes the whole session for
+saving.
+'''
+
+
+import time
+
+
+class Telemetry:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Clear all values, eg at start of session'''
+        self.counters = {}      # name: total
+        self.timings = {}       # name: [count, total (s), max (s), max since report (s)]
+        self.gauges = {}        # name: [value, max, max since report]
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.last_counters = {}
+        self.last_timings = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timing(self, name, seconds):
+        stats = self.timings.get(name)
+        if stats is None:
+            stats = self.timings[name] = [0, 0., 0., 0.]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        stats[3] = max(stats[3], seconds)
+
+    def gauge(self, name, value):
+        stats = self.gauges.get(name)
+        if stats is None:
+            stats = self.gauges[name] = [value, value, value]
+        stats[0] = value
+        stats[1] = max(stats[1], value)
+        stats[2] = max(stats[2], value)
+
+    def report(self):
+        '''Activity since last report
+        Returns dict of name: (rate per s) for counters, (count, mean (s), max
+        (s)) for timings, and (value, max) for gauges.
+        '''
+
+        now = time.monotonic()
+        dt = max(now - self.last_report, 1e-9)
+        self.last_report = now
+
+        stats = {}
+        for name, total in list(self.counters.items()):
+            stats[name] = (total - self.last_counters.get(name, 0)) / dt
+            self.last_counters[name] = total
+        for name, timing in list(self.timings.items()):
+            count, total = timing[:2]
+            last_count, last_total = self.last_timings.get(name, (0, 0.))
+            n = count - last_count
+            stats[name] = (n, (total - last_total) / n if n else 0., timing[3])
+            self.last_timings[name] = (count, total)
+            timing[3] = 0.
+        for name, gauge in list(self.gauges.items()):
+            stats[name] = (gauge[0], gauge[2])
+            gauge[2] = gauge[0]
+        return stats
+
+    def format(self, stats=None, sep='\n'):
+        '''Readable summary of `report()`'''
+
+        stats = self.report() if stats is None else stats
+        lines = []
+        for name, value in stats.items():
+            if name in self.timings:
+                n, mean, peak = value
+                lines.append(f'{name}: {mean * 1000:.2f} ms (max {peak * 1000:.2f}), {n}x')
+            elif name in self.gauges:
+                lines.append(f'{name}: {value[0]:.0f} (max {value[1]:.0f})')
+            else:
+                lines.append(f'{name}: {value:.0f}/s')
+        return sep.join(lines)
+
+    def attrs(self):
+        '''Session totals, for saving'''
+
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        attrs = {}
+        for name, total in self.counters.items():
+            attrs[f'telemetry_{name}'] = total
+            attrs[f'telemetry_{name}_per_s'] = total / elapsed
+        for name, (count, total, peak, _) in self.timings.items():
+            attrs[f'telemetry_{name}_n'] = count
+            attrs[f'telemetry_{name}_mean_ms'] = total / count * 1000 if count else 0.
+            attrs[f'telemetry_{name}_max_ms'] = peak * 1000
+        for name, (value, peak, _) in self.gauges.items():
+            attrs[f'telemetry_{name}_max'] = peak
+        return attrs
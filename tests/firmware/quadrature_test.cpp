@@ -0,0 +1,103 @@
+/*
+Replay synthetic encoder edge sequences through QuadUpdate (quadrature.h)
+
+Prints each failed check and exits nonzero if any failed.
+*/
+
+#include <stdio.h>
+#include "quadrature.h"
+
+#define CHECK(cond) if (!(cond)) { printf("%s:%d: failed: %s\n", __FILE__, __LINE__, #cond); failed++; }
+
+// States (A | B << 1) in forward order: (A, B) = 01, 11, 10, 00
+const uint8_t forward[4] = {2, 3, 1, 0};
+
+int failed = 0;
+
+
+void Replay(const uint8_t* states, int n, uint8_t* state, volatile int* count, volatile int* errors) {
+  for (int i = 0; i < n; i++) QuadUpdate(states[i], state, count, errors);
+}
+
+
+void TestForward() {
+  uint8_t state = forward[0];
+  volatile int count = 0, errors = 0;
+  for (int i = 1; i <= 400; i++) QuadUpdate(forward[i % 4], &state, &count, &errors);
+  CHECK(count == 400);
+  CHECK(errors == 0);
+}
+
+
+void TestReverse() {
+  uint8_t state = forward[0];
+  volatile int count = 0, errors = 0;
+  for (int i = 399; i >= 0; i--) QuadUpdate(forward[i % 4], &state, &count, &errors);
+  CHECK(count == -400);
+  CHECK(errors == 0);
+}
+
+
+void TestBounce() {
+  // Contact bounce on one channel moves back and forth, netting zero
+  uint8_t state = 2;
+  volatile int count = 0, errors = 0;
+  const uint8_t bounce[] = {3, 2, 3, 2, 3, 2, 3};
+  Replay(bounce, sizeof(bounce), &state, &count, &errors);
+  CHECK(count == 1);
+  CHECK(errors == 0);
+
+  // Same state again (eg interrupt from other pin's glitch) doesn't move
+  QuadUpdate(3, &state, &count, &errors);
+  CHECK(count == 1);
+  CHECK(errors == 0);
+}
+
+
+void TestDoubleChange() {
+  // Both channels changed at once: an edge was missed
+  uint8_t state = 2;
+  volatile int count = 0, errors = 0;
+  const uint8_t missed[] = {3, 0, 2, 1};   // 3 -> 0 skips 1, 2 -> 1 skips 3
+  Replay(missed, sizeof(missed), &state, &count, &errors);
+  CHECK(count == 2);                       // 2 -> 3 and 0 -> 2 forward; skips don't count
+  CHECK(errors == 2);
+
+  // Every illegal transition in table counts as error
+  for (uint8_t from = 0; from < 4; from++) {
+    uint8_t to = from ^ 0b11;
+    state = from;
+    count = errors = 0;
+    QuadUpdate(to, &state, &count, &errors);
+    CHECK(count == 0);
+    CHECK(errors == 1);
+    CHECK(state == to);
+  }
+
+  // Error count saturates instead of wrapping
+  state = 0;
+  count = 0;
+  errors = 32767;
+  QuadUpdate(3, &state, &count, &errors);
+  CHECK(errors == 32767);
+}
+
+
+void TestMatches1x() {
+  // A rising with B high counts +1, same direction as 1x mode
+  uint8_t state = 2;                        // A low, B high
+  volatile int count = 0, errors = 0;
+  QuadUpdate(3, &state, &count, &errors);   // A rises
+  CHECK(count == 1);
+}
+
+
+int main() {
+  TestForward();
+  TestReverse();
+  TestBounce();
+  TestDoubleChange();
+  TestMatches1x();
+  if (!failed) printf("ok\n");
+  return failed ? 1 : 0;
+}
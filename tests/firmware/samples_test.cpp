@@ -0,0 +1,123 @@
+/*
+Check sample buffering, encoding and counter snapshot (samples.h)
+
+Prints each failed check and exits nonzero if any failed.
+*/
+
+#include <stdio.h>
+#include <string.h>
+#include "samples.h"
+
+#define CHECK(cond) if (!(cond)) { printf("%s:%d: failed: %s\n", __FILE__, __LINE__, #cond); failed++; }
+
+int failed = 0;
+
+
+void TestBufferOverflow() {
+  SampleBuffer buffer = {};
+  // Holds one less than its size
+  for (int i = 0; i < SAMPLEBUFSIZE - 1; i++) CHECK(BufferPush(&buffer, 7, i, i));
+  CHECK(BufferCount(&buffer) == SAMPLEBUFSIZE - 1);
+  CHECK(buffer.dropped == 0);
+
+  CHECK(!BufferPush(&buffer, 7, 100, 100));
+  CHECK(!BufferPush(&buffer, 7, 101, 101));
+  CHECK(buffer.dropped == 2);
+  CHECK(BufferCount(&buffer) == SAMPLEBUFSIZE - 1);
+  // Buffered samples aren't overwritten
+  CHECK(buffer.samples[(buffer.head - 1) & (SAMPLEBUFSIZE - 1)].ts == SAMPLEBUFSIZE - 2);
+
+  // Dropped count saturates instead of wrapping
+  buffer.dropped = 65535;
+  BufferPush(&buffer, 7, 102, 102);
+  CHECK(buffer.dropped == 65535);
+
+  // Room again once samples are sent
+  byte out[FRAMESIZE];
+  CHECK(EncodePacket(&buffer, true, out, FRAMESIZE) == FRAMESIZE);
+  CHECK(BufferPush(&buffer, 7, 103, 103));
+}
+
+
+void TestBinaryPacket() {
+  SampleBuffer buffer = {};
+  for (int i = 0; i < 10; i++) BufferPush(&buffer, 7, 0x01020304 + i, -1000 + i);
+
+  // Only whole frames that fit are taken, oldest first
+  byte out[64];
+  int n = EncodePacket(&buffer, true, out, 64);
+  CHECK(n == 7 * FRAMESIZE);
+  CHECK(BufferCount(&buffer) == 3);
+  for (int i = 0; i < 7; i++) {
+    const byte* frame = out + i * FRAMESIZE;
+    uint32_t ts;
+    int16_t value;
+    memcpy(&ts, frame + 2, 4);
+    memcpy(&value, frame + 6, 2);
+    CHECK(frame[0] == FRAMESYNC);
+    CHECK(frame[1] == 7);
+    CHECK(ts == (uint32_t)(0x01020304 + i));
+    CHECK(value == -1000 + i);
+    byte checksum = 0;
+    for (int j = 1; j < FRAMESIZE - 1; j++) checksum ^= frame[j];
+    CHECK(frame[FRAMESIZE - 1] == checksum);
+  }
+  // Little-endian on the wire
+  CHECK(out[2] == 0x04 && out[5] == 0x01);
+
+  // Nothing taken if no frame fits
+  CHECK(EncodePacket(&buffer, true, out, FRAMESIZE - 1) == 0);
+  CHECK(BufferCount(&buffer) == 3);
+  CHECK(EncodePacket(&buffer, true, out, 64) == 3 * FRAMESIZE);
+  CHECK(BufferCount(&buffer) == 0);
+  CHECK(EncodePacket(&buffer, true, out, 64) == 0);
+}
+
+
+void TestAsciiPacket() {
+  byte line[LINESIZE + 1];
+  int n = EncodeSample(7, 1234, -5, false, line);
+  CHECK(n == (int)strlen("7,1234,-5\r\n"));
+  CHECK(memcmp(line, "7,1234,-5\r\n", n) == 0);
+
+  // Longest sample fits in LINESIZE
+  n = EncodeSample(255, 4294967295UL, -32768, false, line);
+  CHECK(n == (int)strlen("255,4294967295,-32768\r\n"));
+  CHECK(n <= LINESIZE);
+  CHECK(memcmp(line, "255,4294967295,-32768\r\n", n) == 0);
+
+  // Packet of lines stops at last whole line that fits
+  SampleBuffer buffer = {};
+  BufferPush(&buffer, 7, 10, 1);
+  BufferPush(&buffer, 7, 20, -2);
+  BufferPush(&buffer, 9, 30, 300);
+  byte out[64];
+  n = EncodePacket(&buffer, false, out, 16);   // Second line (9 bytes) doesn't fit after first (8)
+  CHECK(n == 8);
+  CHECK(memcmp(out, "7,10,1\r\n", n) == 0);
+  CHECK(BufferCount(&buffer) == 2);
+  n = EncodePacket(&buffer, false, out, 64);
+  CHECK(n == (int)strlen("7,20,-2\r\n9,30,300\r\n"));
+  CHECK(memcmp(out, "7,20,-2\r\n9,30,300\r\n", n) == 0);
+}
+
+
+void TestTakeCount() {
+  volatile int counter = 42;
+  CHECK(TakeCount(&counter) == 42);
+  CHECK(counter == 0);
+  CHECK(TakeCount(&counter) == 0);
+  counter = -7;
+  CHECK(TakeCount(&counter) == -7);
+  CHECK(counter == 0);
+}
+
+
+int main() {
+  TestBufferOverflow();
+  TestBinaryPacket();
+  TestAsciiPacket();
+  TestTakeCount();
+  if (!failed) printf("ok\n");
+  return failed ? 1 : 0;
+}
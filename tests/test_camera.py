@@ -0,0 +1,91 @@
+'''
+Camera strobe timestamps: unwrapping and recording through a session
+
+The session test records a 1 min session from `emulator.py` over TCP at
+1000 fps, passing the 2^15 wrap of the frame index. It takes about 10 s,
+limited by how fast the emulator generates frames.
+'''
+
+
+import os
+import subprocess
+import sys
+import time
+import h5py
+import numpy as np
+import pytest
+import acquisition
+import channels
+import protocol
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_unwrapper_synthetic():
+    # Increasing (us, frame) counters cut into batches at arbitrary points
+    us = np.arange(0, 3 * protocol.camera_ts_max, 2**20 + 12345, dtype=np.int64)
+    frame = np.arange(len(us), dtype=np.int64) * 7
+    wrapped = np.column_stack([us % protocol.camera_ts_max, frame % protocol.camera_index_max])
+    unwrapper = channels.Unwrapper((protocol.camera_ts_max, protocol.camera_index_max))
+
+    rng = np.random.default_rng(0)
+    cuts = np.sort(rng.choice(np.arange(1, len(us)), 20, replace=False))
+    batches = np.split(wrapped, cuts) + [wrapped[:0]]
+    unwrapped = np.concatenate([unwrapper(batch) for batch in batches])
+    assert np.array_equal(unwrapped, np.column_stack([us, frame]))
+
+
+def test_unwrapper_single_rows():
+    unwrapper = channels.Unwrapper((None, 16))
+    values = [unwrapper([[ts, ts % 16]])[0].tolist() for ts in range(40)]
+    assert values == [[ts, ts] for ts in range(40)]
+
+
+@pytest.fixture
+def emulator_port():
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'emulator.py'), '--tcp', '--once', '--speed', '100', '--seed', '1'],
+        stdout=subprocess.PIPE, text=True
+    )
+    line = process.stdout.readline()
+    assert line.startswith('Emulated Arduino on'), line
+    yield line.split()[-1]
+    process.kill()
+    process.wait()
+
+
+def test_session_camera_frames(emulator_port, tmp_path):
+    camera_fps = 1000       # Passes 2^15 frames in 33 s
+    values = {
+        'emulate_wheel': 0,
+        'session_dur': 1,
+        'record_zeros': 1,
+        'track_period': 50,
+        'binary_frames': 1,
+        'baudrate': 250000,
+        'camera_fps': camera_fps,
+        'send_period': 10,
+        'decode_mode': 1,
+    }
+    parameters = {name: values[name] for name in protocol.parameter_names}
+    session = acquisition.Session(parameters, sync_interval=0, telemetry_interval=0)
+    session.connect(emulator_port)
+    filename = str(tmp_path / 'camera.h5')
+    session.start(hdf5_filename=filename, subject='test')
+    timeout = time.monotonic() + 30
+    while not session.finished and time.monotonic() < timeout:
+        time.sleep(0.05)
+        session.poll()
+    session.close()
+    assert session.finished
+    assert session.finalize() is None
+
+    with h5py.File(filename, 'r') as hdf5_file:
+        camera = hdf5_file[f'{session.hdf5_grp_name}/behavior/camera'][()]
+    us, frame = camera[:, 0], camera[:, 1]
+    assert frame.max() > protocol.camera_index_max
+    assert np.array_equal(frame, np.arange(frame[0], frame[0] + len(frame)))
+    assert np.all(np.diff(us) > 0)
+    # Frame interval matches strobe rate
+    assert np.median(np.diff(us)) == pytest.approx(1e6 / camera_fps, rel=0.01)
@@ -0,0 +1,41 @@
+'''
+Host-compiled tests of firmware headers in track_wheel
+
+Each driver in `firmware/` includes headers from track_wheel, replays
+synthetic input, and exits nonzero if a check fails. Skipped without g++.
+'''
+
+
+import os
+import shutil
+import subprocess
+import pytest
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+compiler = shutil.which('g++')
+
+
+def run_driver(name, tmp_path):
+    '''Compile and run driver `firmware/<name>.cpp`; returns its output'''
+
+    if compiler is None:
+        pytest.skip('g++ not found')
+    source = os.path.join(root, 'tests', 'firmware', f'{name}.cpp')
+    binary = str(tmp_path / name)
+    build = subprocess.run(
+        [compiler, '-std=c++11', '-Wall', '-Werror', '-I', os.path.join(root, 'track_wheel'), source, '-o', binary],
+        capture_output=True, text=True
+    )
+    assert build.returncode == 0, build.stderr
+    result = subprocess.run([binary], capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def test_quadrature(tmp_path):
+    assert 'ok' in run_driver('quadrature_test', tmp_path)
+
+
+def test_samples(tmp_path):
+    assert 'ok' in run_driver('samples_test', tmp_path)
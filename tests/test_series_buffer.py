@@ -0,0 +1,34 @@
+'''
+Min/max decimation keeps history older than raw buffer when bins change
+'''
+
+
+import numpy as np
+from series_buffer import SeriesBuffer, MinMaxDecimator
+
+
+def test_rebin_keeps_history():
+    rng = np.random.default_rng(0)
+    x = np.arange(200000.)
+    y = rng.normal(size=len(x))
+    xy = np.column_stack([x, y])
+
+    buffer = SeriesBuffer(65536)
+    decimator = MinMaxDecimator(100)
+    for chunk in np.array_split(xy, 37):
+        buffer.append(chunk)
+        decimator.append(chunk)
+    assert buffer.view()[0, 0] > 0        # Raw buffer has lost oldest points
+
+    rebinned = decimator.rebin(400, buffer.view())
+    points = rebinned.window(-1)
+    assert points[0, 0] < 400
+    assert np.all(np.diff(points[:, 0]) >= 0)
+
+    # New bins hold whole old bins, so min and max per bin are exact
+    expected = xy[:, 1].reshape(-1, 400)
+    bin_ids = (points[:, 0] // 400).astype(int)
+    assert np.array_equal(np.unique(bin_ids), np.arange(len(expected)))
+    starts = np.flatnonzero(np.r_[True, np.diff(bin_ids) > 0])
+    assert np.array_equal(np.minimum.reduceat(points[:, 1], starts), expected.min(axis=1))
+    assert np.array_equal(np.maximum.reduceat(points[:, 1], starts), expected.max(axis=1))
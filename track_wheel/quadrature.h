@@ -0,0 +1,45 @@
+/*
+Quadrature decoding of rotary encoder
+
+In 4x mode the encoder interrupt runs on both edges of both channels and
+reads A and B together from the port register. The change in position comes
+from a lookup table indexed by the previous and current state of (A, B), so
+each edge costs one table read. A transition where both channels changed
+means an edge was missed (eg interrupt latency at high speed); it doesn't move
+the count and is counted as an error instead.
+
+States are A | B << 1. Going forward, (A, B) steps 01 -> 11 -> 10 -> 00, so A
+rises while B is high, the same direction counted as +1 in 1x mode.
+
+Nothing here touches hardware, so it can be compiled on the host.
+*/
+
+#ifndef QUADRATURE_H
+#define QUADRATURE_H
+
+#include <stdint.h>
+
+#define QUADILLEGAL 2       // Table entry for transitions with both channels changed
+
+// Change in count, indexed by previous state << 2 | current state
+const int8_t quad_table[16] = {
+   0, -1,  1, QUADILLEGAL,
+   1,  0, QUADILLEGAL, -1,
+  -1, QUADILLEGAL,  0,  1,
+  QUADILLEGAL,  1, -1,  0,
+};
+
+
+inline void QuadUpdate(uint8_t ab, uint8_t* state, volatile int* count, volatile int* errors) {
+  // Update count from current state `ab` of channels (A | B << 1)
+  int8_t step = quad_table[(*state << 2) | ab];
+  *state = ab;
+  if (step == QUADILLEGAL) {
+    if (*errors < 32767) (*errors)++;
+  }
+  else {
+    *count += step;
+  }
+}
+
+#endif
@@ -0,0 +1,116 @@
+/*
+Samples buffered on board and encoded for serial
+
+Samples are queued in `SampleBuffer` when they are taken and sent later in
+packets (`EncodePacket`), so many samples go out in one `Serial.write()`.
+`TakeCount()` reads and clears a counter updated by an interrupt with
+interrupts disabled, so no counts are lost between the read and the reset.
+
+Nothing here touches hardware, so it can be compiled on the host: without
+ARDUINO defined, `byte` and the interrupt functions are stubbed.
+
+Binary frame (little-endian):
+  [sync (1), code (1), ts (4), value (2), checksum (1)]
+Checksum is XOR of code, ts, and value bytes. ASCII samples are sent as
+"code,ts,value\r\n". Keep in sync with protocol.py.
+*/
+
+#ifndef SAMPLES_H
+#define SAMPLES_H
+
+#ifdef ARDUINO
+#include <Arduino.h>
+#else
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+typedef uint8_t byte;
+inline void noInterrupts() {}
+inline void interrupts() {}
+#endif
+
+#define FRAMESYNC 0xA5        // First byte of binary frame
+#define FRAMESIZE 9           // Size of binary frame (bytes)
+#define LINESIZE 24           // Max size of ASCII sample (bytes)
+#define SAMPLEBUFSIZE 32      // Samples buffered (power of 2; holds one less)
+
+
+struct Sample {
+  byte code;
+  uint32_t ts;
+  int16_t value;
+};
+
+
+struct SampleBuffer {
+  Sample samples[SAMPLEBUFSIZE];
+  byte head;                  // Next slot written
+  byte tail;                  // Next slot sent
+  unsigned int dropped;       // Samples not buffered because buffer was full
+};
+
+
+inline byte BufferCount(const SampleBuffer* buffer) {
+  return (buffer->head - buffer->tail) & (SAMPLEBUFSIZE - 1);
+}
+
+
+inline bool BufferPush(SampleBuffer* buffer, byte code, uint32_t ts, int16_t value) {
+  // Queue sample; count it as dropped if buffer is full
+  byte next = (buffer->head + 1) & (SAMPLEBUFSIZE - 1);
+  if (next == buffer->tail) {
+    if (buffer->dropped < 65535) buffer->dropped++;
+    return false;
+  }
+  Sample* sample = &buffer->samples[buffer->head];
+  sample->code = code;
+  sample->ts = ts;
+  sample->value = value;
+  buffer->head = next;
+  return true;
+}
+
+
+inline int EncodeSample(byte code, uint32_t ts, int16_t value, bool binary, byte* out) {
+  // Write sample to `out` (at least LINESIZE + 1 bytes); returns bytes used
+  if (binary) {
+    out[0] = FRAMESYNC;
+    out[1] = code;
+    memcpy(out + 2, &ts, 4);
+    memcpy(out + 6, &value, 2);
+    byte checksum = 0;
+    for (int i = 1; i < FRAMESIZE - 1; i++) checksum ^= out[i];
+    out[FRAMESIZE - 1] = checksum;
+    return FRAMESIZE;
+  }
+  return snprintf((char*)out, LINESIZE + 1, "%u,%lu,%d\r\n", code, (unsigned long)ts, (int)value);
+}
+
+
+inline int EncodePacket(SampleBuffer* buffer, bool binary, byte* out, int size) {
+  // Move oldest buffered samples that fit in `size` bytes to `out`
+  // Returns bytes used
+  byte sample_bytes[LINESIZE + 1];
+  int n = 0;
+  while (buffer->tail != buffer->head) {
+    const Sample* sample = &buffer->samples[buffer->tail];
+    int len = EncodeSample(sample->code, sample->ts, sample->value, binary, sample_bytes);
+    if (n + len > size) break;
+    memcpy(out + n, sample_bytes, len);
+    n += len;
+    buffer->tail = (buffer->tail + 1) & (SAMPLEBUFSIZE - 1);
+  }
+  return n;
+}
+
+
+inline int TakeCount(volatile int* counter) {
+  // Read and reset counter shared with interrupt, as one step
+  noInterrupts();
+  int count = *counter;
+  *counter = 0;
+  interrupts();
+  return count;
+}
+
+#endif
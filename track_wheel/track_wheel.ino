@@ -9,26 +9,66 @@ Data from hardware is routed directly back via serial connection to Python
 GUI as "triplet" for recording and calculations.
 
 Example input:
-D1,1,0,50,271828
+D1,1,0,50,1,115200,0,10,1,271828
+
+Samples are sent either as comma-separated ASCII lines or as binary frames
+(see samples.h), depending on the `binary_frames` parameter.
+
+Wheel samples are queued on board and sent every `send_period` ms (or when
+the queue is half full), several per packet. Encoder counts are taken from the
+interrupt counter atomically, so none are lost between samples.
+
+Encoder decoding (`decode_mode`): 1 counts rising edges of A (1x); 4 counts
+every edge of A and B (4x resolution, see quadrature.h) and reports missed
+edges with `code_encoder_error` (value: errors since last sample).
+
+Serial starts at BAUDRATE. Once parameters are processed, it switches to the
+`baudrate` parameter (if different). Samples are never allowed to block: if
+the transmit buffer is full, sample is dropped and counted, and the count is
+reported with `code_dropped` when there is room again.
+
+Camera frames: if `camera_fps` is set, rising edges of the camera strobe on
+`pin_strobe` are timestamped in a pin change interrupt with micros() and kept
+in a small buffer. Interrupt registers are looked up from `pin_strobe` in
+setup(), so any pin with a pin change interrupt can be used. Buffered frames are sent as `code_camera` samples
+(ts: us since session start, value: frame index mod 2^15) once CAMBATCH are
+waiting or CAMFLUSHMS after the last batch, as many as fit in the transmit
+buffer; the rest wait for the next pass. Frames strobed while the buffer is
+full are lost, which shows as a gap in the frame index.
 
 */
 
 
+#include "samples.h"
+#include "quadrature.h"
+
 #define CODEEND 48
 #define CODEPARAMSEND 271828
 #define CODEPARAMS 68
 #define CODESTART 69
 #define CODEPARAMERR 70
-#define DELIM ","         // Delimiter used for serial outputs
+#define CODEIDENT 63      // '?', reply with FIRMWARE
+#define CODEPING 80       // 'P', reply with code_sync sample
+#define FIRMWARE "track_wheel"
+#define PACKETSIZE 64     // Max bytes per write (size of transmit buffer)
+#define BAUDRATE 9600     // Baud rate until parameters are processed
+#define CAMBUFSIZE 32     // Camera frames buffered (power of 2)
+#define CAMBATCH 8        // Camera frames sent together
+#define CAMFLUSHMS 10     // Max time between batches (ms)
 
 // Pins
 const int pin_track_a = 2;
 const int pin_track_b = 3;
 const int pin_cam = 4;
+const int pin_strobe = 8;   // Camera strobe (exposure) output; needs pin change interrupt
 
 // Output codes
 const int code_end = 0;
 const int code_move = 7;
+const int code_sync = 8;
+const int code_dropped = 9;
+const int code_camera = 5;
+const int code_encoder_error = 10;
 
 // Variables via serial
 // unsigned long sessionDur;
@@ -36,25 +76,153 @@ unsigned long session_dur;
 bool rec_zeros;
 bool emulate_wheel;
 unsigned long track_period;
+bool binary_frames;
+unsigned long baudrate;
+unsigned int camera_fps;
+unsigned long send_period;
+byte decode_mode;
 
 // Other variables
 volatile int track_change = 0;   // Rotations within tracking epochs
+volatile int encoder_errors = 0; // Illegal encoder transitions within tracking epochs
+byte encoder_state;              // Last state of encoder channels (A | B << 1)
+// Input registers and bit masks of encoder pins, looked up in setup() so
+// interrupts read pins directly on any board
+volatile uint8_t* track_a_port;
+volatile uint8_t* track_b_port;
+uint8_t track_a_mask;
+uint8_t track_b_mask;
+unsigned int dropped = 0;        // Samples dropped since last report
+SampleBuffer sample_buffer;      // Wheel samples waiting to be sent
+unsigned long start;             // Session start (ms)
+unsigned long start_us;          // Session start (us)
+
+// Camera frames, written by ISR and read by loop
+volatile unsigned long frame_us[CAMBUFSIZE];
+volatile unsigned int frame_index[CAMBUFSIZE];
+volatile byte frame_head = 0;         // Next slot written by ISR
+volatile byte frame_tail = 0;         // Next slot sent by loop
+volatile unsigned int frame_count = 0;    // Frames strobed since start
+volatile uint8_t* strobe_port;        // Input register and bit mask of strobe pin
+uint8_t strobe_mask;
+volatile uint8_t* strobe_pcicr;       // Pin change interrupt control register of strobe pin (0 if none)
+uint8_t strobe_pcie;
+
+
+byte EncoderState() {
+  // Current state of encoder channels (A | B << 1)
+  return ((*track_a_port & track_a_mask) ? 0b01 : 0) | ((*track_b_port & track_b_mask) ? 0b10 : 0);
+}
 
 
 void TrackMovement() {
-  // Track changes in rotary encoder via interrupt
-  if (digitalRead(pin_track_b)) track_change++;
+  // Track changes in rotary encoder via interrupt (1x, rising edge of A)
+  if (*track_b_port & track_b_mask) track_change++;
   else track_change--;
 }
 
 
+void TrackQuadrature() {
+  // Track changes in rotary encoder via interrupt (4x, any edge of A or B)
+  QuadUpdate(EncoderState(), &encoder_state, &track_change, &encoder_errors);
+}
+
+
+#ifndef PCICR
+#error "Camera strobe needs pin change interrupts (PCICR)"
+#endif
+
+
+void StrobeChange() {
+  // Timestamp rising edge of camera strobe
+  if (!(*strobe_port & strobe_mask)) return;
+  unsigned long now = micros();
+  frame_count++;
+  byte next = (frame_head + 1) & (CAMBUFSIZE - 1);
+  if (next == frame_tail) return;     // Buffer full; frame is lost
+  frame_us[frame_head] = now;
+  frame_index[frame_head] = frame_count;
+  frame_head = next;
+}
+
+
+// Only strobe pin is enabled in its PCMSK, so whichever group it is in, only
+// it triggers interrupt
+#ifdef PCINT0_vect
+ISR(PCINT0_vect) { StrobeChange(); }
+#endif
+#ifdef PCINT1_vect
+ISR(PCINT1_vect) { StrobeChange(); }
+#endif
+#ifdef PCINT2_vect
+ISR(PCINT2_vect) { StrobeChange(); }
+#endif
+#ifdef PCINT3_vect
+ISR(PCINT3_vect) { StrobeChange(); }
+#endif
+
+
+void WriteSample(byte code, unsigned long ts, int value) {
+  // Send sample to host as "triplet" (see samples.h)
+  byte sample_bytes[LINESIZE + 1];
+  Serial.write(sample_bytes, EncodeSample(code, ts, value, binary_frames, sample_bytes));
+}
+
+
+void ReportDropped(unsigned long ts) {
+  // Report dropped samples if there is room for report and a sample
+  int sample_size = binary_frames ? FRAMESIZE : LINESIZE;
+  dropped = min((unsigned long)dropped + sample_buffer.dropped, 65535UL);
+  sample_buffer.dropped = 0;
+  if (dropped && Serial.availableForWrite() >= 2 * sample_size) {
+    int n = min(dropped, 32767);
+    WriteSample(code_dropped, ts, n);
+    dropped -= n;
+  }
+}
+
+
+void SendSamples(unsigned long ts, bool block) {
+  // Send buffered wheel samples in packets
+  // Without `block`, only samples that fit in transmit buffer are sent
+  byte packet[PACKETSIZE];
+  ReportDropped(ts);
+  while (BufferCount(&sample_buffer)) {
+    int room = block ? PACKETSIZE : min(Serial.availableForWrite(), PACKETSIZE);
+    int n = EncodePacket(&sample_buffer, binary_frames, packet, room);
+    if (!n) break;
+    Serial.write(packet, n);
+  }
+}
+
+
+byte FramesWaiting() {
+  return (frame_head - frame_tail) & (CAMBUFSIZE - 1);
+}
+
+
+void SendFrames(bool block) {
+  // Send buffered camera frames
+  // Without `block`, only frames that fit in transmit buffer are sent
+  int sample_size = binary_frames ? FRAMESIZE : LINESIZE;
+  while (frame_tail != frame_head) {
+    if (!block && Serial.availableForWrite() < sample_size) break;
+    // Slot at tail isn't written by ISR until tail moves on
+    WriteSample(code_camera, frame_us[frame_tail] - start_us, frame_index[frame_tail] & 0x7FFF);
+    frame_tail = (frame_tail + 1) & (CAMBUFSIZE - 1);
+  }
+}
+
+
 void EndSession(unsigned long ts) {
-  // Send "end" signal
-  Serial.print(code_end);
-  Serial.print(DELIM);
-  Serial.print(ts);
-  Serial.print(DELIM);
-  Serial.println("0");
+  // Send remaining frames and report dropped samples, then send "end" signal
+  // Blocks until sent; nothing is sent after
+  if (strobe_pcicr) *strobe_pcicr &= ~_BV(strobe_pcie);
+  SendSamples(ts, true);
+  SendFrames(true);
+  dropped = min((unsigned long)dropped + sample_buffer.dropped, 65535UL);
+  if (dropped) WriteSample(code_dropped, ts, min(dropped, 32767));
+  WriteSample(code_end, ts, 0);
 
   digitalWrite(pin_cam, LOW);
 
@@ -64,7 +232,7 @@ void EndSession(unsigned long ts) {
 
 // Retrieve parameters from serial
 int GetParams() {
-  const int param_num = 5;
+  const int param_num = 10;
   unsigned long parameters[param_num];
   unsigned long last_num;
 
@@ -76,7 +244,12 @@ int GetParams() {
   session_dur = parameters[1] * 1000 * 60;
   rec_zeros = parameters[2];
   track_period = parameters[3];
-  last_num = parameters[4];
+  binary_frames = parameters[4];
+  baudrate = parameters[5];
+  camera_fps = parameters[6];
+  send_period = parameters[7];
+  decode_mode = parameters[8];
+  last_num = parameters[9];
   
   if (last_num != CODEPARAMSEND) return 1;
   else return 0;
@@ -103,6 +276,9 @@ void LookForSignal(int waiting_for, unsigned long ts) {
         case CODESTART:
           if (waiting_for == 2) return;   // Start session
           break;
+        case CODEIDENT:
+          Serial.println(FIRMWARE);       // Identify firmware to host
+          break;
         }
     }
 
@@ -112,13 +288,20 @@ void LookForSignal(int waiting_for, unsigned long ts) {
 
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(BAUDRATE);
   randomSeed(analogRead(0));
 
   // Set pins
   pinMode(pin_track_a, INPUT);
   pinMode(pin_track_b, INPUT);
   pinMode(pin_cam, OUTPUT);
+  pinMode(pin_strobe, INPUT);
+  track_a_port = portInputRegister(digitalPinToPort(pin_track_a));
+  track_b_port = portInputRegister(digitalPinToPort(pin_track_b));
+  track_a_mask = digitalPinToBitMask(pin_track_a);
+  track_b_mask = digitalPinToBitMask(pin_track_b);
+  strobe_port = portInputRegister(digitalPinToPort(pin_strobe));
+  strobe_mask = digitalPinToBitMask(pin_strobe);
 
   // Wait for parameters
   int exit_code;
@@ -143,6 +326,17 @@ void setup() {
   else {
     Serial.println("no emulation");
   }
+  if (binary_frames) {
+    Serial.println("Sending binary frames");
+  }
+
+  // Change baud rate; host changes when it receives message
+  if (baudrate && baudrate != BAUDRATE) {
+    Serial.println("Switching baud rate");
+    Serial.flush();
+    Serial.begin(baudrate);
+    delay(100);   // Give host time to change
+  }
 
   // Wait for start signal
   Serial.println("Waiting for start signal ('E')");
@@ -150,9 +344,30 @@ void setup() {
   Serial.println("Session started");
   digitalWrite(pin_cam, HIGH);
 
-  // Set interrupt
+  // Set interrupts
   // Do not set earlier as TrackMovement() will be called before session starts.
-  attachInterrupt(digitalPinToInterrupt(pin_track_a), TrackMovement, RISING);
+  start = millis();
+  start_us = micros();
+  if (decode_mode == 4) {
+    encoder_state = EncoderState();
+    attachInterrupt(digitalPinToInterrupt(pin_track_a), TrackQuadrature, CHANGE);
+    attachInterrupt(digitalPinToInterrupt(pin_track_b), TrackQuadrature, CHANGE);
+  }
+  else {
+    attachInterrupt(digitalPinToInterrupt(pin_track_a), TrackMovement, RISING);
+  }
+  if (camera_fps) {
+    if (digitalPinToPCICR(pin_strobe)) {
+      strobe_pcie = digitalPinToPCICRbit(pin_strobe);
+      *digitalPinToPCMSK(pin_strobe) |= _BV(digitalPinToPCMSKbit(pin_strobe));
+      PCIFR = _BV(strobe_pcie);     // Clear edges from before start (PCIFR bits match PCICR)
+      strobe_pcicr = digitalPinToPCICR(pin_strobe);
+      *strobe_pcicr |= _BV(strobe_pcie);
+    }
+    else {
+      Serial.println("No pin change interrupt on camera strobe pin");
+    }
+  }
 }
 
 
@@ -160,9 +375,10 @@ void loop() {
 
   // Variables
   static unsigned long ts_next_track = track_period;  // Timer used for motion tracking and conveyor movement
+  static unsigned long ts_frames = 0;                 // Last time camera frames were sent
+  static unsigned long ts_samples = 0;                // Last time wheel samples were sent
 
   // Timestamp
-  static const unsigned long start = millis();        // Record start of session
   unsigned long ts = millis() - start;                // Update current timestamp
 
 
@@ -174,6 +390,10 @@ void loop() {
       case CODEEND:
         EndSession(ts);
         break;
+      case CODEPING:
+        // Reply right away for clock alignment (see clock_sync.py)
+        WriteSample(code_sync, millis() - start, 0);
+        break;
     }
   }
 
@@ -184,27 +404,35 @@ void loop() {
 
   // -- 2. TRACK MOVEMENT -- //
   if (ts >= ts_next_track) {
+    int change = TakeCount(&track_change);
+    int errors = TakeCount(&encoder_errors);
+    if (errors) BufferPush(&sample_buffer, code_encoder_error, ts, errors);
     if (emulate_wheel){
       if (rec_zeros || random(10) == 0) {
-        Serial.print(code_move);
-        Serial.print(DELIM);
-        Serial.print(ts);
-        Serial.print(DELIM);
-        Serial.println(random(1, 25));
+        BufferPush(&sample_buffer, code_move, ts, random(1, 25));
       } 
     }
     else {
-      if (rec_zeros || track_change != 0) {
-          Serial.print(code_move);
-          Serial.print(DELIM);
-          Serial.print(ts);
-          Serial.print(DELIM);
-          Serial.println(track_change);
+      if (rec_zeros || change != 0) {
+          BufferPush(&sample_buffer, code_move, ts, change);
       }
     }
-    track_change = 0;
     
     // Increment ts_next_track for next track stamp
     ts_next_track = ts_next_track + track_period;
   }
+
+  // -- 3. SEND SAMPLES -- //
+  byte buffered = BufferCount(&sample_buffer);
+  if (buffered && (ts - ts_samples >= send_period || buffered >= SAMPLEBUFSIZE / 2)) {
+    SendSamples(ts, false);
+    ts_samples = ts;
+  }
+
+  // -- 4. CAMERA FRAMES -- //
+  byte waiting = FramesWaiting();
+  if (waiting >= CAMBATCH || (waiting && ts - ts_frames >= CAMFLUSHMS)) {
+    SendFrames(false);
+    ts_frames = ts;
+  }
 }
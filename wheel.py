@@ -13,8 +13,16 @@ Arduino when this happens.
 3. Set meta data for experiment and saved file location.
 4. Start experiment!
 
+Plotting (matplotlib) and HDF5 (h5py) modules are slow to import, so they are
+loaded in the background after the window is first drawn. Run with
+`--profile-startup` to print time taken by each import and startup step.
 '''
 
+import sys
+import startup_profile
+if __name__ == '__main__' and '--profile-startup' in sys.argv:
+    startup_profile.install()
+
 import argparse
 import tkinter as tk
 import tkinter.ttk as ttk
@@ -22,29 +30,14 @@ import tkinter.font as tkFont
 import tkinter.messagebox as tkMessageBox
 import tkinter.filedialog as tkFileDialog
 from tkinter.scrolledtext import ScrolledText
-from PIL import ImageTk
-import serial
-import serial.tools.list_ports
 import threading
-from queue import Queue
-import time
 from datetime import datetime, timedelta
 import os
-import sys
-import h5py
-import numpy as np
-import matplotlib
-from matplotlib.figure import Figure
 import arduino
-import live_data_view
-import pdb
-
-matplotlib.use('TKAgg')
+import channels
+import protocol
 
 
-# Header to print with Arduino outputs
-arduino_head = '  [a]: '
-
 # Formatting
 entry_width = 10
 ew = 10  # Width of Entry UI
@@ -53,14 +46,8 @@ py = 5
 px1 = 5
 py1 = 2
 
-# Serial input codes
-code_end = 0
-code_wheel = 7
-
-# Arduino code to save-file variable
-arduino_events = {
-    code_wheel: 'wheel'
-}
+# Export formats (see `export.formats`)
+export_formats = ['csv', 'npy', 'parquet']
 
 # Events to count
 # counter_ev =[]
@@ -70,12 +57,17 @@ source_path = os.path.dirname(sys.argv[0])
 
 class Main(tk.Frame):
 
-    def __init__(self, parent, verbose=False, emulate_wheel=False, print_arduino=False):
+    def __init__(self, parent, verbose=False, emulate_wheel=False, print_arduino=False, flush_interval=1, flush_rows=10000, swmr=False, export_format='csv', ports=[], baudrate=115200, camera_fps=0,
+                 include_bridges=False):
         self.parent = parent
         parent.columnconfigure(0, weight=1)
         # parent.rowconfigure(1, weight=1)
 
         self.verbose = verbose
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.swmr = swmr
+        self.export_format = export_format
 
         self.var_cache_size = tk.IntVar()
         self.var_sess_dur = tk.IntVar()
@@ -83,6 +75,11 @@ class Main(tk.Frame):
         self.var_emulate_wheel = tk.IntVar()
         self.var_track_per = tk.IntVar()
         self.var_save_txt = tk.BooleanVar()
+        self.var_binary_frames = tk.IntVar()
+        self.var_baudrate = tk.IntVar()
+        self.var_camera_fps = tk.IntVar()
+        self.var_send_period = tk.IntVar()
+        self.var_decode_mode = tk.IntVar()
 
         self.var_cache_size.set(500)
         self.var_sess_dur.set(1)
@@ -90,12 +87,23 @@ class Main(tk.Frame):
         self.var_emulate_wheel.set(emulate_wheel)
         self.var_track_per.set(50)
         self.var_save_txt.set(True)
+        self.var_binary_frames.set(1)
+        self.var_baudrate.set(baudrate)
+        self.var_camera_fps.set(camera_fps)
+        self.var_send_period.set(10)
+        self.var_decode_mode.set(1)
 
+        # IMPORTANT: keep in same order as `GetParams()` in track_wheel.ino
         self.parameters = {
             'emulate_wheel': self.var_emulate_wheel,
             'session_dur': self.var_sess_dur,
             'record_zeros': self.var_rec_zeros,
             'track_period': self.var_track_per,
+            'binary_frames': self.var_binary_frames,
+            'baudrate': self.var_baudrate,      # Set in Arduino settings
+            'camera_fps': self.var_camera_fps,
+            'send_period': self.var_send_period,
+            'decode_mode': self.var_decode_mode,
         }
 
         self.var_print_arduino = tk.BooleanVar()
@@ -104,14 +112,15 @@ class Main(tk.Frame):
         self.var_print_arduino.set(print_arduino)
         self.var_stop.set(False)
 
-        # Counters
-        # IMPORTANT: need to keep `counter_vars` in same order as `arduino_events`
-        self.var_counter_wheel = tk.IntVar()
-        counter_vars = [self.var_counter_wheel]
-        self.counter = {ev: var_count for ev, var_count in zip(arduino_events.values(), counter_vars)}
+        # Counters, one per channel (see `channels`)
+        # Counts are kept by session and pushed to Tk once per refresh
+        self.counter_vars = {channel.name: tk.IntVar() for channel in channels.registry}
 
         self.var_start_time = tk.StringVar()
         self.var_stop_time = tk.StringVar()
+        self.var_latency = tk.StringVar()
+        self.var_stats = tk.StringVar()
+        self.window_stats = None
 
         # Lay out GUI
 
@@ -180,14 +189,29 @@ class Main(tk.Frame):
         ### UI for miscellaneous parameters
         self.entry_rec_all = ttk.Checkbutton(frame_misc, variable=self.var_rec_zeros)
         self.entry_track_period = ttk.Entry(frame_misc, textvariable=self.var_track_per, width=entry_width)
+        self.entry_binary_frames = ttk.Checkbutton(frame_misc, variable=self.var_binary_frames)
+        self.entry_camera_fps = ttk.Entry(frame_misc, textvariable=self.var_camera_fps, width=entry_width)
+        self.entry_send_period = ttk.Entry(frame_misc, textvariable=self.var_send_period, width=entry_width)
+        self.entry_decode_mode = ttk.Combobox(frame_misc, textvariable=self.var_decode_mode, values=protocol.decode_modes, width=entry_width)
         tk.Label(frame_misc, text='Record zeros: ', anchor='e').grid(row=0, column=0, sticky='e')
         tk.Label(frame_misc, text='Track period (ms): ', anchor='e').grid(row=1, column=0, sticky='e')
+        tk.Label(frame_misc, text='Binary frames: ', anchor='e').grid(row=2, column=0, sticky='e')
+        tk.Label(frame_misc, text='Camera fps (0 off): ', anchor='e').grid(row=3, column=0, sticky='e')
+        tk.Label(frame_misc, text='Send period (ms): ', anchor='e').grid(row=4, column=0, sticky='e')
+        tk.Label(frame_misc, text='Encoder decoding (x): ', anchor='e').grid(row=5, column=0, sticky='e')
         self.entry_rec_all.grid(row=0, column=1, sticky='w')
         self.entry_track_period.grid(row=1, column=1, sticky='w')
+        self.entry_binary_frames.grid(row=2, column=1, sticky='w')
+        self.entry_camera_fps.grid(row=3, column=1, sticky='w')
+        self.entry_send_period.grid(row=4, column=1, sticky='w')
+        self.entry_decode_mode.grid(row=5, column=1, sticky='w')
 
         ### frame_arduino
         ### UI for Arduino
-        self.arduino = arduino.Arduino(frame_arduino, main_window=self.parent, verbose=self.verbose, params=self.parameters)
+        self.arduino = arduino.Arduino(
+            frame_arduino, main_window=self.parent, verbose=self.verbose, params=self.parameters, extra_ports=ports,
+            include_bridges=include_bridges
+        )
         self.arduino.grid(row=0, column=0, sticky='we')
         self.arduino.var_uploaded.trace_add('write', self.gui_util)
 
@@ -210,7 +234,7 @@ class Main(tk.Frame):
         self.button_set_file.grid(row=1, column=1, sticky='e')
 
         folder_icon_file = os.path.join(source_path, 'graphics/folder.png')
-        icon_folder = ImageTk.PhotoImage(file=folder_icon_file)
+        icon_folder = tk.PhotoImage(file=folder_icon_file)
         self.button_set_file.config(image=icon_folder)
         self.button_set_file.image = icon_folder
         
@@ -227,16 +251,17 @@ class Main(tk.Frame):
         self.entry_stop_time = ttk.Entry(frame_counter, textvariable=self.var_stop_time, state='readonly', width=entry_width)
         self.entry_start_time.grid(row=0, column=1, sticky='wens')
         self.entry_stop_time.grid(row=1, column=1, sticky='wens')
+        tk.Label(frame_counter, text='Latency p50/p99 (ms): ').grid(row=2, column=0, sticky='e')
+        self.entry_latency = ttk.Entry(frame_counter, textvariable=self.var_latency, state='readonly', width=entry_width)
+        self.entry_latency.grid(row=2, column=1, sticky='wens')
+        ttk.Button(frame_counter, text='Pipeline stats', command=self.show_stats).grid(row=3, column=1, sticky='we')
 
         ## Live frame
-        data_types = {
-            arduino_events[code_wheel]: 'line'
-        }
-        # tk.Label(frame_live, text='Also under construction').grid()
-        self.live_view = live_data_view.LiveDataView(
-            frame_live, x_history=30000, scale_x=0.001,
-            data_types=data_types, ylim=(-25, 50), xlabel='Time (s)'
-        )
+        # Created once plotting modules are loaded (see `load_modules`)
+        self.frame_live = frame_live
+        self.live_view = None
+        self.label_live = tk.Label(frame_live, text='Loading plot...')
+        self.label_live.grid(row=0, column=0)
         
         ###### GUI OBJECTS ORGANIZED BY TIME ACTIVE ######
         # List of components to disable at open
@@ -269,10 +294,40 @@ class Main(tk.Frame):
         self.button_stop['state'] = 'disabled'
 
         ###### SESSION VARIABLES ######
-        self.q_serial = Queue()
+        self.session = None
 
         # self.update_serial()
 
+        # Load slow modules once window is drawn
+        startup_profile.mark('GUI created')
+        self.parent.after_idle(self.load_modules)
+
+    def load_modules(self):
+        '''Import plotting and HDF5 modules in background
+        Live view is created when done.
+        '''
+
+        startup_profile.mark('First paint')
+        thread = threading.Thread(target=preload_modules, name='preload', daemon=True)
+        thread.start()
+        self.parent.after(20, self.create_live_view, thread)
+
+    def create_live_view(self, thread=None):
+        if thread is not None and thread.is_alive():
+            self.parent.after(20, self.create_live_view, thread)
+            return
+        if self.live_view is not None: return
+
+        import live_data_view
+        self.label_live.destroy()
+        self.live_view = live_data_view.LiveDataView(
+            self.frame_live, x_history=30000, scale_x=0.001,
+            data_types={channel.name: channel.plot for channel in channels.registry if channel.plot},
+            decimate='minmax', ylim=(-25, 50), xlabel='Time (s)'
+        )
+        startup_profile.mark('Live view created')
+        startup_profile.report()
+
     def get_save_file(self):
         ''' Opens prompt for file for data to be saved
         Runs when button beside save file is pressed.
@@ -314,6 +369,8 @@ class Main(tk.Frame):
                 obj['state'] = 'disable' if new_state == 'normal' else 'normal'
     
     def start(self, code_start='E'):
+        import acquisition
+
         self.gui_util('start')
 
         now = datetime.now()
@@ -344,92 +401,47 @@ class Main(tk.Frame):
         else:
             self.hdf5_filename = self.entry_save_file.get()
 
-        # Try to open/create file
-        try:
-            # Create file if it doesn't already exist, append otherwise ('a' parameter)
-            with h5py.File(self.hdf5_filename, 'a') as _:
-                pass
-        except IOError:
-            tkMessageBox.showerror('File error', 'Could not create file to save data.')
-            self.gui_util('stop')
-            return
-
-        # Prepare HDF5 file
-        with h5py.File(self.hdf5_filename, 'a') as hdf5_file:
-            # Create group for experiment
-            # Append to existing file (if applicable). If group already exists, append number to name.
-            date = str(now.date())
-            subj = self.entry_subject.get() or '?'
-            index = 0
-            file_index = ''
-            while True:
-                try:
-                    hdf5_grp_exp = hdf5_file.create_group(f'{subj}/{date + file_index}')
-                except (RuntimeError, ValueError):
-                    index += 1
-                    file_index = '-' + str(index)
-                else:
-                    break
-            self.hdf5_grp_name = f'{subj}/{date + file_index}'
-            hdf5_grp_exp['weight'] = int(self.entry_weight.get()) if self.entry_weight.get() else 0
-
-            # *** Create file structure ***
-            self.cache_size = self.var_cache_size.get()
-            nstepframes = 2 * 60000 * self.var_sess_dur.get() / self.var_track_per.get()
-            chunk_size = (self.cache_size, 2)
-
-            hdf5_grp_behav = hdf5_grp_exp.create_group('behavior')
-            hdf5_grp_behav.create_dataset(name='wheel', dtype='int32', shape=(int(nstepframes) * 1.1, 2), chunks=chunk_size)
-            
-            # Store session parameters into behavior group
-            for key, value in self.parameters.items():
-                hdf5_grp_behav.attrs[key] = value.get()
-
-        # Create cache
-        self.cache = {
-            'wheel': np.zeros((self.cache_size, 2)),
-        }
+        # Create session
+        parameters = {key: value.get() for key, value in self.parameters.items()}
+        self.session = acquisition.Session(
+            parameters, cache_size=self.var_cache_size.get(),
+            flush_interval=self.flush_interval, flush_rows=self.flush_rows, swmr=self.swmr,
+            print_arduino=self.var_print_arduino.get(), verbose=self.verbose
+        )
 
         # Reset counters and clear data
-        for counter in self.counter.values(): counter.set(0)
+        for counter in self.counter_vars.values(): counter.set(0)
+        self.var_latency.set('')
+        self.var_stats.set('')
+        self.n_updates = 0
+        self.create_live_view()
         self.live_view.clear_data()
-
-        # Clear Queues
-        for q in [self.q_serial]:
-            with q.mutex:
-                q.queue.clear()
-
-        # Create thread to scan serial
-        suppress = [
-            # code_wheel if self.var_suppress_print_movement.get() else None
-        ]
-        thread_scan = threading.Thread(
-            target=scan_serial,
-            args=(
-                self.q_serial, self.arduino.ser, self.var_print_arduino.get(),
-                suppress, code_end
-            )
-        )
-        thread_scan.daemon = True    # Don't remember why this is here
+        self.live_view.telemetry = self.session.telemetry
 
         # Start session
-        self.arduino.ser.flushInput()                                   # Remove data from serial input
-        self.arduino.ser.write(code_start.encode())
-        thread_scan.start()
+        # Create file if it doesn't already exist, append otherwise
+        try:
+            self.session.start(
+                self.arduino.ser, self.hdf5_filename,
+                subject=self.entry_subject.get() or '?',
+                weight=int(self.entry_weight.get()) if self.entry_weight.get() else 0,
+                code_start=code_start
+            )
+        except IOError:
+            tkMessageBox.showerror('File error', 'Could not create file to save data.')
+            self.gui_util('stop')
+            return
 
-        self.start_time = datetime.now()
-        end_time = self.start_time + timedelta(minutes=self.var_sess_dur.get())
-        self.var_start_time.set(self.start_time.strftime('%H:%M:%S'))
+        start_time = self.session.start_time
+        end_time = start_time + timedelta(minutes=self.var_sess_dur.get())
+        self.var_start_time.set(start_time.strftime('%H:%M:%S'))
         self.var_stop_time.set(end_time.strftime('%H:%M:%S'))
-        print('Session start {}'.format(self.start_time))
 
         # Update GUI
         self.update_session()
 
     def update_session(self):
-        # Checks Queue for incoming data from arduino. Data arrives as comma-
-        # separated values with the first element ('code') defining the type of
-        # data.
+        # Checks session for incoming data from arduino and updates GUI.
 
         # Rate to update GUI
         # Should be faster than data coming in, ie tracking rate
@@ -438,48 +450,49 @@ class Main(tk.Frame):
         # End on 'Stop' button (by user)
         if self.var_stop.get():
             self.var_stop.set(False)
-            self.arduino.ser.write('0'.encode())
-            print('User triggered stop, sending signal to Arduino...')
-
-        # Watch incoming queue
-        # Data has format: [code, ts, extra values]
-        # Empty queue before leaving. Otherwise, a backlog will grow.
-        while not self.q_serial.empty():
-            code, ts, data = self.q_serial.get()
-            # print(code, ts, data)
-
-            # End session
-            if code == code_end:
-                arduino_end = ts
-                print('Arduino ended, finalizing data...')
-                self.stop_session(arduino_end=arduino_end)
-                return
-
-            # Record data to cache
-            event_var = arduino_events[code]
-            event_n = self.counter[arduino_events[code]].get()
-            cache_n = event_n % self.cache_size
-            self.cache[event_var][cache_n, :] = [ts, data]
-            self.counter[event_var].set(event_n + 1)
-
-            # Record data to HDF5 when cache fills
-            if cache_n >= self.cache_size - 1:
-                with h5py.File(self.hdf5_filename, 'a') as hdf5_file:
-                    cache_slice = slice(event_n - cache_n, event_n + 1)
-                    dataset = hdf5_file[f'{self.hdf5_grp_name}/behavior/{event_var}']
-                    dataset[cache_slice, :] = self.cache[event_var]
-                self.cache[event_var][:] = 0
-
-            # Update live view
-            if code == code_wheel:
-                self.live_view.update_view(
-                    [ts, data],
-                    name=arduino_events[code_wheel]
-                )
+            print('User triggered stop')
+            self.session.stop()
+
+        new = self.session.poll()
+
+        # Update live view
+        for name, rows in new.items():
+            if name in self.live_view.buffers:
+                self.live_view.update_view_many(rows[:, :2], name=name)
+
+        for ev, counter in self.counter_vars.items():
+            counter.set(self.session.counter[ev])
+
+        # Update latency and pipeline stats about once a second
+        self.n_updates += 1
+        if self.n_updates * refresh_rate >= 1000:
+            self.n_updates = 0
+            p50, p99 = self.session.latency.live()
+            self.var_latency.set(f'{p50:.1f}/{p99:.1f}' if p50 is not None else '')
+            self.var_stats.set(self.session.telemetry.format(self.session.stats))
+
+        # End session
+        if self.session.finished:
+            print('Arduino ended, finalizing data...')
+            self.stop_session()
+            return
 
         self.parent.after(refresh_rate, self.update_session)
 
-    def stop_session(self, frame_cutoff=None, arduino_end=None):
+    def show_stats(self):
+        '''Open window with pipeline telemetry (see `telemetry`)'''
+
+        if self.window_stats is not None and self.window_stats.winfo_exists():
+            self.window_stats.lift()
+            return
+        self.window_stats = tk.Toplevel(self.parent)
+        self.window_stats.title('Pipeline stats')
+        tk.Label(
+            self.window_stats, textvariable=self.var_stats, justify='left', anchor='nw',
+            font='TkFixedFont', width=48, height=14
+        ).grid(row=0, column=0, padx=10, pady=10)
+
+    def stop_session(self, frame_cutoff=None):
         '''Finalize session
         Closes hardware connections and saves HDF5 data file. Resets GUI.
         '''
@@ -491,54 +504,19 @@ class Main(tk.Frame):
 
         # Finalize data
         print('Finalizing behavioral data')
-        with h5py.File(self.hdf5_filename, 'a') as hdf5_file:
-            # Write remainder of cache
-            hdf5_grp_behav = hdf5_file[f'{self.hdf5_grp_name}/behavior']
-            hdf5_grp_behav.attrs['start_time'] = self.start_time.strftime('%H:%M:%S')
-            hdf5_grp_behav.attrs['end_time'] = end_time
-            hdf5_grp_behav.attrs['arduino_end'] = arduino_end
-            for ev in arduino_events.values():
-                event_n = self.counter[ev].get()
-                cache_n = event_n % self.cache_size
-                cache_slice = slice(event_n - cache_n, event_n)  # No `+ 1`????????
-                dataset = hdf5_grp_behav[ev]
-                # pdb.set_trace()
-                dataset[cache_slice, :] = self.cache[ev][:cache_n, :]
-                dataset.resize((event_n, 2))
-
-            # Write notes
-            hdf5_file[self.hdf5_grp_name].attrs['notes'] = \
-                self.scrolled_notes.get(1.0, 'end')
-
-        # Create csv files if indicated
+        error = self.session.finalize(notes=self.scrolled_notes.get(1.0, 'end'), end_time=end_time)
+        if error:
+            tkMessageBox.showerror('File error', f'Error saving data: {error}')
+
+        # Create csv (or other export format) files if indicated
+        # Runs in background so GUI isn't held up by long sessions
         if self.var_save_txt.get():
             filename_base = os.path.splitext(self.entry_save_file.get())[0]
-
-            with h5py.File(self.hdf5_filename, 'r') as hdf5_file:
-                hdf5_grp_behav = hdf5_file[f'{self.hdf5_grp_name}/behavior']
-                
-                # Save attributes
-                subj = self.entry_subject.get() or '?'
-                wt = hdf5_file[f"{self.hdf5_grp_name}/weight"].value
-                notes = hdf5_file[self.hdf5_grp_name].attrs['notes']
-                with open(f"{filename_base}-attributes.csv", 'w') as file:
-                    file.write(f"subject,{subj}\n")
-                    file.write(f"weight,{wt}\n")
-                    for k, v in hdf5_grp_behav.attrs.items():
-                        file.write(f"{k},{v}\n")
-                    file.write(f"notes:\n{notes}")
-
-                # Save datasets
-                for ev in arduino_events.values():
-                    np.savetxt(
-                        f"{filename_base}-{ev}.csv",
-                        hdf5_grp_behav[ev],
-                        delimiter=','
-                    )
-            os.remove(self.hdf5_filename)
-
-        # Clear self.parameters
-        self.parameters = {}
+            thread_export = threading.Thread(
+                target=export_and_remove,
+                args=(self.hdf5_filename, self.session.hdf5_grp_name, filename_base, self.export_format, self.verbose)
+            )
+            thread_export.start()
 
         # Clear GUI
         self.entry_subject.delete(0, 'end')
@@ -547,34 +525,28 @@ class Main(tk.Frame):
         self.scrolled_notes.delete('1.0', 'end')
 
         print('All done!')
-        pdb.set_trace()
 
 
-def scan_serial(q_serial, ser, print_arduino=False, suppress=[], code_end=0):
-    '''Check serial for data
-    Continually check serial connection for data sent from Arduino. Send data 
-    through Queue to communicate with main GUI. Stop when `code_end` is 
-    received from serial.
-    '''
+def preload_modules():
+    '''Import modules that are slow to load'''
+    import acquisition
+    import export
+    import live_data_view
 
-    if print_arduino: print('  Scanning Arduino outputs.')
-    while 1:
-        input_arduino = ser.readline().decode()
-        if not input_arduino: continue
 
-        try:
-            input_split = [int(x) for x in input_arduino.split(',')]
-        except ValueError:
-            # If not all comma-separated values are int castable
-            if print_arduino: sys.stdout.write(arduino_head + input_arduino)
-        else:
-            if print_arduino and input_split[0] not in suppress:
-                # Only print from serial if code is not in list of codes to suppress
-                sys.stdout.write(arduino_head + input_arduino)
-            if input_arduino: q_serial.put(input_split)
-            if input_split[0] == code_end:
-                if print_arduino: print('  Scan complete.')
-                return
+def export_and_remove(hdf5_filename, session, filename_base, fmt='csv', verbose=False):
+    '''Export session from HDF5 file, then delete HDF5 file'''
+
+    import export
+
+    print(f'Exporting data to {filename_base}-*')
+    try:
+        export.export_session(hdf5_filename, session, filename_base, fmt, verbose=verbose)
+    except Exception as err:
+        print(f'Error exporting data, keeping {hdf5_filename}: {err}')
+    else:
+        os.remove(hdf5_filename)
+        print('Export complete')
 
 
 def main():
@@ -582,15 +554,30 @@ def main():
     parser.add_argument('--verbose', action='store_true')
     parser.add_argument('--emulate-wheel', action='store_true')
     parser.add_argument('--print-arduino', action='store_true')
+    parser.add_argument('--flush-interval', type=float, default=1, help='Max seconds between HDF5 flushes')
+    parser.add_argument('--flush-rows', type=int, default=10000, help='Max rows written between HDF5 flushes')
+    parser.add_argument('--swmr', action='store_true', help='Allow other processes to read HDF5 file while recording')
+    parser.add_argument('--port', action='append', default=[], help='Additional port or pyserial URL to list (eg emulator)')
+    parser.add_argument('--baudrate', type=int, default=115200, choices=protocol.baudrates, help='Baud rate after parameters are uploaded')
+    parser.add_argument('--camera-fps', type=int, default=0, help='Record camera strobe on pin 8, expected frame rate (0 to disable)')
+    parser.add_argument('--include-bridges', action='store_true',
+                        help='Also check generic USB-serial chips (FTDI, CP210x, CH340) for wheel firmware')
+    parser.add_argument('--export-format', choices=export_formats, default='csv', help='Format of exported data when not saving as HDF5')
+    parser.add_argument('--profile-startup', action='store_true', help='Print time taken by imports and startup steps')
     args = parser.parse_args()
 
     # GUI
+    startup_profile.mark('Arguments parsed')
     root = tk.Tk()
     root.wm_title('Wheel')
     Main(
         root,
         verbose=args.verbose,
-        emulate_wheel=args.emulate_wheel, print_arduino=args.print_arduino
+        emulate_wheel=args.emulate_wheel, print_arduino=args.print_arduino,
+        flush_interval=args.flush_interval, flush_rows=args.flush_rows,
+        swmr=args.swmr, export_format=args.export_format,
+        ports=args.port, baudrate=args.baudrate, camera_fps=args.camera_fps,
+        include_bridges=args.include_bridges
     )
     root.grid()
     root.mainloop()